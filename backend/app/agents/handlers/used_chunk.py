@@ -4,8 +4,7 @@ from contextvars import ContextVar
 from pprint import pprint
 from typing import Any, Dict, Generator, List, Optional
 
-from app.repositories.models.conversation import ChunkModel
-from app.vector_search import SearchResult, filter_used_results, get_source_link
+from app.vector_search import SearchResult, filter_used_results, to_chunk_models
 from langchain_core.callbacks.base import BaseCallbackHandler
 
 
@@ -27,18 +26,10 @@ class UsedChunkCallbackHandler(BaseCallbackHandler):
             if search_results is None or len(search_results) == 0:
                 return
 
-            self.used_chunks = []
             generated_text: str = output.get("output")  # type: ignore
-            for r in filter_used_results(generated_text, search_results):
-                content_type, source_link = get_source_link(r.source)
-                self.used_chunks.append(
-                    ChunkModel(
-                        content=r.content,
-                        content_type=content_type,
-                        source=source_link,
-                        rank=r.rank,
-                    )
-                )
+            self.used_chunks = to_chunk_models(
+                filter_used_results(generated_text, search_results)
+            )
         else:
             raise ValueError(f"Invalid output type: {type(output)}")
 
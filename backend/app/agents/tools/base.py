@@ -25,7 +25,7 @@ class BaseTool(LangChainBaseTool):
                 {
                     "name": name,
                     "description": field.field_info.description,
-                    "type": field.type_,
+                    "type": field.outer_type_,
                     "is_required": field.required,
                 }
             )
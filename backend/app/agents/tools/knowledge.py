@@ -3,7 +3,11 @@ from typing import Any, Dict, List, Optional, Type
 
 from app.agents.tools.base import BaseTool
 from app.repositories.models.custom_bot import BotModel
-from app.vector_search import SearchResult, search_related_docs
+from app.vector_search import (
+    SearchResult,
+    search_related_docs,
+    search_related_docs_many,
+)
 from langchain_core.callbacks import CallbackManagerForToolRun
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.prompts import PromptTemplate
@@ -104,6 +108,10 @@ dummy_search_results = [
 
 class AnswerWithKnowledgeInput(BaseModel):
     query: str = Field(description="User's original question string.")
+    related_queries: List[str] = Field(
+        default=[],
+        description="Optional rephrasings or sub-questions of the question, which are searched together with it.",
+    )
 
 
 class AnswerWithKnowledgeTool(BaseTool):
@@ -126,17 +134,33 @@ class AnswerWithKnowledgeTool(BaseTool):
         return values
 
     def _run(
-        self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None
+        self,
+        query: str,
+        related_queries: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
     ) -> dict:
-        logger.info(f"Running AnswerWithKnowledgeTool with query: {query}")
+        logger.info(
+            f"Running AnswerWithKnowledgeTool with query: {query}, related queries: {related_queries}"
+        )
         if self.bot.id == "dummy":
             # For testing purpose
             search_results = dummy_search_results
+        elif related_queries:
+            # All queries are searched by a single round trip to the vector store.
+            search_results = search_related_docs_many(
+                self.bot.id,
+                [query, *related_queries],
+                limit=self.bot.search_params.max_results,
+                search_params=self.bot.search_params,
+                vector_snapshot=self.bot.vector_snapshot,
+            )
         else:
             search_results = search_related_docs(
                 self.bot.id,
                 limit=self.bot.search_params.max_results,
                 query=query,
+                search_params=self.bot.search_params,
+                vector_snapshot=self.bot.vector_snapshot,
             )
 
         context_prompt = self._format_search_results(search_results)
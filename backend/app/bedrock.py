@@ -1,14 +1,22 @@
+import hashlib
 import json
 import logging
 import os
+import re
+import unicodedata
 
+import boto3
 from anthropic import AnthropicBedrock
+from app.cache import TTLCache
 from app.config import BEDROCK_PRICING, DEFAULT_EMBEDDING_CONFIG
 from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CONFIG
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG
+from app.repositories import codec
+from app.repositories.image import resolve_image_body
 from app.repositories.models.conversation import MessageModel
 from app.repositories.models.custom_bot import GenerationParamsModel
 from app.utils import get_bedrock_client, is_anthropic_model
+from botocore.exceptions import ClientError
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
@@ -21,8 +29,24 @@ DEFAULT_GENERATION_CONFIG = (
     else DEFAULT_CLAUDE_GENERATION_CONFIG
 )
 
+# Query embeddings are deterministic, so they are cached without expiry.
+QUERY_EMBEDDING_CACHE_MAX_SIZE = int(
+    os.environ.get("QUERY_EMBEDDING_CACHE_MAX_SIZE", 512)
+)
+# Optional S3 bucket to share query embeddings between Lambda instances. Deployed by CDK
+# with a lifecycle rule, so that objects are expired.
+QUERY_EMBEDDING_CACHE_BUCKET = os.environ.get("QUERY_EMBEDDING_CACHE_BUCKET", "")
+# Max number of texts embedded by a single request of Cohere.
+QUERY_EMBEDDING_BATCH_SIZE = 96
+
 client = get_bedrock_client()
 anthropic_client = AnthropicBedrock()
+s3_client = boto3.client("s3")
+
+# (model id, normalized query) -> embedding
+query_embedding_cache: TTLCache[tuple[str, str], list[float]] = TTLCache(
+    maxsize=QUERY_EMBEDDING_CACHE_MAX_SIZE
+)
 
 
 class InvocationMetrics(BaseModel):
@@ -123,7 +147,7 @@ def compose_args_for_anthropic_client(
                             "source": {
                                 "type": "base64",
                                 "media_type": c.media_type,
-                                "data": c.body,
+                                "data": resolve_image_body(c.body),
                             },
                         }
                     )
@@ -193,23 +217,94 @@ def get_model_id(model: str) -> str:
         raise NotImplementedError()
 
 
+def normalize_query(query: str) -> str:
+    """Normalize the query so that trivially different texts share the same embedding."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip()
+
+
+def _compose_query_embedding_key(model_id: str, query: str) -> str:
+    digest = hashlib.sha256(query.encode("utf-8")).hexdigest()
+    return f"query_embeddings/{model_id}/{digest}"
+
+
+def _find_shared_query_embedding(model_id: str, query: str) -> list[float] | None:
+    try:
+        response = s3_client.get_object(
+            Bucket=QUERY_EMBEDDING_CACHE_BUCKET,
+            Key=_compose_query_embedding_key(model_id, query),
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            logger.warning(f"Failed to read shared query embedding: {e}")
+        return None
+    return codec.decode(response["Body"].read())
+
+
+def _store_shared_query_embedding(model_id: str, query: str, embedding: list[float]):
+    try:
+        s3_client.put_object(
+            Bucket=QUERY_EMBEDDING_CACHE_BUCKET,
+            Key=_compose_query_embedding_key(model_id, query),
+            Body=codec.encode(embedding),
+        )
+    except ClientError as e:
+        # The cache is best effort
+        logger.warning(f"Failed to store shared query embedding: {e}")
+
+
 def calculate_query_embedding(question: str) -> list[float]:
+    """Calculate the embedding of the search query.
+    Embeddings are cached in process by the model id and the normalized query, and also
+    in S3 if `QUERY_EMBEDDING_CACHE_BUCKET` is set.
+    """
+    return calculate_query_embeddings([question])[0]
+
+
+def calculate_query_embeddings(questions: list[str]) -> list[list[float]]:
+    """Calculate the embeddings of the search queries in the same order.
+    Queries missing from the cache are embedded together, by a single request unless
+    there are more than `QUERY_EMBEDDING_BATCH_SIZE` of them.
+    """
     model_id = DEFAULT_EMBEDDING_CONFIG["model_id"]
 
     # Currently only supports "cohere.embed-multilingual-v3"
     assert model_id == "cohere.embed-multilingual-v3"
 
-    payload = json.dumps({"texts": [question], "input_type": "search_query"})
-    accept = "application/json"
-    content_type = "application/json"
+    queries = [normalize_query(question) for question in questions]
+    embeddings: dict[str, list[float]] = {}
+    for query in dict.fromkeys(queries):
+        cache_key = (model_id, query)
+        embedding = query_embedding_cache.get(cache_key)
+        if embedding is None and QUERY_EMBEDDING_CACHE_BUCKET:
+            embedding = _find_shared_query_embedding(model_id, query)
+            if embedding is not None:
+                query_embedding_cache.set(cache_key, embedding)
+        if embedding is not None:
+            embeddings[query] = embedding
+
+    missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+    for i in range(0, len(missing), QUERY_EMBEDDING_BATCH_SIZE):
+        batch = missing[i : i + QUERY_EMBEDDING_BATCH_SIZE]
+        payload = json.dumps({"texts": batch, "input_type": "search_query"})
+        accept = "application/json"
+        content_type = "application/json"
 
-    response = client.invoke_model(
-        accept=accept, contentType=content_type, body=payload, modelId=model_id
-    )
-    output = json.loads(response.get("body").read())
-    embedding = output.get("embeddings")[0]
+        response = client.invoke_model(
+            accept=accept, contentType=content_type, body=payload, modelId=model_id
+        )
+        output = json.loads(response.get("body").read())
+
+        for query, embedding in zip(batch, output.get("embeddings")):
+            embeddings[query] = embedding
+            query_embedding_cache.set((model_id, query), embedding)
+            if QUERY_EMBEDDING_CACHE_BUCKET:
+                _store_shared_query_embedding(model_id, query, embedding)
 
-    return embedding
+    logger.info(
+        f"Query embedding cache {'miss' if missing else 'hit'}: "
+        f"{query_embedding_cache.stats()}"
+    )
+    return [embeddings[query] for query in queries]
 
 
 def calculate_document_embeddings(documents: list[str]) -> list[list[float]]:
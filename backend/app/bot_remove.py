@@ -1,15 +1,13 @@
-import json
 import os
-from typing import Any
 
 import boto3
-import pg8000
+from app.postgres import connection_pool
 from app.repositories.apigateway import delete_api_key, find_usage_plan_by_id
 from app.repositories.cloudformation import delete_stack_by_bot_id, find_stack_by_bot_id
 from app.repositories.common import RecordNotFoundError, decompose_bot_id
-from aws_lambda_powertools.utilities import parameters
+from app.vector_stores.in_process import delete_snapshot, is_enabled
+from app.vector_stores.postgres import drop_bot_index
 
-DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
 DOCUMENT_BUCKET = os.environ.get("DOCUMENT_BUCKET", "documents")
 
 s3_client = boto3.client("s3")
@@ -17,30 +15,27 @@ s3_client = boto3.client("s3")
 
 def delete_from_postgres(bot_id: str):
     """Delete data related to `bot_id` from vector store (i.e. PostgreSQL)."""
-
-    secrets: Any = parameters.get_secret(DB_SECRETS_ARN)  # type: ignore
-    db_info = json.loads(secrets)
-
-    conn = pg8000.connect(
-        database=db_info["dbname"],
-        host=db_info["host"],
-        port=db_info["port"],
-        user=db_info["username"],
-        password=db_info["password"],
-    )
-
     try:
-        with conn.cursor() as cursor:
+        with connection_pool.connection() as conn, conn.cursor() as cursor:
             delete_query = "DELETE FROM items WHERE botid = %s"
             cursor.execute(delete_query, (bot_id,))
-        conn.commit()
+        drop_bot_index(bot_id)
         print(f"Successfully deleted records for bot_id: {bot_id}")
     except Exception as e:
-        conn.rollback()
         print(f"Error deleting records for bot_id: {bot_id}")
         print(e)
-    finally:
-        conn.close()
+
+
+def delete_vector_snapshot(bot_id: str):
+    """Delete the snapshot of the in-process vector store for `bot_id`."""
+    if not is_enabled():
+        return
+    try:
+        delete_snapshot(bot_id)
+        print(f"Successfully deleted vector snapshot for bot_id: {bot_id}")
+    except Exception as e:
+        print(f"Error deleting vector snapshot for bot_id: {bot_id}")
+        print(e)
 
 
 def delete_from_s3(user_id: str, bot_id: str):
@@ -71,6 +66,7 @@ def handler(event, context):
     This function is triggered by dynamodb stream when item is deleted.
     Following resources are deleted asynchronously when bot is deleted:
     - vector store record (postgres)
+    - vector snapshot (in-process vector store)
     - s3 files
     - cloudformation stack (if exists)
     """
@@ -91,6 +87,7 @@ def handler(event, context):
     bot_id = decompose_bot_id(sk)
 
     delete_from_postgres(bot_id)
+    delete_vector_snapshot(bot_id)
     delete_from_s3(user_id, bot_id)
 
     # Check if cloudformation stack exists
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[K, V]):
+    """In-process LRU cache with per-entry expiry.
+    Intended to keep expensive objects (credentials, clients, lookups) alive across
+    warm Lambda invocations. Entries are evicted in least-recently-used order once
+    `maxsize` is exceeded, and are treated as missing after their deadline.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float | None = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        # key -> (expire_at, value). `expire_at` is None when the entry never expires.
+        self._data: OrderedDict[K, tuple[float | None, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expire_at, value = entry  # type: ignore
+            if expire_at is not None and expire_at <= self._timer():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        """Store the value. `ttl` overrides the default time to live of the cache."""
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = None if ttl is None else self._timer() + ttl
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)  # type: ignore
+            if entry is _MISSING:
+                return False
+            expire_at, _ = entry  # type: ignore
+            return expire_at is None or expire_at > self._timer()
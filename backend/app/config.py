@@ -49,6 +49,15 @@ DEFAULT_EMBEDDING_CONFIG: EmbeddingConfig = {
 # Configure search parameter to fetch relevant documents from vector store.
 DEFAULT_SEARCH_CONFIG = {
     "max_results": 20,
+    # `vector` or `hybrid` (vector and full-text search)
+    "search_mode": "vector",
+    "vector_weight": 1.0,
+    "keyword_weight": 1.0,
+    # Maximal marginal relevance to drop near-duplicate chunks
+    "enable_mmr": False,
+    "mmr_lambda": 0.5,
+    # Minimum cosine similarity to the query. `None` to disable.
+    "min_similarity": None,
 }
 
 # Used for price estimation.
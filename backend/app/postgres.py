@@ -0,0 +1,184 @@
+"""Pooled connections to the vector store (PostgreSQL).
+Connections are kept at module level, so warm Lambda invocations and the embedding job
+reuse them instead of opening a new TLS connection for every query.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+import pg8000
+from aws_lambda_powertools.utilities import parameters
+
+logger = logging.getLogger(__name__)
+
+DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
+# The secret is refetched earlier when the authentication fails (e.g. after rotation).
+DB_SECRET_CACHE_TTL = int(os.environ.get("DB_SECRET_CACHE_TTL", 3600))
+POSTGRES_POOL_MAX_SIZE = int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 2))
+# Idle connections are checked with a round trip before reuse after this many seconds.
+POSTGRES_HEALTH_CHECK_INTERVAL = 30
+# Idle connections are closed instead of reused after this many seconds.
+POSTGRES_MAX_IDLE_TIME = 600
+
+# SQLSTATE of `invalid_password`
+INVALID_PASSWORD = "28P01"
+
+
+def get_db_info(force_fetch: bool = False) -> dict:
+    secrets: Any = parameters.get_secret(
+        DB_SECRETS_ARN, max_age=DB_SECRET_CACHE_TTL, force_fetch=force_fetch
+    )  # type: ignore
+    return json.loads(secrets)
+
+
+def _open(db_info: dict) -> pg8000.Connection:
+    return pg8000.connect(
+        database=db_info["dbname"],
+        host=db_info["host"],
+        port=db_info["port"],
+        user=db_info["username"],
+        password=db_info["password"],
+    )
+
+
+def _is_authentication_error(e: Exception) -> bool:
+    # NOTE: pg8000 passes the fields of the error response as the first argument.
+    fields = e.args[0] if e.args else None
+    return isinstance(fields, dict) and fields.get("C") == INVALID_PASSWORD
+
+
+def connect() -> pg8000.Connection:
+    """Open a new connection with the cached secret.
+    If the password was rotated, the secret is fetched again and the connection is retried.
+    """
+    try:
+        return _open(get_db_info())
+    except pg8000.Error as e:
+        if not _is_authentication_error(e):
+            raise e
+        logger.info("Authentication failed. Fetching the database secret again.")
+        return _open(get_db_info(force_fetch=True))
+
+
+class PooledConnection:
+    def __init__(self, conn: pg8000.Connection, timer: Callable[[], float]):
+        self.conn = conn
+        self.last_used = timer()
+        # SQL -> prepared statement on this connection
+        self._statements: dict[str, Any] = {}
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def prepare(self, operation: str):
+        """Return the statement prepared on this connection.
+        Statements are parsed and planned by the server only once per connection.
+        Parameters are named (e.g. `:bot_id`) and given to `run` as keyword arguments.
+        """
+        statement = self._statements.get(operation)
+        if statement is None:
+            statement = self.conn.prepare(operation)
+            self._statements[operation] = statement
+        return statement
+
+    def is_healthy(self) -> bool:
+        try:
+            self.conn.run("SELECT 1")
+            self.conn.rollback()
+            return True
+        except Exception as e:
+            logger.info(f"Discarding unhealthy connection: {e}")
+            return False
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            # The connection is already broken
+            pass
+
+
+class ConnectionPool:
+    """Pool of connections to PostgreSQL.
+    The most recently used connection is reused first, so that unused connections reach
+    `max_idle_time` and get closed.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], pg8000.Connection] = connect,
+        maxsize: int = POSTGRES_POOL_MAX_SIZE,
+        health_check_interval: float = POSTGRES_HEALTH_CHECK_INTERVAL,
+        max_idle_time: float = POSTGRES_MAX_IDLE_TIME,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self._connect = connect
+        self.maxsize = maxsize
+        self.health_check_interval = health_check_interval
+        self.max_idle_time = max_idle_time
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._idle: list[PooledConnection] = []
+        # Connections must not be shared with forked processes (e.g. `multiprocessing`).
+        self._pid = os.getpid()
+
+    def _acquire(self) -> PooledConnection:
+        while True:
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = []
+                    self._pid = os.getpid()
+                pooled = self._idle.pop() if self._idle else None
+
+            if pooled is None:
+                return PooledConnection(self._connect(), self._timer)
+
+            idle_time = self._timer() - pooled.last_used
+            if idle_time > self.max_idle_time:
+                pooled.close()
+            elif idle_time > self.health_check_interval and not pooled.is_healthy():
+                pooled.close()
+            else:
+                return pooled
+
+    def _release(self, pooled: PooledConnection):
+        pooled.last_used = self._timer()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.maxsize:
+                self._idle.append(pooled)
+                return
+        pooled.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        """Borrow a connection from the pool.
+        The transaction is committed when the block exits normally, and rolled back
+        otherwise. Connections which cannot be rolled back are discarded.
+        """
+        pooled = self._acquire()
+        try:
+            yield pooled
+            pooled.conn.commit()
+        except Exception as e:
+            try:
+                pooled.conn.rollback()
+            except Exception:
+                pooled.close()
+                raise e
+            self._release(pooled)
+            raise e
+        self._release(pooled)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
+
+
+connection_pool = ConnectionPool()
@@ -0,0 +1,47 @@
+"""Encoding of message bodies stored in DynamoDB and S3.
+Encoded bodies start with a single version byte followed by the payload, so that the format
+can evolve without migrating stored items. Plain JSON written by older versions is still
+accepted on decode.
+"""
+
+import zlib
+from typing import Any
+
+import orjson
+from boto3.dynamodb.types import Binary
+
+# Version byte of the encoded payload.
+# NOTE: Must not collide with `{` (0x7b), which is the first byte of legacy plain JSON.
+VERSION_ZLIB_JSON = 0x01
+
+COMPRESSION_LEVEL = 6
+
+
+class UnsupportedCodecVersionError(Exception):
+    pass
+
+
+def encode(data: Any) -> bytes:
+    """Serialize the data as JSON and compress it.
+    The result is a single buffer, so its length can be used as the stored size.
+    """
+    return bytes([VERSION_ZLIB_JSON]) + zlib.compress(
+        orjson.dumps(data), COMPRESSION_LEVEL
+    )
+
+
+def decode(raw: bytes | bytearray | Binary | str) -> Any:
+    """Decode the data encoded by `encode`.
+    For backward compatibility, plain JSON (as `str` or `bytes`) is also accepted.
+    """
+    if isinstance(raw, str):
+        return orjson.loads(raw)
+    if isinstance(raw, Binary):
+        raw = raw.value
+
+    version = raw[0]
+    if version == VERSION_ZLIB_JSON:
+        return orjson.loads(zlib.decompress(memoryview(raw)[1:]))
+    if version == ord("{"):
+        return orjson.loads(raw)
+    raise UnsupportedCodecVersionError(f"Unsupported codec version: {version}")
@@ -1,7 +1,12 @@
 import json
+import logging
 import os
+import re
+import zlib
+from datetime import datetime, timezone
 
 import boto3
+from app.cache import TTLCache
 
 DDB_ENDPOINT_URL = os.environ.get("DDB_ENDPOINT_URL")
 TABLE_NAME = os.environ.get("TABLE_NAME", "")
@@ -9,6 +14,25 @@ ACCOUNT = os.environ.get("ACCOUNT", "")
 REGION = os.environ.get("REGION", "ap-northeast-1")
 TABLE_ACCESS_ROLE_ARN = os.environ.get("TABLE_ACCESS_ROLE_ARN", "")
 TRANSACTION_BATCH_SIZE = 25
+# Scoped credentials are cached per user to avoid calling `sts:AssumeRole` on every access.
+CREDENTIAL_CACHE_MAX_SIZE = int(os.environ.get("CREDENTIAL_CACHE_MAX_SIZE", 256))
+# Refresh cached credentials this many seconds before they actually expire.
+CREDENTIAL_REFRESH_MARGIN = 300
+# Prefix of the user id of published APIs. See `add_current_user_to_request`.
+PUBLISHED_API_USER_PREFIX = "PUBLISHED_API#"
+# Conversations of a published API are spread over this many partitions.
+# NOTE: Must not be changed after deployment, otherwise stored conversations are not found.
+PUBLISHED_API_PARTITION_SHARD_COUNT = 16
+# Matches sharded partition keys of published APIs. The first group is the user id.
+# NOTE: Also used in Athena queries, so keep it compatible with Java regular expressions.
+PUBLISHED_API_PARTITION_KEY_PATTERN = r"^(PUBLISHED_API#[^#]+)#[0-9]+$"
+
+logger = logging.getLogger(__name__)
+
+# (service_name, user_id) -> boto3 resource
+_resource_cache: TTLCache[tuple[str, str | None], object] = TTLCache(
+    maxsize=CREDENTIAL_CACHE_MAX_SIZE
+)
 
 
 class RecordNotFoundError(Exception):
@@ -23,15 +47,67 @@ class ResourceConflictError(Exception):
     pass
 
 
+def compose_partition_key(user_id: str, conversation_id: str) -> str:
+    """Partition key of the conversation.
+    All conversations of a published API belong to the same user id, so they are spread
+    over shards derived from the conversation id to avoid a hot partition. The shard is
+    appended to the user id, so the key still matches the `LeadingKeys` condition.
+    """
+    if not user_id.startswith(PUBLISHED_API_USER_PREFIX):
+        return user_id
+    shard = (
+        zlib.crc32(conversation_id.encode("utf-8"))
+        % PUBLISHED_API_PARTITION_SHARD_COUNT
+    )
+    return f"{user_id}#{shard}"
+
+
+def compose_partition_keys(user_id: str) -> list[str]:
+    """All partition keys which may hold conversations of the user.
+    For published APIs, the unsharded key is included last for conversations stored
+    before sharding was introduced.
+    """
+    if not user_id.startswith(PUBLISHED_API_USER_PREFIX):
+        return [user_id]
+    return [
+        f"{user_id}#{shard}" for shard in range(PUBLISHED_API_PARTITION_SHARD_COUNT)
+    ] + [user_id]
+
+
+def decompose_partition_key(partition_key: str) -> str:
+    """User id of the partition key, i.e. the shard suffix of published APIs is removed."""
+    return re.sub(PUBLISHED_API_PARTITION_KEY_PATTERN, r"\1", partition_key)
+
+
 def compose_conv_id(user_id: str, conversation_id: str):
-    # Add user_id prefix for row level security to match with `LeadingKeys` condition
-    return f"{user_id}#CONV#{conversation_id}"
+    # Add partition key prefix for row level security to match with `LeadingKeys` condition
+    return f"{compose_partition_key(user_id, conversation_id)}#CONV#{conversation_id}"
 
 
 def decompose_conv_id(conv_id: str):
     return conv_id.split("#")[-1]
 
 
+def compose_message_id(user_id: str, conversation_id: str, message_id: str):
+    # Add user_id prefix for row level security to match with `LeadingKeys` condition
+    return f"{compose_message_prefix(user_id, conversation_id)}{message_id}"
+
+
+def compose_message_prefix(user_id: str, conversation_id: str | None = None):
+    """Prefix of the message items of the conversation.
+    If `conversation_id` is omitted, the prefix matches the messages of all conversations
+    in the partition `user_id`.
+    """
+    if conversation_id is None:
+        return f"{user_id}#MESSAGE#"
+    partition_key = compose_partition_key(user_id, conversation_id)
+    return f"{partition_key}#MESSAGE#{conversation_id}#"
+
+
+def decompose_message_id(composed_message_id: str):
+    return composed_message_id.split("#")[-1]
+
+
 def compose_bot_id(user_id: str, bot_id: str):
     # Add user_id prefix for row level security to match with `LeadingKeys` condition
     return f"{user_id}#BOT#{bot_id}"
@@ -50,13 +126,51 @@ def decompose_bot_alias_id(composed_alias_id: str):
     return composed_alias_id.split("#")[-1]
 
 
+def compose_retrieval_cache_id(user_id: str, cache_key: str):
+    # Add user_id prefix for row level security to match with `LeadingKeys` condition
+    return f"{user_id}#RETRIEVAL#{cache_key}"
+
+
 def _get_aws_resource(service_name, user_id=None):
     """Get AWS resource with optional row-level access control for DynamoDB.
+    Resources are cached per user until shortly before the assumed role credentials expire.
     Ref: https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_examples_dynamodb_items.html
     """
+    cache_key = (service_name, user_id)
+    resource = _resource_cache.get(cache_key)
+    if resource is not None:
+        return resource
+
+    logger.debug(f"Credential cache miss for user: {user_id}")
+    resource, ttl = _create_aws_resource(service_name, user_id)
+    _resource_cache.set(cache_key, resource, ttl=ttl)
+    return resource
+
+
+def _get_aws_low_level_client(service_name, user_id=None):
+    """Get a low-level AWS client, cached like `_get_aws_resource`.
+    Unlike resources, low-level clients are thread safe, so they can be shared by worker
+    threads. Note that DynamoDB items are in the low-level format (e.g. `{"S": "..."}`).
+    """
+    cache_key = (f"{service_name}:client", user_id)
+    client = _resource_cache.get(cache_key)
+    if client is not None:
+        return client
+
+    logger.debug(f"Credential cache miss for user: {user_id}")
+    client, ttl = _create_aws_resource(service_name, user_id, low_level=True)
+    _resource_cache.set(cache_key, client, ttl=ttl)
+    return client
+
+
+def _create_aws_resource(service_name, user_id=None, low_level=False):
+    """Create AWS resource (or low-level client if `low_level`) and return it with the
+    number of seconds it can be reused.
+    """
     if "AWS_EXECUTION_ENV" not in os.environ:
+        factory = boto3.client if low_level else boto3.resource
         if DDB_ENDPOINT_URL:
-            return boto3.resource(
+            resource = factory(
                 service_name,
                 endpoint_url=DDB_ENDPOINT_URL,
                 aws_access_key_id="key",
@@ -64,7 +178,9 @@ def _get_aws_resource(service_name, user_id=None):
                 region_name=REGION,
             )
         else:
-            return boto3.resource(service_name, region_name=REGION)
+            resource = factory(service_name, region_name=REGION)
+        # Local credentials are managed by the default credential chain
+        return resource, None
 
     policy_document = {
         "Statement": [
@@ -108,7 +224,17 @@ def _get_aws_resource(service_name, user_id=None):
         aws_secret_access_key=credentials["SecretAccessKey"],
         aws_session_token=credentials["SessionToken"],
     )
-    return session.resource(service_name, region_name=REGION)
+    expiration: datetime = credentials["Expiration"]
+    ttl = (
+        expiration - datetime.now(timezone.utc)
+    ).total_seconds() - CREDENTIAL_REFRESH_MARGIN
+    factory = session.client if low_level else session.resource
+    return factory(service_name, region_name=REGION), max(ttl, 0)
+
+
+def get_credential_cache_stats() -> dict[str, int]:
+    """Hit / miss counters of the scoped credential cache."""
+    return _resource_cache.stats()
 
 
 def _get_dynamodb_client(user_id=None):
@@ -116,6 +242,13 @@ def _get_dynamodb_client(user_id=None):
     return _get_aws_resource("dynamodb", user_id=user_id).meta.client
 
 
+def _get_dynamodb_resource(user_id=None):
+    """Get a DynamoDB service resource, optionally with row-level access control.
+    Used for batch operations (e.g. `batch_get_item`) which are not available on table clients.
+    """
+    return _get_aws_resource("dynamodb", user_id=user_id)
+
+
 def _get_table_client(user_id):
     """Get a DynamoDB table client with row-level access."""
     return _get_aws_resource("dynamodb", user_id=user_id).Table(TABLE_NAME)
@@ -1,3 +1,4 @@
+import base64
 import json
 import logging
 import os
@@ -6,15 +7,27 @@ from decimal import Decimal as decimal
 from functools import wraps
 
 import boto3
+from app.repositories import codec
 from app.repositories.common import (
+    TABLE_NAME,
     TRANSACTION_BATCH_SIZE,
     RecordNotFoundError,
+    _get_dynamodb_resource,
     _get_table_client,
     compose_conv_id,
+    compose_message_id,
+    compose_message_prefix,
+    compose_partition_key,
+    compose_partition_keys,
     decompose_conv_id,
+    decompose_message_id,
+)
+from app.repositories.image import (
+    delete_images_by_conversation_id,
+    delete_images_by_user_id,
+    store_image,
 )
 from app.repositories.models.conversation import (
-    ChunkModel,
     ContentModel,
     ConversationMeta,
     ConversationModel,
@@ -24,24 +37,127 @@ from app.repositories.models.conversation import (
 from app.utils import get_current_time
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
+from pydantic import TypeAdapter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 s3_client = boto3.client("s3")
 
 THRESHOLD_LARGE_MESSAGE = 300 * 1024  # 300KB
+BATCH_GET_SIZE = 100  # Max number of keys per `BatchGetItem`
+# Max number of messages whose parents are updated in place. More messages are written by
+# replacing the conversation item, to keep the update expression within its size limit.
+MESSAGE_PARENTS_UPDATE_SIZE = 100
 LARGE_MESSAGE_BUCKET = os.environ.get("LARGE_MESSAGE_BUCKET")
 
+# Validates the whole message in a single pass
+_message_adapter = TypeAdapter(MessageModel)
+
+
+def _compose_message_item(
+    user_id: str,
+    conversation_id: str,
+    message_id: str,
+    message: MessageModel,
+    threshold: int,
+) -> dict:
+    """Compose a DynamoDB item for a single message.
+    `Parent`, `Children` and `Feedback` are kept as top-level attributes so that the message
+    tree and feedback can be updated without touching the message body.
+    """
+    item = {
+        "PK": compose_partition_key(user_id, conversation_id),
+        "SK": compose_message_id(user_id, conversation_id, message_id),
+        "Parent": message.parent,
+        "Children": message.children,
+    }
+    if message.feedback:
+        item["Feedback"] = message.feedback.model_dump()
+
+    content = message.model_dump(exclude={"parent", "children", "feedback"})
+    # Images are stored out of line and the message keeps only the reference to them.
+    for c in content["content"]:
+        if c["content_type"] == "image":
+            c["body"] = store_image(
+                user_id, conversation_id, c["body"], c["media_type"]
+            )
+
+    # Compressed once. The size to decide S3 offloading is measured on the same buffer.
+    body = codec.encode(content)
+    body_size = len(body)
+    if body_size > threshold:
+        logger.info(
+            f"Message {message_id} size {body_size} exceeds threshold {threshold}"
+        )
+        large_message_path = f"{user_id}/{conversation_id}/{message_id}"
+        s3_client.put_object(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Key=large_message_path,
+            Body=body,
+        )
+        item["IsLargeMessage"] = True
+        item["LargeMessagePath"] = large_message_path
+    else:
+        item["IsLargeMessage"] = False
+        item["Message"] = body
+
+    return item
+
+
+def _store_messages(
+    table,
+    user_id: str,
+    conversation: ConversationModel,
+    message_ids: list[str],
+    threshold: int,
+):
+    with table.batch_writer() as writer:
+        for message_id in message_ids:
+            writer.put_item(
+                Item=_compose_message_item(
+                    user_id,
+                    conversation.id,
+                    message_id,
+                    conversation.message_map[message_id],
+                    threshold,
+                )
+            )
+
+
+def _compose_conversation_keys(user_id: str, conversation_id: str) -> list[dict]:
+    """Keys of the conversation item, in the order to look up.
+    Conversations of published APIs stored before sharding are kept under the unsharded
+    partition key until they are read and written again.
+    """
+    partition_key = compose_partition_key(user_id, conversation_id)
+    keys = [{"PK": partition_key, "SK": compose_conv_id(user_id, conversation_id)}]
+    if partition_key != user_id:
+        keys.append({"PK": user_id, "SK": f"{user_id}#CONV#{conversation_id}"})
+    return keys
+
 
 def store_conversation(
-    user_id: str, conversation: ConversationModel, threshold=THRESHOLD_LARGE_MESSAGE
+    user_id: str,
+    conversation: ConversationModel,
+    threshold=THRESHOLD_LARGE_MESSAGE,
+    message_ids: list[str] | None = None,
 ):
-    logger.info(f"Storing conversation: {conversation.model_dump_json()}")
+    """Store conversation.
+    Each message is stored as its own item under the conversation, so a chat turn only needs
+    to write the messages it touched. Specify them with `message_ids` (e.g. the parent, the
+    new user message and the new assistant message). If omitted, all messages are written.
+    The conversation item keeps the parent of every message (`MessageParents`), so that
+    `find_conversation_path` never reads the message items off the path.
+    Conversations stored in the legacy single-item layout are migrated on write.
+    """
+    logger.info(f"Storing conversation: {conversation.id}")
     table = _get_table_client(user_id)
+    conversation_key, *legacy_keys = _compose_conversation_keys(
+        user_id, conversation.id
+    )
 
     item_params = {
-        "PK": user_id,
-        "SK": compose_conv_id(user_id, conversation.id),
+        **conversation_key,
         "Title": conversation.title,
         "CreateTime": decimal(conversation.create_time),
         # Convert to decimal via str to avoid error
@@ -49,231 +165,436 @@ def store_conversation(
         "TotalPrice": decimal(str(conversation.total_price)),
         "LastMessageId": conversation.last_message_id,
         "ShouldContinue": conversation.should_continue,
+        # NOTE: all message has the same model
+        "Model": (
+            conversation.message_map["system"].model
+            if "system" in conversation.message_map
+            else ""
+        ),
     }
 
     if conversation.bot_id:
         item_params["BotId"] = conversation.bot_id
 
-    message_map = {
-        k: {
-            **v.model_dump(),
-            "content": [c.model_dump() for c in v.content],
-        }
-        for k, v in conversation.message_map.items()
-    }
-    message_map_size = len(json.dumps(message_map).encode("utf-8"))
-    logger.info(f"Message map size: {message_map_size}")
-    if message_map_size > threshold:
-        logger.info(
-            f"Message map size {message_map_size} exceeds threshold {threshold}"
-        )
-        item_params["IsLargeMessage"] = True
-        large_message_path = f"{user_id}/{conversation.id}/message_map.json"
-        item_params["LargeMessagePath"] = large_message_path
-        # Store all message in S3
-        s3_client.put_object(
-            Bucket=LARGE_MESSAGE_BUCKET,
-            Key=large_message_path,
-            Body=json.dumps(message_map),
-        )
-        # Store only `system` attribute in DynamoDB
-        item_params["MessageMap"] = json.dumps(
-            {
-                k: v.model_dump()
-                for k, v in conversation.message_map.items()
-                if k == "system"
-            }
+    if message_ids is None:
+        message_ids = list(conversation.message_map.keys())
+
+    # Write messages before the conversation item so that readers never see
+    # `LastMessageId` pointing to a message which does not exist yet.
+    _store_messages(table, user_id, conversation, message_ids, threshold)
+
+    if len(message_ids) <= MESSAGE_PARENTS_UPDATE_SIZE:
+        try:
+            # The condition fails for new conversations, for legacy conversations holding
+            # the whole `MessageMap` in a single item and for conversations stored before
+            # `MessageParents` was added.
+            return _update_conversation_item(
+                table, conversation, item_params, message_ids
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+
+    logger.info(f"Writing all messages of conversation: {conversation.id}")
+    rest_ids = [k for k in conversation.message_map.keys() if k not in message_ids]
+    _store_messages(table, user_id, conversation, rest_ids, threshold)
+
+    # NOTE: The message map may only contain the path, so the parents are read from the
+    # message items, which include all messages written above.
+    item_params["MessageParents"] = {
+        decompose_message_id(message_item["SK"]): message_item["Parent"]
+        for message_item in _find_message_items(
+            table,
+            user_id,
+            conversation.id,
+            ProjectionExpression="SK, Parent",
+            ConsistentRead=True,
         )
-    else:
-        item_params["IsLargeMessage"] = False
-        item_params["MessageMap"] = json.dumps(
-            {k: v.model_dump() for k, v in conversation.message_map.items()}
+    }
+    response = table.put_item(Item=item_params, ReturnValues="ALL_OLD")
+    old_items = [response.get("Attributes", {})]
+    # Move the conversation stored before sharding to its shard. The conversation may have
+    # been read on another instance, so the legacy key is always deleted here.
+    # NOTE: Only reached when the conditional put fails, i.e. on the first write.
+    for legacy_key in legacy_keys:
+        old_items.append(
+            table.delete_item(Key=legacy_key, ReturnValues="ALL_OLD").get(
+                "Attributes", {}
+            )
         )
+    for old_item in old_items:
+        if old_item.get("IsLargeMessage", False) and "LargeMessagePath" in old_item:
+            # Remove the legacy message map stored in S3
+            s3_client.delete_object(
+                Bucket=LARGE_MESSAGE_BUCKET, Key=old_item["LargeMessagePath"]
+            )
+    return response
+
 
-    response = table.put_item(
-        Item=item_params,
+def _update_conversation_item(
+    table, conversation: ConversationModel, item_params: dict, message_ids: list[str]
+):
+    """Update the conversation item and add the parents of the messages in place."""
+    names = {}
+    values = {}
+    assignments = []
+    for i, (name, value) in enumerate(item_params.items()):
+        if name in ("PK", "SK"):
+            continue
+        names[f"#a{i}"] = name
+        values[f":a{i}"] = value
+        assignments.append(f"#a{i} = :a{i}")
+    for i, message_id in enumerate(message_ids):
+        names[f"#m{i}"] = message_id
+        values[f":m{i}"] = conversation.message_map[message_id].parent
+        assignments.append(f"MessageParents.#m{i} = :m{i}")
+
+    return table.update_item(
+        Key={"PK": item_params["PK"], "SK": item_params["SK"]},
+        UpdateExpression="SET " + ", ".join(assignments),
+        ConditionExpression="attribute_exists(MessageParents)",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
     )
-    return response
 
 
-def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
+def _find_model_name(item: dict) -> str:
+    if "Model" in item:
+        return item["Model"]
+    # For backward compatibility (legacy single-item layout)
+    # NOTE: all message has the same model
+    return codec.decode(item["MessageMap"]).get("system", {}).get("model", "")
+
+
+def _to_conversation_meta(item: dict) -> ConversationMeta:
+    return ConversationMeta(
+        id=decompose_conv_id(item["SK"]),
+        create_time=float(item["CreateTime"]),
+        title=item["Title"],
+        model=_find_model_name(item),
+        bot_id=item["BotId"] if "BotId" in item else None,
+    )
+
+
+def _encode_next_token(last_evaluated_key: dict) -> str:
+    return base64.b64encode(json.dumps(last_evaluated_key).encode("utf-8")).decode(
+        "utf-8"
+    )
+
+
+def _decode_next_token(user_id: str, next_token: str) -> dict:
+    try:
+        key = json.loads(base64.b64decode(next_token).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid next token")
+    if not isinstance(key, dict) or key.get("PK") not in compose_partition_keys(
+        user_id
+    ):
+        raise ValueError("Invalid next token")
+    return key
+
+
+def find_conversation_page_by_user_id(
+    user_id: str, limit: int | None = None, next_token: str | None = None
+) -> tuple[list[ConversationMeta], str | None]:
+    """Find a page of conversations of the user, newest first.
+    Only the attributes needed for listing are read, so a page is small regardless of
+    the size of the conversations. `MessageMap` only exists on legacy items which have
+    no `Model` attribute yet.
+    NOTE: Conversations of published APIs are spread over partitions, which are read one
+    after another. The order is kept only within a partition and a page may be short.
+    """
     logger.info(f"Finding conversations for user: {user_id}")
     table = _get_table_client(user_id)
+    partition_keys = compose_partition_keys(user_id)
 
+    start_key = _decode_next_token(user_id, next_token) if next_token else None
+    partition_key = start_key["PK"] if start_key else partition_keys[0]
     query_params = {
-        "KeyConditionExpression": Key("PK").eq(user_id)
+        "KeyConditionExpression": Key("PK").eq(partition_key)
         # NOTE: Need SK to fetch only conversations
-        & Key("SK").begins_with(f"{user_id}#CONV#"),
+        & Key("SK").begins_with(f"{partition_key}#CONV#"),
+        "ProjectionExpression": "SK, Title, CreateTime, Model, BotId, MessageMap",
         "ScanIndexForward": False,
     }
+    if limit:
+        query_params["Limit"] = limit
+    if start_key and "SK" in start_key:
+        query_params["ExclusiveStartKey"] = start_key
 
     response = table.query(**query_params)
-    conversations = [
-        ConversationMeta(
-            id=decompose_conv_id(item["SK"]),
-            create_time=float(item["CreateTime"]),
-            title=item["Title"],
-            # NOTE: all message has the same model
-            model=json.loads(item["MessageMap"]).get("system", {}).get("model", ""),
-            bot_id=item["BotId"] if "BotId" in item else None,
-        )
-        for item in response["Items"]
-    ]
+    conversations = [_to_conversation_meta(item) for item in response["Items"]]
 
-    query_count = 1
-    MAX_QUERY_COUNT = 5
-    while "LastEvaluatedKey" in response:
-        model = (
-            json.loads(response["Items"][0]["MessageMap"])
-            .get("system", {})
-            .get("model", "")
-        )
-        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-        # NOTE: max page size is 1MB
-        # See: https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/Query.Pagination.html
-        response = table.query(
-            **query_params,
-        )
-        conversations.extend(
-            [
-                ConversationMeta(
-                    id=decompose_conv_id(item["SK"]),
-                    create_time=float(item["CreateTime"]),
-                    title=item["Title"],
-                    model=model,
-                    bot_id=item["BotId"] if "BotId" in item else None,
-                )
-                for item in response["Items"]
-            ]
+    next_key = response.get("LastEvaluatedKey")
+    index = partition_keys.index(partition_key)
+    if next_key is None and index + 1 < len(partition_keys):
+        # Continue from the beginning of the next partition
+        next_key = {"PK": partition_keys[index + 1]}
+
+    return conversations, _encode_next_token(next_key) if next_key else None
+
+
+def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
+    """Find all conversations of the user, newest first."""
+    conversations, next_token = find_conversation_page_by_user_id(user_id)
+    while next_token:
+        page, next_token = find_conversation_page_by_user_id(
+            user_id, next_token=next_token
         )
-        query_count += 1
-        if query_count > MAX_QUERY_COUNT:
-            logger.warning(f"Query count exceeded {MAX_QUERY_COUNT}")
-            break
+        conversations.extend(page)
 
     logger.info(f"Found conversations: {conversations}")
     return conversations
 
 
-def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationModel:
-    logger.info(f"Finding conversation: {conversation_id}")
-    table = _get_table_client(user_id)
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_conv_id(user_id, conversation_id)),
+def _to_message_model(v: dict) -> MessageModel:
+    if type(v["content"]) != list:
+        # For backward compatibility
+        v = {**v, "content": [{**v["content"], "media_type": None}]}
+    if v.get("used_chunks"):
+        for c in v["used_chunks"]:
+            # For backward compatibility
+            c.setdefault("content_type", "s3")
+    else:
+        v = {**v, "used_chunks": None}
+    if not v.get("feedback"):
+        v = {**v, "feedback": None}
+    return _message_adapter.validate_python(v)
+
+
+def _load_message_body(item: dict) -> dict:
+    """Load the message body of a message item. Large bodies are stored in S3."""
+    if item.get("IsLargeMessage", False):
+        response = s3_client.get_object(
+            Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
+        )
+        return codec.decode(response["Body"].read())
+    return codec.decode(item["Message"])
+
+
+def _item_to_message_model(item: dict) -> MessageModel:
+    body = _load_message_body(item)
+    return _to_message_model(
+        {
+            **body,
+            "parent": item["Parent"],
+            "children": item["Children"],
+            # NOTE: Items written before feedback became a top-level attribute
+            # keep it in the body.
+            "feedback": item.get("Feedback", body.get("feedback")),
+        }
     )
-    if len(response["Items"]) == 0:
-        raise RecordNotFoundError(f"No conversation found with id: {conversation_id}")
 
-    # NOTE: conversation is unique
-    item = response["Items"][0]
+
+def _find_message_items(table, user_id: str, conversation_id: str, **kwargs) -> list:
+    query_params = {
+        "KeyConditionExpression": Key("PK").eq(
+            compose_partition_key(user_id, conversation_id)
+        )
+        & Key("SK").begins_with(compose_message_prefix(user_id, conversation_id)),
+        **kwargs,
+    }
+    response = table.query(**query_params)
+    items = response["Items"]
+    while "LastEvaluatedKey" in response:
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        response = table.query(**query_params)
+        items.extend(response["Items"])
+    return items
+
+
+def _find_legacy_message_map(item: dict) -> dict[str, MessageModel]:
+    """Load message map from the legacy single-item layout."""
     if item.get("IsLargeMessage", False):
         large_message_path = item["LargeMessagePath"]
         response = s3_client.get_object(
             Bucket=LARGE_MESSAGE_BUCKET, Key=large_message_path
         )
-        message_map = json.loads(response["Body"].read().decode("utf-8"))
+        message_map = codec.decode(response["Body"].read())
     else:
-        message_map = json.loads(item["MessageMap"])
+        message_map = codec.decode(item["MessageMap"])
+    return {k: _to_message_model(v) for k, v in message_map.items()}
+
 
-    conv = ConversationModel(
+def _find_conversation_item(table, user_id: str, conversation_id: str) -> dict:
+    # NOTE: Both keys are known, so read the item directly (and consistently)
+    # instead of querying the GSI.
+    conversation_key, *legacy_keys = _compose_conversation_keys(
+        user_id, conversation_id
+    )
+    response = table.get_item(Key=conversation_key, ConsistentRead=True)
+    if "Item" in response:
+        return response["Item"]
+    for key in legacy_keys:
+        response = table.get_item(Key=key, ConsistentRead=True)
+        if "Item" in response:
+            return response["Item"]
+    raise RecordNotFoundError(f"No conversation found with id: {conversation_id}")
+
+
+def _to_conversation_model(
+    item: dict, message_map: dict[str, MessageModel]
+) -> ConversationModel:
+    return ConversationModel(
         id=decompose_conv_id(item["SK"]),
         create_time=float(item["CreateTime"]),
         title=item["Title"],
         total_price=item.get("TotalPrice", 0),
-        message_map={
-            k: MessageModel(
-                role=v["role"],
-                content=(
-                    [
-                        ContentModel(
-                            content_type=c["content_type"],
-                            body=c["body"],
-                            media_type=c["media_type"],
-                        )
-                        for c in v["content"]
-                    ]
-                    if type(v["content"]) == list
-                    else [
-                        # For backward compatibility
-                        ContentModel(
-                            content_type=v["content"]["content_type"],
-                            body=v["content"]["body"],
-                            media_type=None,
-                        )
-                    ]
-                ),
-                model=v["model"],
-                children=v["children"],
-                parent=v["parent"],
-                create_time=float(v["create_time"]),
-                feedback=(
-                    FeedbackModel(
-                        thumbs_up=v["feedback"]["thumbs_up"],
-                        category=v["feedback"]["category"],
-                        comment=v["feedback"]["comment"],
-                    )
-                    if v.get("feedback")
-                    else None
-                ),
-                used_chunks=(
-                    [
-                        ChunkModel(
-                            content=c["content"],
-                            content_type=(
-                                c["content_type"] if "content_type" in c else "s3"
-                            ),
-                            source=c["source"],
-                            rank=c["rank"],
-                        )
-                        for c in v["used_chunks"]
-                    ]
-                    if v.get("used_chunks")
-                    else None
-                ),
-                thinking_log=v.get("thinking_log"),
-            )
-            for k, v in message_map.items()
-        },
+        message_map=message_map,
         last_message_id=item["LastMessageId"],
         bot_id=item["BotId"] if "BotId" in item else None,
         should_continue=item.get("ShouldContinue", False),
     )
+
+
+def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationModel:
+    logger.info(f"Finding conversation: {conversation_id}")
+    table = _get_table_client(user_id)
+    item = _find_conversation_item(table, user_id, conversation_id)
+    if "MessageMap" in item:
+        message_map = _find_legacy_message_map(item)
+    else:
+        message_map = {
+            decompose_message_id(message_item["SK"]): _item_to_message_model(
+                message_item
+            )
+            for message_item in _find_message_items(table, user_id, conversation_id)
+        }
+
+    conv = _to_conversation_model(item, message_map)
     logger.info(f"Found conversation: {conv}")
     return conv
 
 
-def delete_conversation_by_id(user_id: str, conversation_id: str):
-    logger.info(f"Deleting conversation: {conversation_id}")
+def _batch_get_message_items(
+    user_id: str, conversation_id: str, message_ids: list[str]
+) -> list[dict]:
+    dynamodb = _get_dynamodb_resource(user_id)
+    partition_key = compose_partition_key(user_id, conversation_id)
+    keys = [
+        {"PK": partition_key, "SK": compose_message_id(user_id, conversation_id, m)}
+        for m in message_ids
+    ]
+    items = []
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {
+            TABLE_NAME: {"Keys": keys[i : i + BATCH_GET_SIZE], "ConsistentRead": True}
+        }
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response["Responses"].get(TABLE_NAME, []))
+            request_items = response.get("UnprocessedKeys")
+    return items
+
+
+def find_conversation_path(
+    user_id: str, conversation_id: str, leaf_id: str | None = None
+) -> ConversationModel:
+    """Find conversation with only the messages on the path from `leaf_id` to the root.
+    Sibling branches (edited or regenerated messages) are not loaded. The message map also
+    contains the last message of the conversation, which is needed to continue generation.
+    If `leaf_id` is omitted, the last message is used as the leaf.
+    NOTE: Conversations stored in the legacy single-item layout are loaded as a whole.
+    """
+    logger.info(f"Finding conversation path: {conversation_id} (leaf: {leaf_id})")
     table = _get_table_client(user_id)
+    item = _find_conversation_item(table, user_id, conversation_id)
+    if "MessageMap" in item:
+        return _to_conversation_model(item, _find_legacy_message_map(item))
+
+    # The path is found from the parents kept on the conversation item, so only the message
+    # items on the path are read.
+    parents = item.get("MessageParents")
+    if parents is None:
+        # Stored before `MessageParents` was added. Added by the next write.
+        # NOTE: The projection reduces the transfer size, but the query is still billed
+        # for the full size of every message item.
+        parents = {
+            decompose_message_id(message_item["SK"]): message_item["Parent"]
+            for message_item in _find_message_items(
+                table,
+                user_id,
+                conversation_id,
+                ProjectionExpression="SK, Parent",
+            )
+        }
 
-    try:
-        # Check if the conversation has a large message map
-        response = table.get_item(
-            Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
-            ProjectionExpression="IsLargeMessage, LargeMessagePath",
-        )
+    if not leaf_id:
+        leaf_id = item["LastMessageId"]
+    if leaf_id == "system" and "instruction" in parents:
+        leaf_id = "instruction"
+
+    path_ids = []
+    node_id = leaf_id
+    while node_id is not None and node_id in parents:
+        path_ids.append(node_id)
+        node_id = parents[node_id]
+    if item["LastMessageId"] in parents and item["LastMessageId"] not in path_ids:
+        path_ids.append(item["LastMessageId"])
 
-        item = response.get("Item")
-        if item and item.get("IsLargeMessage", False):
-            # Delete the large message map from S3
+    message_map = {
+        decompose_message_id(message_item["SK"]): _item_to_message_model(message_item)
+        for message_item in _batch_get_message_items(user_id, conversation_id, path_ids)
+    }
+    conv = _to_conversation_model(item, message_map)
+    logger.info(f"Found conversation path: {list(message_map.keys())}")
+    return conv
+
+
+def _delete_items(table, partition_key: str, items: list):
+    """Delete items and the large message bodies stored in S3."""
+    for item in items:
+        if item.get("IsLargeMessage", False):
             s3_client.delete_object(
                 Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
             )
 
-        # Delete the conversation from DynamoDB
-        response = table.delete_item(
-            Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
-            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
-        )
+    for i in range(0, len(items), TRANSACTION_BATCH_SIZE):
+        batch = items[i : i + TRANSACTION_BATCH_SIZE]
+        with table.batch_writer() as writer:
+            for item in batch:
+                writer.delete_item(Key={"PK": partition_key, "SK": item["SK"]})
 
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            raise RecordNotFoundError(
-                f"Conversation with id {conversation_id} not found"
+
+def delete_conversation_by_id(user_id: str, conversation_id: str):
+    logger.info(f"Deleting conversation: {conversation_id}")
+    table = _get_table_client(user_id)
+
+    # NOTE: Deleted under every key, so that a copy left under the unsharded key of a
+    # published API does not come back.
+    response = None
+    for key in _compose_conversation_keys(user_id, conversation_id):
+        try:
+            # Delete the conversation from DynamoDB
+            deleted = table.delete_item(
+                Key=key,
+                ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+                ReturnValues="ALL_OLD",
             )
-        else:
-            raise e
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+            continue
+
+        response = response or deleted
+        item = deleted.get("Attributes", {})
+        if item.get("IsLargeMessage", False):
+            # Delete the large message map of legacy layout from S3
+            s3_client.delete_object(
+                Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
+            )
+    if response is None:
+        raise RecordNotFoundError(f"Conversation with id {conversation_id} not found")
+
+    # Delete all messages belonging to the conversation
+    message_items = _find_message_items(
+        table,
+        user_id,
+        conversation_id,
+        ProjectionExpression="SK, IsLargeMessage, LargeMessagePath",
+    )
+    _delete_items(table, compose_partition_key(user_id, conversation_id), message_items)
+    delete_images_by_conversation_id(user_id, conversation_id)
 
     return response
 
@@ -282,74 +603,64 @@ def delete_conversation_by_user_id(user_id: str):
     logger.info(f"Deleting ALL conversations for user: {user_id}")
     table = _get_table_client(user_id)
 
-    query_params = {
-        "KeyConditionExpression": Key("PK").eq(user_id)
-        # NOTE: Need SK to fetch only conversations
-        & Key("SK").begins_with(f"{user_id}#CONV#"),
-        "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath",
-    }
-
-    def delete_batch(batch):
-        with table.batch_writer() as writer:
-            for item in batch:
-                writer.delete_item(Key={"PK": user_id, "SK": item["SK"]})
-
-    def delete_large_messages(items):
-        for item in items:
-            if item.get("IsLargeMessage", False):
-                s3_client.delete_object(
-                    Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
-                )
+    for partition_key, prefix in [
+        (partition_key, prefix)
+        for partition_key in compose_partition_keys(user_id)
+        for prefix in [
+            f"{partition_key}#CONV#",
+            compose_message_prefix(partition_key),
+        ]
+    ]:
+        query_params = {
+            "KeyConditionExpression": Key("PK").eq(partition_key)
+            # NOTE: Need SK to fetch only conversations and their messages
+            & Key("SK").begins_with(prefix),
+            "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath",
+        }
 
-    try:
-        response = table.query(
-            **query_params,
-        )
+        try:
+            response = table.query(
+                **query_params,
+            )
 
-        while True:
-            items = response.get("Items", [])
-            delete_large_messages(items)
+            while True:
+                _delete_items(table, partition_key, response.get("Items", []))
 
-            for i in range(0, len(items), TRANSACTION_BATCH_SIZE):
-                batch = items[i : i + TRANSACTION_BATCH_SIZE]
-                delete_batch(batch)
+                # Check if next page exists
+                if "LastEvaluatedKey" not in response:
+                    break
 
-            # Check if next page exists
-            if "LastEvaluatedKey" not in response:
-                break
+                # Load next page
+                query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+                response = table.query(
+                    **query_params,
+                )
 
-            # Load next page
-            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-            response = table.query(
-                **query_params,
-            )
+        except ClientError as e:
+            logger.error(f"An error occurred: {e.response['Error']['Message']}")
 
-    except ClientError as e:
-        logger.error(f"An error occurred: {e.response['Error']['Message']}")
+    delete_images_by_user_id(user_id)
 
 
 def change_conversation_title(user_id: str, conversation_id: str, new_title: str):
     logger.info(f"Updating conversation title: {conversation_id} to {new_title}")
     table = _get_table_client(user_id)
 
-    try:
-        response = table.update_item(
-            Key={
-                "PK": user_id,
-                "SK": compose_conv_id(user_id, conversation_id),
-            },
-            UpdateExpression="set Title=:t",
-            ExpressionAttributeValues={":t": new_title},
-            ReturnValues="UPDATED_NEW",
-            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            raise RecordNotFoundError(
-                f"Conversation with id {conversation_id} not found"
+    for key in _compose_conversation_keys(user_id, conversation_id):
+        try:
+            response = table.update_item(
+                Key=key,
+                UpdateExpression="set Title=:t",
+                ExpressionAttributeValues={":t": new_title},
+                ReturnValues="UPDATED_NEW",
+                ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
             )
-        else:
-            raise e
+            break
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise e
+    else:
+        raise RecordNotFoundError(f"Conversation with id {conversation_id} not found")
 
     logger.info(f"Updated conversation title response: {response}")
 
@@ -361,21 +672,29 @@ def update_feedback(
 ):
     logger.info(f"Updating feedback for conversation: {conversation_id}")
     table = _get_table_client(user_id)
-    conv = find_conversation_by_id(user_id, conversation_id)
-    message_map = conv.message_map
-    message_map[message_id].feedback = feedback
-
-    response = table.update_item(
-        Key={
-            "PK": user_id,
-            "SK": compose_conv_id(user_id, conversation_id),
-        },
-        UpdateExpression="set MessageMap = :m",
-        ExpressionAttributeValues={
-            ":m": json.dumps({k: v.model_dump() for k, v in message_map.items()})
-        },
-        ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
-        ReturnValues="UPDATED_NEW",
-    )
+    try:
+        # Only the feedback attribute of the message item is updated.
+        response = table.update_item(
+            Key={
+                "PK": compose_partition_key(user_id, conversation_id),
+                "SK": compose_message_id(user_id, conversation_id, message_id),
+            },
+            UpdateExpression="SET Feedback = :feedback",
+            ExpressionAttributeValues={":feedback": feedback.model_dump()},
+            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise e
+
+        # Legacy conversation stored as a single item. Migrate it to per-message items.
+        conv = find_conversation_by_id(user_id, conversation_id)
+        if message_id not in conv.message_map:
+            raise RecordNotFoundError(
+                f"Message {message_id} not found in conversation {conversation_id}"
+            )
+        conv.message_map[message_id].feedback = feedback
+        response = store_conversation(user_id, conv)
+
     logger.info(f"Updated feedback response: {response}")
     return response
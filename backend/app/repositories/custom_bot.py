@@ -3,15 +3,19 @@ import base64
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal as decimal
 from functools import partial
 
 import boto3
+from app.cache import TTLCache
 from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CONFIG
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG, DEFAULT_SEARCH_CONFIG
 from app.repositories.common import (
     RecordNotFoundError,
+    _get_aws_low_level_client,
+    _get_aws_resource,
     _get_table_client,
     _get_table_public_client,
     compose_bot_alias_id,
@@ -34,10 +38,20 @@ from app.repositories.models.custom_bot import (
 from app.routes.schemas.bot import type_sync_status
 from app.utils import get_current_time
 from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
 TABLE_NAME = os.environ.get("TABLE_NAME", "")
 ENABLE_MISTRAL = os.environ.get("ENABLE_MISTRAL", "") == "true"
+# Query bots through the sparse `OwnedBotIndex` and `PublishedBotIndex`.
+# Enable only after the existing bots are backfilled. See BOT_INDEX_MIGRATION.md.
+ENABLE_BOT_INDEXES = os.environ.get("ENABLE_BOT_INDEXES", "") == "true"
+# Constant partition key of `PublishedBotIndex`, set on public bots. Only published bots
+# have the sort key `PublishedBotId`, so the index contains the bots which are both.
+PUBLISHED_BOT_PARTITION = "PUBLISHED"
+BOT_CACHE_MAX_SIZE = int(os.environ.get("BOT_CACHE_MAX_SIZE", 256))
+BOT_CACHE_TTL = int(os.environ.get("BOT_CACHE_TTL", 60))
+BATCH_GET_SIZE = 100  # Max number of keys per `BatchGetItem`
 
 DEFAULT_GENERATION_CONFIG = (
     DEFAULT_MISTRAL_GENERATION_CONFIG
@@ -48,6 +62,92 @@ DEFAULT_GENERATION_CONFIG = (
 logger = logging.getLogger(__name__)
 sts_client = boto3.client("sts")
 
+# bot_id -> BotModel, shared by owned and public lookups.
+# Writes through this module invalidate the entry right away. Changes made by other
+# instances are detected by the `Version` of the bot item, which is checked on every hit.
+# See `find_cached_bot`.
+bot_cache: TTLCache[str, BotModel] = TTLCache(
+    maxsize=BOT_CACHE_MAX_SIZE, ttl=BOT_CACHE_TTL
+)
+
+
+def invalidate_bot_cache(bot_id: str):
+    bot_cache.pop(bot_id)
+
+
+def find_cached_bot(user_id: str, bot_id: str) -> tuple[bool, BotModel] | None:
+    """Find the bot in `bot_cache` if it is still the latest version.
+    The bot may have been modified, closed, removed or embedded again on another instance,
+    so only its `Version` is read before the cached bot is used. Returns a tuple of whether
+    the bot is owned by the user and a copy of the cached bot, or None if the bot is not
+    cached or the entry is stale.
+    NOTE: `LastBotUsed` and `IsPinned` are not versioned, because they are written on use.
+    """
+    cached = bot_cache.get(bot_id)
+    if cached is None:
+        return None
+    owned = cached.owner_user_id == user_id
+    if not owned and cached.public_bot_id is None:
+        # Private bot of another user
+        return None
+
+    response = _get_table_public_client().get_item(
+        Key={
+            "PK": cached.owner_user_id,
+            "SK": compose_bot_id(cached.owner_user_id, bot_id),
+        },
+        ProjectionExpression="Version",
+    )
+    item = response.get("Item")
+    if item is None or int(item.get("Version", 0)) != cached.version:
+        invalidate_bot_cache(bot_id)
+        return None
+    # NOTE: Copied, so that callers never modify the shared entry.
+    return owned, cached.model_copy(deep=True)
+
+
+def find_cached_public_bots(bot_ids: list[str]) -> dict[str, BotModel]:
+    """Find the public bots in `bot_cache` which are still the latest version.
+    Same as `find_cached_bot`, but the versions of all bots are read by batches.
+    Returns copies of the cached bots by id. Bots which are not cached or stale are not
+    included in the result.
+    """
+    cached: dict[str, BotModel] = {}
+    for bot_id in bot_ids:
+        bot = bot_cache.get(bot_id)
+        if bot is not None and bot.public_bot_id is not None:
+            cached[bot_id] = bot
+    if not cached:
+        return {}
+
+    dynamodb = _get_aws_resource("dynamodb")
+    keys = [
+        {"PK": bot.owner_user_id, "SK": compose_bot_id(bot.owner_user_id, bot_id)}
+        for bot_id, bot in cached.items()
+    ]
+    versions: dict[str, int] = {}
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {
+            TABLE_NAME: {
+                "Keys": keys[i : i + BATCH_GET_SIZE],
+                "ProjectionExpression": "SK, Version",
+            }
+        }
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response["Responses"].get(TABLE_NAME, []):
+                versions[decompose_bot_id(item["SK"])] = int(item.get("Version", 0))
+            request_items = response.get("UnprocessedKeys")
+
+    found: dict[str, BotModel] = {}
+    for bot_id, bot in cached.items():
+        if versions.get(bot_id) != bot.version:
+            invalidate_bot_cache(bot_id)
+            continue
+        # NOTE: Copied, so that callers never modify the shared entry.
+        found[bot_id] = bot.model_copy(deep=True)
+    return found
+
 
 def store_bot(user_id: str, custom_bot: BotModel):
     table = _get_table_client(user_id)
@@ -77,9 +177,17 @@ def store_bot(user_id: str, custom_bot: BotModel):
         "ConversationQuickStarters": [
             starter.model_dump() for starter in custom_bot.conversation_quick_starters
         ],
+        # Key of the sparse `OwnedBotIndex`. Not set for aliases.
+        "OwnedBotUserId": user_id,
+        "VectorSnapshot": custom_bot.vector_snapshot,
+        "Version": custom_bot.version + 1,
     }
+    if custom_bot.published_api_stack_name:
+        # Sort key of the sparse `PublishedBotIndex`
+        item["PublishedBotId"] = custom_bot.id
 
     response = table.put_item(Item=item)
+    invalidate_bot_cache(custom_bot.id)
     return response
 
 
@@ -119,7 +227,8 @@ def update_bot(
             "GenerationParams = :generation_params, "
             "SearchParams = :search_params, "
             "DisplayRetrievedChunks = :display_retrieved_chunks, "
-            "ConversationQuickStarters = :conversation_quick_starters",
+            "ConversationQuickStarters = :conversation_quick_starters "
+            "ADD Version :one",
             ExpressionAttributeValues={
                 ":title": title,
                 ":description": description,
@@ -135,6 +244,7 @@ def update_bot(
                 ":conversation_quick_starters": [
                     starter.model_dump() for starter in conversation_quick_starters
                 ],
+                ":one": 1,
             },
             ReturnValues="ALL_NEW",
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
@@ -145,14 +255,12 @@ def update_bot(
         else:
             raise e
 
+    invalidate_bot_cache(bot_id)
     return response
 
 
-def store_alias(user_id: str, alias: BotAliasModel):
-    table = _get_table_client(user_id)
-    logger.info(f"Storing alias: {alias}")
-
-    item = {
+def _compose_alias_item(user_id: str, alias: BotAliasModel) -> dict:
+    return {
         "PK": user_id,
         "SK": compose_bot_alias_id(user_id, alias.id),
         "Title": alias.title,
@@ -169,46 +277,75 @@ def store_alias(user_id: str, alias: BotAliasModel):
         ],
     }
 
-    response = table.put_item(Item=item)
+
+def store_alias(user_id: str, alias: BotAliasModel):
+    table = _get_table_client(user_id)
+    logger.info(f"Storing alias: {alias}")
+
+    response = table.put_item(Item=_compose_alias_item(user_id, alias))
     return response
 
 
-def update_bot_last_used_time(user_id: str, bot_id: str):
-    """Update last used time for bot."""
+def store_aliases(user_id: str, aliases: list[BotAliasModel]):
+    """Store the aliases by batches of `BatchWriteItem`."""
     table = _get_table_client(user_id)
-    logger.info(f"Updating last used time for bot: {bot_id}")
-    try:
-        response = table.update_item(
-            Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET LastBotUsed = :val",
-            ExpressionAttributeValues={":val": decimal(get_current_time())},
-            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-        else:
-            raise e
-    return response
+    logger.info(f"Storing aliases: {[alias.id for alias in aliases]}")
+
+    with table.batch_writer() as writer:
+        for alias in aliases:
+            writer.put_item(Item=_compose_alias_item(user_id, alias))
 
 
-def update_alias_last_used_time(user_id: str, alias_id: str):
-    """Update last used time for alias."""
+def _update_last_used_time(user_id: str, sk: str, min_interval: int):
+    """Update `LastBotUsed` of the item unless it was updated within `min_interval`
+    milliseconds. Returns `False` if the item does not exist.
+    """
     table = _get_table_client(user_id)
-    logger.info(f"Updating last used time for alias: {alias_id}")
+    current_time = get_current_time()
     try:
-        response = table.update_item(
-            Key={"PK": user_id, "SK": compose_bot_alias_id(user_id, alias_id)},
+        table.update_item(
+            Key={"PK": user_id, "SK": sk},
             UpdateExpression="SET LastBotUsed = :val",
-            ExpressionAttributeValues={":val": decimal(get_current_time())},
-            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+            ExpressionAttributeValues={
+                ":val": decimal(current_time),
+                ":threshold": decimal(current_time - min_interval),
+            },
+            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK) "
+            "AND (attribute_not_exists(LastBotUsed) OR LastBotUsed < :threshold)",
+            # To distinguish a recent update from a missing item
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
         )
     except ClientError as e:
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            raise RecordNotFoundError(f"Alias with id {alias_id} not found")
+            if "Item" in e.response:
+                logger.info(f"Last used time of {sk} is recent enough. Skipped.")
+                return True
+            return False
         else:
             raise e
-    return response
+    return True
+
+
+def update_bot_last_used_time(user_id: str, bot_id: str, min_interval: int = 0):
+    """Update last used time for bot.
+    The update is skipped if the last used time is within `min_interval` milliseconds.
+    """
+    logger.info(f"Updating last used time for bot: {bot_id}")
+    if not _update_last_used_time(
+        user_id, compose_bot_id(user_id, bot_id), min_interval
+    ):
+        raise RecordNotFoundError(f"Bot with id {bot_id} not found")
+
+
+def update_alias_last_used_time(user_id: str, alias_id: str, min_interval: int = 0):
+    """Update last used time for alias.
+    The update is skipped if the last used time is within `min_interval` milliseconds.
+    """
+    logger.info(f"Updating last used time for alias: {alias_id}")
+    if not _update_last_used_time(
+        user_id, compose_bot_alias_id(user_id, alias_id), min_interval
+    ):
+        raise RecordNotFoundError(f"Alias with id {alias_id} not found")
 
 
 def update_bot_pin_status(user_id: str, bot_id: str, pinned: bool):
@@ -259,36 +396,28 @@ def find_private_bots_by_user_id(
     table = _get_table_client(user_id)
     logger.info(f"Finding bots for user: {user_id}")
 
-    query_params = {
-        "IndexName": "LastBotUsedIndex",
-        "KeyConditionExpression": Key("PK").eq(user_id),
-        "ScanIndexForward": False,
-        # NOTE: Filter out alias bots (public shared bots)
-        "FilterExpression": Attr("OriginalBotId").not_exists()
-        | Attr("OriginalBotId").eq(""),
-    }
+    if ENABLE_BOT_INDEXES:
+        # NOTE: `OwnedBotIndex` is sparse. Alias bots (public shared bots) are not
+        # indexed, so `Limit` is exact and no filter is needed.
+        query_params = {
+            "IndexName": "OwnedBotIndex",
+            "KeyConditionExpression": Key("OwnedBotUserId").eq(user_id),
+            "ScanIndexForward": False,
+        }
+        if limit:
+            query_params["Limit"] = limit
+    else:
+        query_params = {
+            "IndexName": "LastBotUsedIndex",
+            "KeyConditionExpression": Key("PK").eq(user_id),
+            "ScanIndexForward": False,
+            # NOTE: Filter out alias bots (public shared bots)
+            "FilterExpression": Attr("OriginalBotId").not_exists()
+            | Attr("OriginalBotId").eq(""),
+        }
 
-    response = table.query(**query_params)
-    bots = [
-        BotMeta(
-            id=decompose_bot_id(item["SK"]),
-            title=item["Title"],
-            create_time=float(item["CreateTime"]),
-            last_used_time=float(item["LastBotUsed"]),
-            owned=True,
-            available=True,
-            is_pinned=item["IsPinned"],
-            description=item["Description"],
-            is_public="PublicBotId" in item,
-            sync_status=item["SyncStatus"],
-        )
-        for item in response["Items"]
-    ]
-
-    query_count = 1
-    MAX_QUERY_COUNT = 5
-    while "LastEvaluatedKey" in response:
-        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    bots = []
+    while True:
         response = table.query(**query_params)
         bots.extend(
             [
@@ -307,14 +436,11 @@ def find_private_bots_by_user_id(
                 for item in response["Items"]
             ]
         )
-        query_count += 1
-        if limit and len(bots) >= limit:
-            # NOTE: `Limit` in query params is evaluated after filter expression.
-            # So limit manually here.
-            break
-        if query_count > MAX_QUERY_COUNT:
-            logger.warning(f"Query count exceeded {MAX_QUERY_COUNT}")
+        # NOTE: Without the index, `Limit` would be evaluated before the filter
+        # expression, so pages are read until enough bots are found.
+        if (limit and len(bots) >= limit) or "LastEvaluatedKey" not in response:
             break
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
 
     if limit:
         bots = bots[:limit]
@@ -327,13 +453,13 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
     """Find private bot."""
     table = _get_table_client(user_id)
     logger.info(f"Finding bot with id: {bot_id}")
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_id(user_id, bot_id)),
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
+        ConsistentRead=True,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-    item = response["Items"][0]
+    item = response["Item"]
 
     if "OriginalBotId" in item:
         raise RecordNotFoundError(f"Bot with id {bot_id} is alias")
@@ -376,10 +502,10 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
             )
         ),
         search_params=SearchParamsModel(
-            max_results=(
-                item["SearchParams"]["max_results"]
+            **(
+                item["SearchParams"]
                 if "SearchParams" in item
-                else DEFAULT_SEARCH_CONFIG["max_results"]
+                else DEFAULT_SEARCH_CONFIG
             )
         ),
         agent=(
@@ -406,6 +532,8 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
         ),
         display_retrieved_chunks=item.get("DisplayRetrievedChunks", False),
         conversation_quick_starters=item.get("ConversationQuickStarters", []),
+        vector_snapshot=item.get("VectorSnapshot"),
+        version=int(item.get("Version", 0)),
     )
 
     logger.info(f"Found bot: {bot}")
@@ -423,8 +551,46 @@ def find_public_bot_by_id(bot_id: str) -> BotModel:
     if len(response["Items"]) == 0:
         raise RecordNotFoundError(f"Public bot with id {bot_id} not found")
 
-    item = response["Items"][0]
-    bot = BotModel(
+    bot = _to_public_bot_model(response["Items"][0])
+    logger.info(f"Found public bot: {bot}")
+    return bot
+
+
+def find_public_bots_by_ids_concurrently(
+    bot_ids: list[str], max_workers: int = 10
+) -> dict[str, BotModel]:
+    """Find public bots by ids, querying up to `max_workers` of them at a time.
+    Removed (or closed) bots are not included in the result.
+    NOTE: Resources and table clients are not thread safe, so the worker threads share
+    a low-level client instead.
+    """
+    if not bot_ids:
+        return {}
+    client = _get_aws_low_level_client("dynamodb")
+    deserializer = TypeDeserializer()
+
+    def find(bot_id: str) -> BotModel | None:
+        response = client.query(
+            TableName=TABLE_NAME,
+            IndexName="PublicBotIdIndex",
+            KeyConditionExpression="PublicBotId = :bot_id",
+            ExpressionAttributeValues={":bot_id": {"S": bot_id}},
+        )
+        if len(response["Items"]) == 0:
+            return None
+        item = {k: deserializer.deserialize(v) for k, v in response["Items"][0].items()}
+        return _to_public_bot_model(item)
+
+    with ThreadPoolExecutor(max_workers=min(len(bot_ids), max_workers)) as executor:
+        return {
+            bot_id: bot
+            for bot_id, bot in zip(bot_ids, executor.map(find, bot_ids))
+            if bot is not None
+        }
+
+
+def _to_public_bot_model(item: dict) -> BotModel:
+    return BotModel(
         id=decompose_bot_id(item["SK"]),
         title=item["Title"],
         description=item["Description"],
@@ -462,10 +628,10 @@ def find_public_bot_by_id(bot_id: str) -> BotModel:
             )
         ),
         search_params=SearchParamsModel(
-            max_results=(
-                item["SearchParams"]["max_results"]
+            **(
+                item["SearchParams"]
                 if "SearchParams" in item
-                else DEFAULT_SEARCH_CONFIG["max_results"]
+                else DEFAULT_SEARCH_CONFIG
             )
         ),
         agent=(
@@ -492,22 +658,22 @@ def find_public_bot_by_id(bot_id: str) -> BotModel:
         ),
         display_retrieved_chunks=item.get("DisplayRetrievedChunks", False),
         conversation_quick_starters=item.get("ConversationQuickStarters", []),
+        vector_snapshot=item.get("VectorSnapshot"),
+        version=int(item.get("Version", 0)),
     )
-    logger.info(f"Found public bot: {bot}")
-    return bot
 
 
 def find_alias_by_id(user_id: str, alias_id: str) -> BotAliasModel:
     """Find alias bot by id."""
     table = _get_table_client(user_id)
     logger.info(f"Finding alias bot with id: {alias_id}")
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_alias_id(user_id, alias_id)),
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_bot_alias_id(user_id, alias_id)},
+        ConsistentRead=True,
     )
-    if len(response["Items"]) == 0:
+    if "Item" not in response:
         raise RecordNotFoundError(f"Alias bot with id {alias_id} not found")
-    item = response["Items"][0]
+    item = response["Item"]
 
     bot = BotAliasModel(
         id=decompose_bot_alias_id(item["SK"]),
@@ -532,27 +698,27 @@ def update_bot_visibility(user_id: str, bot_id: str, visible: bool):
     table = _get_table_client(user_id)
     logger.info(f"Making bot public: {bot_id}")
 
-    response = table.query(
-        IndexName="SKIndex",
-        KeyConditionExpression=Key("SK").eq(compose_bot_id(user_id, bot_id)),
-    )
-    if len(response["Items"]) == 0:
-        raise RecordNotFoundError(f"Bot with id {bot_id} not found")
-
+    # NOTE: Existence of the bot is checked by the condition expression.
     try:
         if visible:
             # To visible (open to public)
             response = table.update_item(
                 Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-                UpdateExpression="SET PublicBotId = :val",
-                ExpressionAttributeValues={":val": bot_id},
+                # NOTE: Published bots enter `PublishedBotIndex` with the partition key.
+                UpdateExpression="SET PublicBotId = :val, PublishedBotPartition = :partition ADD Version :one",
+                ExpressionAttributeValues={
+                    ":val": bot_id,
+                    ":partition": PUBLISHED_BOT_PARTITION,
+                    ":one": 1,
+                },
                 ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
             )
         else:
             # To hide (close to private)
             response = table.update_item(
                 Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-                UpdateExpression="REMOVE PublicBotId",
+                UpdateExpression="REMOVE PublicBotId, PublishedBotPartition ADD Version :one",
+                ExpressionAttributeValues={":one": 1},
                 ReturnValues="ALL_NEW",
                 ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
             )
@@ -562,6 +728,7 @@ def update_bot_visibility(user_id: str, bot_id: str, visible: bool):
         else:
             raise e
 
+    invalidate_bot_cache(bot_id)
     return response
 
 
@@ -574,13 +741,15 @@ def update_bot_publication(
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="SET ApiPublishmentStackName = :val, ApiPublishedDatetime = :time, ApiPublishCodeBuildId = :build_id",
+            UpdateExpression="SET ApiPublishmentStackName = :val, ApiPublishedDatetime = :time, ApiPublishCodeBuildId = :build_id, PublishedBotId = :bot_id ADD Version :one",
             # NOTE: Stack naming rule: ApiPublishmentStack{published_api_id}.
             # See bedrock-chat-stack.ts > `ApiPublishmentStack`
             ExpressionAttributeValues={
                 ":val": f"ApiPublishmentStack{published_api_id}",
                 ":time": current_time,
                 ":build_id": build_id,
+                ":bot_id": bot_id,
+                ":one": 1,
             },
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
@@ -590,6 +759,7 @@ def update_bot_publication(
         else:
             raise e
 
+    invalidate_bot_cache(bot_id)
     return response
 
 
@@ -599,7 +769,8 @@ def delete_bot_publication(user_id: str, bot_id: str):
     try:
         response = table.update_item(
             Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-            UpdateExpression="REMOVE ApiPublishmentStackName, ApiPublishedDatetime, ApiPublishCodeBuildId",
+            UpdateExpression="REMOVE ApiPublishmentStackName, ApiPublishedDatetime, ApiPublishCodeBuildId, PublishedBotId ADD Version :one",
+            ExpressionAttributeValues={":one": 1},
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
     except ClientError as e:
@@ -608,6 +779,7 @@ def delete_bot_publication(user_id: str, bot_id: str):
         else:
             raise e
 
+    invalidate_bot_cache(bot_id)
     return response
 
 
@@ -626,6 +798,7 @@ def delete_bot_by_id(user_id: str, bot_id: str):
         else:
             raise e
 
+    invalidate_bot_cache(bot_id)
     return response
 
 
@@ -695,18 +868,33 @@ def find_all_published_bots(
     """Find all published bots. This method is intended for administrator use."""
     table = _get_table_public_client()
 
-    query_params = {
-        "IndexName": "PublicBotIdIndex",
-        "FilterExpression": Attr("ApiPublishmentStackName").exists()
-        & Attr("ApiPublishmentStackName").ne(None),
-        "Limit": limit,
-    }
+    if ENABLE_BOT_INDEXES:
+        # NOTE: `PublishedBotIndex` is sparse and contains only the bots which are both
+        # public and published, so the query needs no filter. `Limit` is the number of
+        # bots returned, and the next token continues right after the last one.
+        query_params = {
+            "IndexName": "PublishedBotIndex",
+            "KeyConditionExpression": Key("PublishedBotPartition").eq(
+                PUBLISHED_BOT_PARTITION
+            ),
+            "Limit": limit,
+        }
+    else:
+        query_params = {
+            "IndexName": "PublicBotIdIndex",
+            "FilterExpression": Attr("ApiPublishmentStackName").exists()
+            & Attr("ApiPublishmentStackName").ne(None),
+            "Limit": limit,
+        }
     if next_token:
         query_params["ExclusiveStartKey"] = json.loads(
             base64.b64decode(next_token).decode("utf-8")
         )
 
-    response = table.scan(**query_params)
+    if ENABLE_BOT_INDEXES:
+        response = table.query(**query_params)
+    else:
+        response = table.scan(**query_params)
 
     bots = [
         BotMetaWithStackInfo(
@@ -0,0 +1,118 @@
+"""Content-addressed storage of images attached to conversations.
+Images are stored once per conversation in S3 under the hash of their content, and
+messages keep only a reference to the object. The image is resolved when it is actually
+sent to the model.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+
+import boto3
+from app.cache import TTLCache
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+s3_client = boto3.client("s3")
+
+LARGE_MESSAGE_BUCKET = os.environ.get("LARGE_MESSAGE_BUCKET")
+# NOTE: `:` never appears in base64, so a reference cannot be confused with an inline image.
+IMAGE_REFERENCE_SCHEME = "s3image://"
+IMAGE_CACHE_MAX_SIZE = int(os.environ.get("IMAGE_CACHE_MAX_SIZE", 16))
+# Seconds to trust that a stored image still exists. Images may be deleted together with
+# their conversation on another instance.
+STORED_KEY_CACHE_TTL = 300
+
+# Object keys known to exist, to skip uploading identical images again.
+_stored_keys: TTLCache[str, bool] = TTLCache(maxsize=4096, ttl=STORED_KEY_CACHE_TTL)
+# Object key -> base64 body. Objects are immutable, so entries only go stale on deletion.
+_body_cache: TTLCache[str, str] = TTLCache(maxsize=IMAGE_CACHE_MAX_SIZE)
+
+
+def compose_image_prefix(user_id: str, conversation_id: str | None = None) -> str:
+    """Prefix of the images of the user, or of the conversation if given.
+    NOTE: Images stored before they were grouped by conversation are directly under the
+    prefix of the user, and are deleted only with all conversations of the user.
+    """
+    if conversation_id is None:
+        return f"{user_id}/images/"
+    return f"{user_id}/images/{conversation_id}/"
+
+
+def is_image_reference(body: str) -> bool:
+    return body.startswith(IMAGE_REFERENCE_SCHEME)
+
+
+def _object_exists(key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=LARGE_MESSAGE_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise e
+
+
+def store_image(
+    user_id: str, conversation_id: str, body: str, media_type: str | None
+) -> str:
+    """Store the base64 encoded image and return the reference to it.
+    Identical images in the same conversation are stored only once.
+    """
+    if is_image_reference(body):
+        return body
+
+    data = base64.b64decode(body)
+    digest = hashlib.sha256(data).hexdigest()
+    key = f"{compose_image_prefix(user_id, conversation_id)}{digest}"
+
+    if key not in _stored_keys and not _object_exists(key):
+        logger.info(f"Storing image: {key}")
+        s3_client.put_object(
+            Bucket=LARGE_MESSAGE_BUCKET,
+            Key=key,
+            Body=data,
+            **({"ContentType": media_type} if media_type else {}),
+        )
+    _stored_keys.set(key, True)
+    return f"{IMAGE_REFERENCE_SCHEME}{key}"
+
+
+def resolve_image_body(body: str) -> str:
+    """Return the base64 encoded image. Inline bodies are returned as is."""
+    if not is_image_reference(body):
+        return body
+
+    key = body[len(IMAGE_REFERENCE_SCHEME) :]
+    cached = _body_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = s3_client.get_object(Bucket=LARGE_MESSAGE_BUCKET, Key=key)
+    resolved = base64.b64encode(response["Body"].read()).decode("utf-8")
+    _body_cache.set(key, resolved)
+    return resolved
+
+
+def delete_images_by_user_id(user_id: str):
+    """Delete all images of the user."""
+    _delete_images(compose_image_prefix(user_id))
+
+
+def delete_images_by_conversation_id(user_id: str, conversation_id: str):
+    """Delete the images of the conversation."""
+    _delete_images(compose_image_prefix(user_id, conversation_id))
+
+
+def _delete_images(prefix: str):
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=LARGE_MESSAGE_BUCKET, Prefix=prefix):
+        objects = [{"Key": o["Key"]} for o in page.get("Contents", [])]
+        if objects:
+            s3_client.delete_objects(
+                Bucket=LARGE_MESSAGE_BUCKET, Delete={"Objects": objects}
+            )
+        for o in objects:
+            _stored_keys.pop(o["Key"])
+            _body_cache.pop(o["Key"])
@@ -1,5 +1,5 @@
 from app.repositories.models.common import Float
-from app.routes.schemas.bot import type_sync_status
+from app.routes.schemas.bot import type_search_mode, type_sync_status
 from pydantic import BaseModel
 
 
@@ -41,6 +41,12 @@ class GenerationParamsModel(BaseModel):
 
 class SearchParamsModel(BaseModel):
     max_results: int
+    search_mode: type_search_mode = "vector"
+    vector_weight: Float = 1.0
+    keyword_weight: Float = 1.0
+    enable_mmr: bool = False
+    mmr_lambda: Float = 0.5
+    min_similarity: Float | None = None
 
 
 class AgentToolModel(BaseModel):
@@ -81,6 +87,11 @@ class BotModel(BaseModel):
     published_api_codebuild_id: str | None
     display_retrieved_chunks: bool
     conversation_quick_starters: list[ConversationQuickStarterModel]
+    # Whether the embedding job exported a snapshot for the in-process vector store.
+    # None if the bot was synced before it was recorded.
+    vector_snapshot: bool | None = None
+    # Incremented on every write of the bot item. Used to validate cached bots.
+    version: int = 0
 
     def has_knowledge(self) -> bool:
         return (
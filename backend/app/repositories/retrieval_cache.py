@@ -0,0 +1,46 @@
+"""Retrieval results shared between the chat and the related-documents API.
+Items are stored in the partition of the user and expire by the TTL attribute `ExpireTime`.
+NOTE: DynamoDB deletes expired items only eventually, so the expiry is also checked on read.
+"""
+
+import logging
+import time
+
+from app.repositories import codec
+from app.repositories.common import _get_table_client, compose_retrieval_cache_id
+
+logger = logging.getLogger(__name__)
+
+# Larger results are not cached, which keeps the item under the limit of DynamoDB (400KB).
+THRESHOLD_LARGE_RESULTS = 300 * 1024  # 300KB
+
+
+def store_retrieval_results(
+    user_id: str, cache_key: str, results: list[dict], ttl: int
+):
+    encoded = codec.encode(results)
+    if len(encoded) > THRESHOLD_LARGE_RESULTS:
+        logger.info(f"Retrieval results are too large to cache: {len(encoded)} bytes")
+        return
+
+    table = _get_table_client(user_id)
+    table.put_item(
+        Item={
+            "PK": user_id,
+            "SK": compose_retrieval_cache_id(user_id, cache_key),
+            "Results": encoded,
+            "ExpireTime": int(time.time()) + ttl,
+        }
+    )
+
+
+def find_retrieval_results(user_id: str, cache_key: str) -> list[dict] | None:
+    """Find the cached results, or return None if they are missing or expired."""
+    table = _get_table_client(user_id)
+    response = table.get_item(
+        Key={"PK": user_id, "SK": compose_retrieval_cache_id(user_id, cache_key)}
+    )
+    item = response.get("Item")
+    if item is None or item["ExpireTime"] <= time.time():
+        return None
+    return codec.decode(item["Results"])
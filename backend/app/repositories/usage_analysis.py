@@ -7,6 +7,7 @@ from datetime import date, timedelta
 from functools import partial
 
 import boto3
+from app.repositories.common import PUBLISHED_API_PARTITION_KEY_PATTERN
 from app.repositories.custom_bot import find_public_bots_by_ids
 from app.repositories.models.usage_analysis import UsagePerBot, UsagePerUser
 
@@ -214,27 +215,11 @@ LIMIT {limit};
     return bot_usage
 
 
-async def find_users_sorted_by_price(
-    limit: int = 20,
-    from_: str | None = None,
-    to_: str | None = None,
-) -> list[UsagePerUser]:
-    assert 1 <= limit <= 1000, "Limit must be between 1 and 1000."
-
-    assert (from_ and to_) or (
-        not from_ and not to_
-    ), "Both from_ and to_ must be specified or omitted."
-
-    if from_ is not None and to_ is not None:
-        from_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", from_)  # type: ignore
-        to_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", to_)  # type: ignore
-    else:
-        today = date.today()
-        from_str = today.strftime("%Y/%m/%d/00")
-        to_str = today.strftime("%Y/%m/%d/23")
-
-    # To avoid duplication of conversation, apply most the latest conversation by using subquery
-    query = f"""
+def _compose_users_sorted_by_price_query(limit: int, from_str: str, to_str: str) -> str:
+    # To avoid duplication of conversation, apply most the latest conversation by using subquery.
+    # Conversations of a published API are spread over sharded partition keys, so the shard
+    # suffix is removed to aggregate them per API.
+    return f"""
 WITH LatestRecords AS (
     SELECT
         newimage.PK.S AS UserId,
@@ -263,7 +248,7 @@ PreAggregatedData AS (
 ),
 AggregatedData AS (
     SELECT
-        p.UserId,
+        regexp_replace(p.UserId, '{PUBLISHED_API_PARTITION_KEY_PATTERN}', '$1') AS UserId,
         p.TotalPrice
     FROM
         PreAggregatedData p
@@ -282,6 +267,27 @@ ORDER BY
 LIMIT {limit};
 """
 
+
+async def find_users_sorted_by_price(
+    limit: int = 20,
+    from_: str | None = None,
+    to_: str | None = None,
+) -> list[UsagePerUser]:
+    assert 1 <= limit <= 1000, "Limit must be between 1 and 1000."
+
+    assert (from_ and to_) or (
+        not from_ and not to_
+    ), "Both from_ and to_ must be specified or omitted."
+
+    if from_ is not None and to_ is not None:
+        from_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", from_)  # type: ignore
+        to_str = re.sub(r"(\d{4})(\d{2})(\d{2})(\d{2})", r"\1/\2/\3/\4", to_)  # type: ignore
+    else:
+        today = date.today()
+        from_str = today.strftime("%Y/%m/%d/00")
+        to_str = today.strftime("%Y/%m/%d/23")
+
+    query = _compose_users_sorted_by_price_query(limit, from_str, to_str)
     logger.debug(query)
     response = await run_athena_query(
         query,
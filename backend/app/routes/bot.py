@@ -96,7 +96,9 @@ def get_all_bots(
         bots = find_private_bots_by_user_id(current_user.id, limit=limit)
     elif kind == "mixed":
         bots = fetch_all_bots_by_user_id(
-            current_user.id, limit=limit, only_pinned=pinned
+            current_user.id,
+            limit=limit,
+            only_pinned=pinned,
         )
     else:
         raise ValueError(f"Invalid kind: {kind}")
@@ -160,6 +162,12 @@ def get_private_bot(request: Request, bot_id: str):
         ),
         search_params=SearchParams(
             max_results=bot.search_params.max_results,
+            search_mode=bot.search_params.search_mode,
+            vector_weight=bot.search_params.vector_weight,
+            keyword_weight=bot.search_params.keyword_weight,
+            enable_mmr=bot.search_params.enable_mmr,
+            mmr_lambda=bot.search_params.mmr_lambda,
+            min_similarity=bot.search_params.min_similarity,
         ),
         sync_status=bot.sync_status,
         sync_status_reason=bot.sync_status_reason,
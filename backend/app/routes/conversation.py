@@ -3,6 +3,7 @@ from app.repositories.conversation import (
     delete_conversation_by_id,
     delete_conversation_by_user_id,
     find_conversation_by_user_id,
+    find_conversation_page_by_user_id,
     update_feedback,
 )
 from app.repositories.models.conversation import FeedbackModel
@@ -24,7 +25,7 @@ from app.usecases.chat import (
     propose_conversation_title,
 )
 from app.user import User
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Query, Request, Response
 
 router = APIRouter(tags=["conversation"])
 
@@ -80,11 +81,25 @@ def remove_conversation(request: Request, conversation_id: str):
 @router.get("/conversations", response_model=list[ConversationMetaOutput])
 def get_all_conversations(
     request: Request,
+    response: Response,
+    limit: int | None = Query(default=None, ge=1, le=100),
+    next_token: str | None = None,
 ):
-    """Get all conversation metadata"""
+    """Get conversation metadata, newest first.
+    If `limit` is given, the token to fetch the next page is returned in the
+    `X-Next-Token` response header.
+    """
     current_user: User = request.state.current_user
 
-    conversations = find_conversation_by_user_id(current_user.id)
+    if limit is None and next_token is None:
+        conversations = find_conversation_by_user_id(current_user.id)
+    else:
+        conversations, next_token = find_conversation_page_by_user_id(
+            current_user.id, limit=limit, next_token=next_token
+        )
+        if next_token:
+            response.headers["X-Next-Token"] = next_token
+
     output = [
         ConversationMetaOutput(
             id=conversation.id,
@@ -13,6 +13,9 @@ if TYPE_CHECKING:
 type_sync_status = Literal[
     "QUEUED", "RUNNING", "SUCCEEDED", "FAILED", "ORIGINAL_NOT_FOUND"
 ]
+# `vector`: Embedding distance only.
+# `hybrid`: Embedding distance and full-text search fused by reciprocal rank fusion.
+type_search_mode = Literal["vector", "hybrid"]
 
 
 class EmbeddingParams(BaseSchema):
@@ -31,6 +34,16 @@ class GenerationParams(BaseSchema):
 
 class SearchParams(BaseSchema):
     max_results: int
+    search_mode: type_search_mode = "vector"
+    # Weights of each ranking on `hybrid` mode
+    vector_weight: float = Field(1.0, ge=0)
+    keyword_weight: float = Field(1.0, ge=0)
+    # Re-select the results by maximal marginal relevance to drop near-duplicate chunks.
+    # `mmr_lambda` is the trade-off between relevance (1.0) and diversity (0.0).
+    enable_mmr: bool = False
+    mmr_lambda: float = Field(0.5, ge=0, le=1)
+    # Results less similar (cosine) to the query than this are dropped.
+    min_similarity: float | None = Field(None, ge=-1, le=1)
 
 
 class AgentTool(BaseSchema):
@@ -1,5 +1,6 @@
 from typing import Literal
 
+from app.repositories.image import is_image_reference
 from app.routes.schemas.base import BaseSchema
 from pydantic import Field, root_validator, validator
 
@@ -26,6 +27,13 @@ class Content(BaseSchema):
     )
     body: str = Field(..., description="Content body. Text or base64 encoded image.")
 
+    @validator("body")
+    def check_body(cls, v, values):
+        # References to stored images are internal and must not be given by clients.
+        if values.get("content_type") == "image" and is_image_reference(v):
+            raise ValueError("body must be a base64 encoded image")
+        return v
+
 
 class FeedbackInput(BaseSchema):
     thumbs_up: bool
@@ -2,6 +2,7 @@ import logging
 import os
 
 from app.agents.utils import get_available_tools, get_tool_by_name
+from app.cache import TTLCache
 from app.config import DEFAULT_EMBEDDING_CONFIG
 from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CONFIG
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG, DEFAULT_SEARCH_CONFIG
@@ -12,12 +13,17 @@ from app.repositories.common import (
     decompose_bot_id,
 )
 from app.repositories.custom_bot import (
+    bot_cache,
     delete_alias_by_id,
     delete_bot_by_id,
     find_alias_by_id,
+    find_cached_bot,
+    find_cached_public_bots,
     find_private_bot_by_id,
     find_public_bot_by_id,
+    find_public_bots_by_ids_concurrently,
     store_alias,
+    store_aliases,
     store_bot,
     update_alias_last_used_time,
     update_alias_pin_status,
@@ -69,6 +75,12 @@ logger = logging.getLogger(__name__)
 
 DOCUMENT_BUCKET = os.environ.get("DOCUMENT_BUCKET", "bedrock-documents")
 ENABLE_MISTRAL = os.environ.get("ENABLE_MISTRAL", "") == "true"
+# Max number of concurrent queries to resolve original bots of aliases
+ALIAS_RESOLUTION_CONCURRENCY = 10
+# Minimum interval in seconds between updates of the last used time of a bot
+LAST_USED_TIME_UPDATE_INTERVAL = int(
+    os.environ.get("LAST_USED_TIME_UPDATE_INTERVAL", 60)
+)
 
 DEFAULT_GENERATION_CONFIG = (
     DEFAULT_MISTRAL_GENERATION_CONFIG
@@ -76,6 +88,11 @@ DEFAULT_GENERATION_CONFIG = (
     else DEFAULT_CLAUDE_GENERATION_CONFIG
 )
 
+# (user_id, bot_id) of bots whose last used time was updated by this instance recently
+_last_used_time_updated: TTLCache[tuple[str, str], bool] = TTLCache(
+    maxsize=1024, ttl=LAST_USED_TIME_UPDATE_INTERVAL
+)
+
 
 def _update_s3_documents_by_diff(
     user_id: str,
@@ -410,13 +427,21 @@ def fetch_bot(user_id: str, bot_id: str) -> tuple[bool, BotModel]:
     `True` means the bot is owned by the user.
     `False` means the bot is shared by another user.
     """
+    cached = find_cached_bot(user_id, bot_id)
+    if cached is not None:
+        return cached
+
     try:
-        return True, find_private_bot_by_id(user_id, bot_id)
+        bot = find_private_bot_by_id(user_id, bot_id)
+        bot_cache.set(bot_id, bot.model_copy(deep=True))
+        return True, bot
     except RecordNotFoundError:
         pass  #
 
     try:
-        return False, find_public_bot_by_id(bot_id)
+        bot = find_public_bot_by_id(bot_id)
+        bot_cache.set(bot_id, bot.model_copy(deep=True))
+        return False, bot
     except RecordNotFoundError:
         raise RecordNotFoundError(
             f"Bot with ID {bot_id} not found in both private (for user {user_id}) and public items."
@@ -424,7 +449,9 @@ def fetch_bot(user_id: str, bot_id: str) -> tuple[bool, BotModel]:
 
 
 def fetch_all_bots_by_user_id(
-    user_id: str, limit: int | None = None, only_pinned: bool = False
+    user_id: str,
+    limit: int | None = None,
+    only_pinned: bool = False,
 ) -> list[BotMeta]:
     """Find all private & shared bots of a user.
     The order is descending by `last_used_time`.
@@ -452,13 +479,17 @@ def fetch_all_bots_by_user_id(
 
     response = table.query(**query_params)
 
+    original_bots = _find_original_bots(
+        [item["OriginalBotId"] for item in response["Items"] if "OriginalBotId" in item]
+    )
+
     bots = []
+    stale_aliases = []
     for item in response["Items"]:
         if "OriginalBotId" in item:
-            # Fetch original bots of alias bots
-            is_original_available = True
-            try:
-                bot = find_public_bot_by_id(item["OriginalBotId"])
+            # Original bots of alias bots
+            bot = original_bots.get(item["OriginalBotId"])
+            if bot is not None:
                 logger.info(f"Found original bot: {bot.id}")
                 meta = BotMeta(
                     id=bot.id,
@@ -472,9 +503,8 @@ def fetch_all_bots_by_user_id(
                     is_public=True,
                     sync_status=bot.sync_status,
                 )
-            except RecordNotFoundError:
+            else:
                 # Original bot is removed
-                is_original_available = False
                 logger.info(f"Original bot {item['OriginalBotId']} has been removed")
                 meta = BotMeta(
                     id=item["OriginalBotId"],
@@ -490,7 +520,7 @@ def fetch_all_bots_by_user_id(
                     sync_status="ORIGINAL_NOT_FOUND",
                 )
 
-            if is_original_available and (
+            if bot is not None and (
                 bot.title != item["Title"]
                 or bot.description != item["Description"]
                 or bot.sync_status != item["SyncStatus"]
@@ -501,9 +531,8 @@ def fetch_all_bots_by_user_id(
                     for starter in item.get("ConversationQuickStarters", [])
                 ]
             ):
-                # Update alias to the latest original bot
-                store_alias(
-                    user_id,
+                # Alias should be updated to the latest original bot
+                stale_aliases.append(
                     BotAliasModel(
                         id=decompose_bot_alias_id(item["SK"]),
                         # Update title and description
@@ -517,7 +546,7 @@ def fetch_all_bots_by_user_id(
                         has_knowledge=bot.has_knowledge(),
                         has_agent=bot.is_agent_enabled(),
                         conversation_quick_starters=bot.conversation_quick_starters,
-                    ),
+                    )
                 )
 
             bots.append(meta)
@@ -538,9 +567,43 @@ def fetch_all_bots_by_user_id(
                 )
             )
 
+    if stale_aliases:
+        # NOTE: Refreshed in place. Tasks after the response are not reliable on Lambda,
+        # which may freeze the execution environment once the response is sent.
+        refresh_aliases(user_id, stale_aliases)
+
     return bots
 
 
+def _find_original_bots(bot_ids: list[str]) -> dict[str, BotModel]:
+    """Find original public bots of aliases concurrently.
+    Removed (or closed) bots are not included in the result.
+    """
+    unique_ids = list(set(bot_ids))
+    original_bots = find_cached_public_bots(unique_ids)
+    missing_ids = [bot_id for bot_id in unique_ids if bot_id not in original_bots]
+
+    found = find_public_bots_by_ids_concurrently(
+        missing_ids, max_workers=ALIAS_RESOLUTION_CONCURRENCY
+    )
+    for bot_id, bot in found.items():
+        bot_cache.set(bot_id, bot.model_copy(deep=True))
+        original_bots[bot_id] = bot
+
+    return original_bots
+
+
+def refresh_aliases(user_id: str, aliases: list[BotAliasModel]):
+    """Update aliases to the latest state of their original bots.
+    Only the aliases which actually changed should be passed. They are written by batches,
+    so that listing bots costs a single round trip per 25 of them.
+    """
+    if not aliases:
+        return
+    logger.info(f"Refreshing aliases: {[alias.id for alias in aliases]}")
+    store_aliases(user_id, aliases)
+
+
 def fetch_bot_summary(user_id: str, bot_id: str) -> BotSummaryOutput:
     try:
         bot = find_private_bot_by_id(user_id, bot_id)
@@ -677,14 +740,26 @@ def remove_bot_by_id(user_id: str, bot_id: str):
 
 
 def modify_bot_last_used_time(user_id: str, bot_id: str):
-    """Modify bot last used time."""
+    """Modify bot last used time.
+    Writes are coalesced: the last used time is updated at most once per
+    `LAST_USED_TIME_UPDATE_INTERVAL` seconds for each user and bot.
+    """
+    key = (user_id, bot_id)
+    if key in _last_used_time_updated:
+        logger.info(f"Last used time of bot {bot_id} was updated recently. Skipped.")
+        return
+
+    min_interval = LAST_USED_TIME_UPDATE_INTERVAL * 1000
     try:
-        return update_bot_last_used_time(user_id, bot_id)
+        update_bot_last_used_time(user_id, bot_id, min_interval=min_interval)
+        _last_used_time_updated.set(key, True)
+        return
     except RecordNotFoundError:
         pass
 
     try:
-        return update_alias_last_used_time(user_id, bot_id)
+        update_alias_last_used_time(user_id, bot_id, min_interval=min_interval)
+        _last_used_time_updated.set(key, True)
     except RecordNotFoundError:
         raise RecordNotFoundError(f"Bot {bot_id} is neither owned nor alias.")
 
@@ -1,6 +1,6 @@
 import logging
-from copy import deepcopy
-from typing import Literal
+from collections import ChainMap
+from typing import Literal, Mapping
 
 from anthropic.types import Message as AnthropicMessage
 from app.agents.agent import AgentExecutor, create_react_agent, format_log_to_str
@@ -19,11 +19,12 @@ from app.prompt import build_rag_prompt
 from app.repositories.conversation import (
     RecordNotFoundError,
     find_conversation_by_id,
+    find_conversation_path,
     store_conversation,
 )
 from app.repositories.custom_bot import find_alias_by_id, store_alias
+from app.repositories.image import resolve_image_body
 from app.repositories.models.conversation import (
-    ChunkModel,
     ContentModel,
     ConversationModel,
     MessageModel,
@@ -44,17 +45,16 @@ from app.routes.schemas.conversation import (
     RelatedDocumentsOutput,
 )
 from app.usecases.bot import fetch_bot, modify_bot_last_used_time
-from app.utils import (
-    get_anthropic_client,
-    get_current_time,
-    is_anthropic_model,
-    is_running_on_lambda,
-)
+from app.utils import get_anthropic_client, get_current_time, is_anthropic_model
 from app.vector_search import (
     SearchResult,
     filter_used_results,
-    get_source_link,
+    find_search_results,
+    get_source_links,
+    is_search_available,
     search_related_docs,
+    store_search_results,
+    to_chunk_models,
 )
 from ulid import ULID
 
@@ -72,8 +72,12 @@ def prepare_conversation(
     bot = None
 
     try:
-        # Fetch existing conversation
-        conversation = find_conversation_by_id(user_id, chat_input.conversation_id)
+        # Fetch existing conversation. Only the messages on the path to the parent are needed.
+        conversation = find_conversation_path(
+            user_id,
+            chat_input.conversation_id,
+            leaf_id=chat_input.message.parent_message_id,
+        )
         logger.info(f"Found conversation: {conversation}")
         parent_id = chat_input.message.parent_message_id
         if chat_input.message.parent_message_id == "system" and chat_input.bot_id:
@@ -214,8 +218,22 @@ def prepare_conversation(
     return (message_id, conversation, bot)
 
 
+def get_updated_message_ids(
+    conversation: ConversationModel, user_msg_id: str, assistant_msg_id: str
+) -> list[str]:
+    """Ids of the messages touched by a chat turn: the parent of the user message (its
+    children are updated), the user message and the assistant message.
+    """
+    parent_id = conversation.message_map[user_msg_id].parent
+    return [
+        message_id
+        for message_id in [parent_id, user_msg_id, assistant_msg_id]
+        if message_id is not None
+    ]
+
+
 def trace_to_root(
-    node_id: str | None, message_map: dict[str, MessageModel]
+    node_id: str | None, message_map: Mapping[str, MessageModel]
 ) -> list[MessageModel]:
     """Trace message map from leaf node to root node."""
     result = []
@@ -245,12 +263,24 @@ def insert_knowledge(
     inserted_prompt = build_rag_prompt(conversation, search_results, display_citation)
     logger.info(f"Inserted prompt: {inserted_prompt}")
 
-    conversation_with_context = deepcopy(conversation)
-    conversation_with_context.message_map["instruction"].content[
-        0
-    ].body = inserted_prompt
-
-    return conversation_with_context
+    # NOTE: The conversation is not copied. Only the instruction is replaced, and the
+    # rest of the message map is shared through an overlay.
+    instruction = conversation.message_map["instruction"]
+    instruction_with_context = instruction.model_copy(
+        update={
+            "content": [
+                instruction.content[0].model_copy(update={"body": inserted_prompt}),
+                *instruction.content[1:],
+            ]
+        }
+    )
+    return conversation.model_copy(
+        update={
+            "message_map": ChainMap(
+                {"instruction": instruction_with_context}, conversation.message_map
+            )
+        }
+    )
 
 
 def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
@@ -316,14 +346,19 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
     else:
         message_map = conversation.message_map
         search_results = []
-        if bot and is_running_on_lambda():
-            # NOTE: `is_running_on_lambda`is a workaround for local testing due to no postgres mock.
+        query: str | None = None
+        if bot and is_search_available(bot.id, bot.vector_snapshot):
+            # NOTE: Without PostgreSQL, only bots with a local vector snapshot can be searched.
             # Fetch most related documents from vector store
             # NOTE: Currently embedding not support multi-modal. For now, use the last content.
             query = conversation.message_map[user_msg_id].content[-1].body
 
             search_results = search_related_docs(
-                bot_id=bot.id, limit=bot.search_params.max_results, query=query
+                bot_id=bot.id,
+                limit=bot.search_params.max_results,
+                query=query,
+                search_params=bot.search_params,
+                vector_snapshot=bot.vector_snapshot,
             )
             logger.info(f"Search results from vector store: {search_results}")
 
@@ -365,19 +400,14 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
         reply_txt = reply_txt.rstrip()
 
         # Used chunks for RAG generation
-        if bot and bot.display_retrieved_chunks and is_running_on_lambda():
+        if bot and bot.display_retrieved_chunks and query is not None:
+            # Reused by `fetch_related_documents`. Stored after the reply, so that the
+            # write does not delay the model call.
+            store_search_results(user_id, bot, query, search_results)
             if len(search_results) > 0:
-                used_chunks = []
-                for r in filter_used_results(reply_txt, search_results):
-                    content_type, source_link = get_source_link(r.source)
-                    used_chunks.append(
-                        ChunkModel(
-                            content=r.content,
-                            content_type=content_type,
-                            source=source_link,
-                            rank=r.rank,
-                        )
-                    )
+                used_chunks = to_chunk_models(
+                    filter_used_results(reply_txt, search_results)
+                )
         if is_anthropic_model(args["model"]):
             # Update total pricing
             input_tokens = response.usage.input_tokens
@@ -407,12 +437,16 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
         conversation.message_map[conversation.last_message_id].content[
             0
         ].body += reply_txt
+        updated_message_ids = [conversation.last_message_id]
     else:
         conversation.message_map[assistant_msg_id] = message
 
         # Append children to parent
         conversation.message_map[user_msg_id].children.append(assistant_msg_id)
         conversation.last_message_id = assistant_msg_id
+        updated_message_ids = get_updated_message_ids(
+            conversation, user_msg_id, assistant_msg_id
+        )
 
     conversation.total_price += price
 
@@ -420,7 +454,7 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
     conversation.should_continue = response.stop_reason == "max_tokens"
 
     # Store updated conversation
-    store_conversation(user_id, conversation)
+    store_conversation(user_id, conversation, message_ids=updated_message_ids)
     # Update bot last used time
     if chat_input.bot_id:
         logger.info("Bot id is provided. Updating bot last used time.")
@@ -488,7 +522,7 @@ def propose_conversation_title(
 </rules>
 """
     # Fetch existing conversation
-    conversation = find_conversation_by_id(user_id, conversation_id)
+    conversation = find_conversation_path(user_id, conversation_id)
 
     messages = trace_to_root(
         node_id=conversation.last_message_id,
@@ -538,7 +572,11 @@ def fetch_conversation(user_id: str, conversation_id: str) -> Conversation:
             content=[
                 Content(
                     content_type=c.content_type,
-                    body=c.body,
+                    body=(
+                        resolve_image_body(c.body)
+                        if c.content_type == "image"
+                        else c.body
+                    ),
                     media_type=c.media_type,
                 )
                 for c in message.content
@@ -604,21 +642,26 @@ def fetch_related_documents(
     if not bot.display_retrieved_chunks:
         return None
 
-    chunks = search_related_docs(
-        bot_id=bot.id,
-        limit=bot.search_params.max_results,
-        query=chat_input.message.content[-1].body,
-    )
-
-    documents = []
-    for chunk in chunks:
-        content_type, source_link = get_source_link(chunk.source)
-        documents.append(
-            RelatedDocumentsOutput(
-                chunk_body=chunk.content,
-                content_type=content_type,
-                source_link=source_link,
-                rank=chunk.rank,
-            )
+    # NOTE: The chat usually has just searched the same query.
+    query = chat_input.message.content[-1].body
+    chunks = find_search_results(user_id, bot, query)
+    if chunks is None:
+        chunks = search_related_docs(
+            bot_id=bot.id,
+            limit=bot.search_params.max_results,
+            query=query,
+            search_params=bot.search_params,
+            vector_snapshot=bot.vector_snapshot,
+        )
+        store_search_results(user_id, bot, query, chunks)
+
+    source_links = get_source_links([chunk.source for chunk in chunks])
+    return [
+        RelatedDocumentsOutput(
+            chunk_body=chunk.content,
+            content_type=content_type,
+            source_link=source_link,
+            rank=chunk.rank,
         )
-    return documents
+        for chunk, (content_type, source_link) in zip(chunks, source_links)
+    ]
@@ -1,14 +1,13 @@
-import json
 import logging
 import os
 from datetime import datetime
 from typing import Any, List, Literal
 
 import boto3
-import pg8000
 from anthropic import AnthropicBedrock
+from app.cache import TTLCache
+from app.postgres import connection_pool
 from app.repositories.models.conversation import MessageModel
-from aws_lambda_powertools.utilities import parameters
 from botocore.client import Config
 from botocore.exceptions import ClientError
 
@@ -19,7 +18,17 @@ BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
 PUBLISH_API_CODEBUILD_PROJECT_NAME = os.environ.get(
     "PUBLISH_API_CODEBUILD_PROJECT_NAME", ""
 )
-DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
+# Presigned download URLs are reused until this many seconds before they expire.
+PRESIGNED_URL_REFRESH_MARGIN = 300
+# Presigned download URLs are reused for at most this many seconds.
+# NOTE: A URL stops working when the credentials which signed it expire, and the expiry
+# of the temporary credentials on Lambda (environment variables) is unknown. The memo is
+# kept short, so that it never outlives them in practice.
+PRESIGNED_URL_CACHE_TTL = 300
+
+# (bucket, key, expiration) -> presigned download URL
+presigned_url_cache: TTLCache[tuple[str, str, int], str] = TTLCache(maxsize=1024)
+_signing_client: Any = None
 
 
 def is_running_on_lambda():
@@ -45,6 +54,21 @@ def get_current_time():
     return int(datetime.now().timestamp() * 1000)
 
 
+def get_signing_s3_client():
+    """S3 client to generate presigned URLs.
+    Created once and reused, because creating a client takes tens of milliseconds.
+    """
+    global _signing_client
+    if _signing_client is None:
+        # See: https://github.com/boto/boto3/issues/421#issuecomment-1849066655
+        _signing_client = boto3.client(
+            "s3",
+            region_name=REGION,
+            config=Config(signature_version="v4", s3={"addressing_style": "path"}),
+        )
+    return _signing_client
+
+
 def generate_presigned_url(
     bucket: str,
     key: str,
@@ -52,25 +76,47 @@ def generate_presigned_url(
     expiration=3600,
     client_method: Literal["put_object", "get_object"] = "put_object",
 ):
-    # See: https://github.com/boto/boto3/issues/421#issuecomment-1849066655
-    client = boto3.client(
-        "s3",
-        region_name=REGION,
-        config=Config(signature_version="v4", s3={"addressing_style": "path"}),
-    )
+    """Generate a presigned URL of the object.
+    Download URLs are memoized for a few minutes (and never until shortly before they
+    expire), so that chunks cited repeatedly from the same file are signed only once.
+    """
+    memoize = client_method == "get_object" and content_type is None
+    cache_key = (bucket, key, expiration)
+    if memoize:
+        url = presigned_url_cache.get(cache_key)
+        if url is not None:
+            return url
+
     params = {"Bucket": bucket, "Key": key}
     if content_type:
         params["ContentType"] = content_type
-    response = client.generate_presigned_url(
+    response = get_signing_s3_client().generate_presigned_url(
         ClientMethod=client_method,
         Params=params,
         ExpiresIn=expiration,
         HttpMethod="PUT" if client_method == "put_object" else "GET",
     )
 
+    ttl = min(PRESIGNED_URL_CACHE_TTL, expiration - PRESIGNED_URL_REFRESH_MARGIN)
+    if memoize and ttl > 0:
+        presigned_url_cache.set(cache_key, response, ttl=ttl)
     return response
 
 
+def generate_presigned_urls(
+    objects: list[tuple[str, str]], expiration=3600
+) -> dict[tuple[str, str], str]:
+    """Generate presigned download URLs of the objects (bucket, key) in one pass.
+    Identical objects are signed only once.
+    """
+    return {
+        (bucket, key): generate_presigned_url(
+            bucket, key, expiration=expiration, client_method="get_object"
+        )
+        for bucket, key in dict.fromkeys(objects)
+    }
+
+
 def compose_upload_temp_s3_prefix(user_id: str, bot_id: str) -> str:
     return f"{user_id}/{bot_id}/_temp/"
 
@@ -170,6 +216,7 @@ def query_postgres(
     include_columns: bool = False,
 ) -> tuple:
     """Query the PostgreSQL and return the results.
+    The connection is borrowed from the pool and returned after the query.
     Args:
         query (str): The SQL query to execute.
         params (tuple, optional): The parameters for the query template. Defaults to None.
@@ -180,28 +227,15 @@ def query_postgres(
         example: ((1, 'Alice'), (2, 'Bob')) if include_columns is False
                  (('id', 'name'), (1, 'Alice'), (2, 'Bob')) if include_columns is True
     """
-    secrets: Any = parameters.get_secret(DB_SECRETS_ARN)  # type: ignore
-    db_info = json.loads(secrets)
-
-    conn = pg8000.connect(
-        database=db_info["dbname"],
-        host=db_info["host"],
-        port=db_info["port"],
-        user=db_info["username"],
-        password=db_info["password"],
-    )
-
     args = params if params else ()
     try:
-        with conn.cursor() as cursor:
+        with connection_pool.connection() as conn, conn.cursor() as cursor:
             cursor.execute(query, args=args)
             res = cursor.fetchall()
             columns = tuple([desc[0] for desc in cursor.description])
     except Exception as e:
         logger.error(f"Error executing query: {e}")
         raise e
-    finally:
-        conn.close()
 
     logger.debug(f"{len(res)} records found.")
 
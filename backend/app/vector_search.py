@@ -1,20 +1,54 @@
+import hashlib
 import json
 import logging
+import os
 import re
 from typing import Any, Literal
 
-from app.bedrock import calculate_query_embedding
-from app.utils import generate_presigned_url, query_postgres
+import numpy as np
+from app.bedrock import (
+    calculate_query_embedding,
+    calculate_query_embeddings,
+    normalize_query,
+)
+from app.cache import TTLCache
+from app.repositories.models.conversation import ChunkModel
+from app.repositories.models.custom_bot import BotModel, SearchParamsModel
+from app.repositories.retrieval_cache import (
+    find_retrieval_results,
+    store_retrieval_results,
+)
+from app.utils import generate_presigned_urls, is_running_on_lambda
+from app.vector_stores import in_process
+from app.vector_stores.base import VectorStore, fuse_rankings
+from app.vector_stores.in_process import InProcessVectorStore
+from app.vector_stores.postgres import PostgresVectorStore
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
+# Number of candidates fetched for maximal marginal relevance, as a multiple of the limit.
+MMR_CANDIDATE_FACTOR = 4
+# Seconds to keep the results of a chat, which are reused by the related-documents API.
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", 300))
+
+postgres_vector_store = PostgresVectorStore()
+in_process_vector_store = InProcessVectorStore()
+
 
 class SearchResult(BaseModel):
     bot_id: str
     content: str
     source: str
     rank: int
+    # L2 distance between the query and the content. Smaller is more related.
+    distance: float | None = None
+
+
+# (user id, cache key) -> results. Backed by DynamoDB to share them between Lambda functions.
+retrieval_cache: TTLCache[tuple[str, str], list[SearchResult]] = TTLCache(
+    maxsize=256, ttl=RETRIEVAL_CACHE_TTL
+)
 
 
 def filter_used_results(
@@ -42,54 +76,290 @@ def filter_used_results(
     return used_results
 
 
-def get_source_link(source: str) -> tuple[Literal["s3", "url"], str]:
-    if source.startswith("s3://"):
-        s3_path = source[5:]  # Remove "s3://" prefix
-        path_parts = s3_path.split("/", 1)
-        bucket_name = path_parts[0]
-        object_key = path_parts[1] if len(path_parts) > 1 else ""
+def _parse_s3_source(source: str) -> tuple[str, str]:
+    s3_path = source[5:]  # Remove "s3://" prefix
+    path_parts = s3_path.split("/", 1)
+    bucket_name = path_parts[0]
+    object_key = path_parts[1] if len(path_parts) > 1 else ""
+    return bucket_name, object_key
+
+
+def get_source_links(sources: list[str]) -> list[tuple[Literal["s3", "url"], str]]:
+    """Get the links of the sources in the same order.
+    S3 sources are signed in one pass, and identical sources only once.
+    """
+    presigned_urls = generate_presigned_urls(
+        [_parse_s3_source(source) for source in sources if source.startswith("s3://")]
+    )
+
+    links: list[tuple[Literal["s3", "url"], str]] = []
+    for source in sources:
+        if source.startswith("s3://"):
+            links.append(("s3", presigned_urls[_parse_s3_source(source)]))
+        elif source.startswith("http://") or source.startswith("https://"):
+            links.append(("url", source))
+        else:
+            # Assume source is a youtube video id
+            links.append(("url", f"https://www.youtube.com/watch?v={source}"))
+    return links
+
 
-        source_link = generate_presigned_url(
-            bucket=bucket_name,
-            key=object_key,
-            client_method="get_object",
+def to_chunk_models(results: list[SearchResult]) -> list[ChunkModel]:
+    """Convert the used results to the chunks stored with the message."""
+    links = get_source_links([r.source for r in results])
+    return [
+        ChunkModel(
+            content=r.content,
+            content_type=content_type,
+            source=source_link,
+            rank=r.rank,
         )
-        return "s3", source_link
-    elif source.startswith("http://") or source.startswith("https://"):
-        return "url", source
-    else:
-        # Assume source is a youtube video id
-        return "url", f"https://www.youtube.com/watch?v={source}"
+        for r, (content_type, source_link) in zip(results, links)
+    ]
+
+
+def distance_to_similarity(distance: float) -> float:
+    """Convert L2 distance to cosine similarity.
+    NOTE: Cohere embeddings are normalized, so `|a - b|^2 = 2 - 2 * cos(a, b)`.
+    """
+    return 1.0 - distance * distance / 2.0
+
+
+def maximal_marginal_relevance(
+    query_embedding: np.ndarray,
+    embeddings: np.ndarray,
+    limit: int,
+    lambda_mult: float = 0.5,
+) -> list[int]:
+    """Select the rows of `embeddings` by maximal marginal relevance.
+    Each step selects the candidate maximizing
+    `lambda_mult * sim(query, c) - (1 - lambda_mult) * max(sim(c, selected))`,
+    so that near-duplicates of the selected ones are pushed back.
+    Returns the indices of the selected rows in the selected order.
+    """
+    if len(embeddings) == 0 or limit <= 0:
+        return []
+
+    def _normalize(x: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(x, axis=-1, keepdims=True)
+        return x / np.maximum(norm, 1e-12)
+
+    candidates = _normalize(embeddings.astype(np.float32))
+    query_similarity = candidates @ _normalize(query_embedding.astype(np.float32))
+    # Max similarity of each candidate to the selected ones
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+
+    selected: list[int] = []
+    for _ in range(min(limit, len(candidates))):
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        index = int(np.argmax(scores))
+        selected.append(index)
+        redundancy = np.maximum(redundancy, candidates @ candidates[index])
+    return selected
+
+
+def _has_snapshot(bot_id: str, vector_snapshot: bool | None) -> bool:
+    # NOTE: Bots synced before `vector_snapshot` was recorded (None) are looked up.
+    if vector_snapshot is False or not in_process.is_enabled():
+        return False
+    return in_process.load_snapshot(bot_id) is not None
+
+
+def get_vector_store(bot_id: str, vector_snapshot: bool | None = None) -> VectorStore:
+    """Route the bot to the vector store to search.
+    Small bots have a snapshot for the in-process store (see `IN_PROCESS_MAX_ITEMS`),
+    which saves the round trip to PostgreSQL. The other bots are searched on PostgreSQL.
+    `vector_snapshot` is recorded on the bot by the embedding job, so that bots without a
+    snapshot are routed to PostgreSQL without looking for one.
+    """
+    if _has_snapshot(bot_id, vector_snapshot):
+        return in_process_vector_store
+    return postgres_vector_store
 
 
-def search_related_docs(bot_id: str, limit: int, query: str) -> list[SearchResult]:
-    """Search to fetch top n most related documents from pgvector.
+def is_search_available(bot_id: str, vector_snapshot: bool | None = None) -> bool:
+    """Whether the knowledge of the bot can be searched.
+    PostgreSQL is only reachable on Lambda. Locally, only bots with a snapshot of the
+    in-process store can be searched (see `VECTOR_SNAPSHOT_DIR`).
+    """
+    if is_running_on_lambda():
+        return True
+    return _has_snapshot(bot_id, vector_snapshot)
+
+
+def search_related_docs(
+    bot_id: str,
+    limit: int,
+    query: str,
+    search_params: SearchParamsModel | None = None,
+    vector_snapshot: bool | None = None,
+) -> list[SearchResult]:
+    """Search to fetch top n most related documents from the vector store of the bot.
     Args:
         bot_id (str): bot id
         limit (int): number of results to return
         query (str): query string
+        search_params (SearchParamsModel, optional): search mode, weights, MMR and
+            similarity cutoff of the bot. Defaults to vector search.
+        vector_snapshot (bool, optional): whether the bot has a snapshot of the
+            in-process store. Looked up if None.
     Returns:
         list[SearchResult]: list of search results
     """
     query_embedding = calculate_query_embedding(query)
-    logger.info(f"query_embedding: {query_embedding}")
+    logger.info(f"query_embedding: {len(query_embedding)} dimensions")
+
+    # NOTE: Only the columns needed for the results are selected. The embedding of each
+    # item is large, so it is only selected for MMR, by the same query as the candidates.
+    enable_mmr = search_params is not None and search_params.enable_mmr
+    fetch_limit = limit * MMR_CANDIDATE_FACTOR if enable_mmr else limit
+
+    vector_store = get_vector_store(bot_id, vector_snapshot)
+    if search_params and search_params.search_mode == "hybrid":
+        results = vector_store.hybrid_search(
+            bot_id,
+            query,
+            query_embedding,
+            fetch_limit,
+            vector_weight=search_params.vector_weight,
+            keyword_weight=search_params.keyword_weight,
+            with_embeddings=enable_mmr,
+        )
+    else:
+        results = vector_store.search(
+            bot_id, query_embedding, fetch_limit, with_embeddings=enable_mmr
+        )
 
-    search_query = """
-SELECT id, botid, content, source, embedding 
-FROM items 
-WHERE botid = %s 
-ORDER BY embedding <-> %s 
-LIMIT %s
-"""
+    if search_params and search_params.min_similarity is not None:
+        results = [
+            r
+            for r in results
+            if distance_to_similarity(float(r[3])) >= search_params.min_similarity
+        ]
 
-    results = query_postgres(search_query, (bot_id, json.dumps(query_embedding), limit))
+    if search_params and enable_mmr and len(results) > limit:
+        selected = maximal_marginal_relevance(
+            np.asarray(query_embedding),
+            np.stack([r[4] for r in results]),
+            limit,
+            lambda_mult=search_params.mmr_lambda,
+        )
+        results = [results[i] for i in selected]
+    results = results[:limit]
     # NOTE: results should be:
     # [
-    #     ('123', 'bot_1', 'content_1', 'source_1', [0.123, 0.456, 0.789]),
-    #     ('124', 'bot_1', 'content_2', 'source_2', [0.234, 0.567, 0.890]),
+    #     ('123', 'content_1', 'source_1', 0.123),
+    #     ('124', 'content_2', 'source_2', 0.234),
     #     ...
     # ]
     return [
-        SearchResult(rank=i, bot_id=r[1], content=r[2], source=r[3])
+        SearchResult(
+            rank=i, bot_id=bot_id, content=r[1], source=r[2], distance=float(r[3])
+        )
+        for i, r in enumerate(results)
+    ]
+
+
+def search_related_docs_many(
+    bot_id: str,
+    queries: list[str],
+    limit: int,
+    search_params: SearchParamsModel | None = None,
+    vector_snapshot: bool | None = None,
+) -> list[SearchResult]:
+    """Search the documents related to any of the queries (e.g. expanded or multi-hop
+    queries) at once. All queries are embedded by a single request and searched by a
+    single round trip to the vector store.
+    Results are deduplicated across the queries and ranked by reciprocal rank fusion, so
+    that the top results of each query come first.
+    NOTE: Only the similarity cutoff of `search_params` is applied. The search is always
+    by embedding distance, without hybrid search and MMR.
+    Args:
+        bot_id (str): bot id
+        queries (list[str]): query strings
+        limit (int): number of results to return in total
+        search_params (SearchParamsModel, optional): similarity cutoff of the bot.
+        vector_snapshot (bool, optional): whether the bot has a snapshot of the
+            in-process store. Looked up if None.
+    Returns:
+        list[SearchResult]: list of search results
+    """
+    if not queries:
+        return []
+
+    query_embeddings = calculate_query_embeddings(queries)
+    vector_store = get_vector_store(bot_id, vector_snapshot)
+    rankings = vector_store.search_many(bot_id, query_embeddings, limit)
+
+    if search_params and search_params.min_similarity is not None:
+        rankings = [
+            [
+                r
+                for r in ranking
+                if distance_to_similarity(float(r[3])) >= search_params.min_similarity
+            ]
+            for ranking in rankings
+        ]
+
+    results = fuse_rankings(rankings, [1.0] * len(rankings), limit)
+    return [
+        SearchResult(
+            rank=i, bot_id=bot_id, content=r[1], source=r[2], distance=float(r[3])
+        )
         for i, r in enumerate(results)
     ]
+
+
+def compose_retrieval_cache_key(bot: BotModel, query: str) -> str:
+    """Compose the cache key of the results of the query.
+    The items of the bot are replaced by each sync, so the execution id and the status of
+    the sync are part of the key. Results cached before the embedding job updates the sync
+    state are never read again.
+    """
+    version = [
+        bot.id,
+        bot.sync_last_exec_id,
+        bot.sync_status,
+        bot.search_params.model_dump_json(),
+        normalize_query(query),
+    ]
+    return hashlib.sha256(json.dumps(version).encode("utf-8")).hexdigest()
+
+
+def store_search_results(
+    user_id: str, bot: BotModel, query: str, results: list[SearchResult]
+):
+    """Cache the results, so that the related-documents API does not search again."""
+    cache_key = compose_retrieval_cache_key(bot, query)
+    retrieval_cache.set((user_id, cache_key), results)
+    try:
+        store_retrieval_results(
+            user_id,
+            cache_key,
+            [r.model_dump() for r in results],
+            ttl=RETRIEVAL_CACHE_TTL,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to cache the search results: {e}")
+
+
+def find_search_results(
+    user_id: str, bot: BotModel, query: str
+) -> list[SearchResult] | None:
+    """Find the results cached by `store_search_results`, or return None."""
+    cache_key = compose_retrieval_cache_key(bot, query)
+    results = retrieval_cache.get((user_id, cache_key))
+    if results is not None:
+        return results
+
+    try:
+        cached = find_retrieval_results(user_id, cache_key)
+    except Exception as e:
+        logger.warning(f"Failed to find the cached search results: {e}")
+        return None
+    if cached is None:
+        return None
+    results = [SearchResult(**r) for r in cached]
+    retrieval_cache.set((user_id, cache_key), results)
+    return results
@@ -0,0 +1,88 @@
+"""Interface of the vector stores behind `app.vector_search`.
+Stores return rows of (id, content, source, distance), where distance is the L2 distance
+between the query and the item. Smaller is more related. With `with_embeddings`, the
+embedding of the item (float32 array) is appended to each row, e.g. for MMR.
+"""
+
+from abc import ABC, abstractmethod
+
+# Constant of reciprocal rank fusion, which damps the weight of the top ranks.
+RRF_K = 60
+# Each ranking of the hybrid search fetches this many times the limit as candidates.
+HYBRID_CANDIDATE_FACTOR = 2
+
+
+def fuse_rankings(
+    rankings: list[list[tuple]], weights: list[float], limit: int, k: int = RRF_K
+) -> list[tuple]:
+    """Fuse the rankings by weighted reciprocal rank fusion.
+    Rows are identified by their first column (id). Each row scores
+    `sum(weight / (k + rank))` over the rankings containing it.
+    """
+    scores: dict[str, float] = {}
+    rows: dict[str, tuple] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, row in enumerate(ranking, start=1):
+            scores[row[0]] = scores.get(row[0], 0.0) + weight / (k + rank)
+            rows.setdefault(row[0], row)
+    ids = sorted(scores, key=lambda id: scores[id], reverse=True)
+    return [rows[id] for id in ids[:limit]]
+
+
+class VectorStore(ABC):
+    @abstractmethod
+    def search(
+        self,
+        bot_id: str,
+        embedding: list[float],
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        """Search the items of the bot nearest to the embedding, ordered by distance."""
+
+    def search_many(
+        self, bot_id: str, embeddings: list[list[float]], limit: int
+    ) -> list[list[tuple]]:
+        """Search the items nearest to each embedding. Returns the rows of each embedding
+        in the same order. Stores override this to search all of them at once.
+        """
+        return [self.search(bot_id, embedding, limit) for embedding in embeddings]
+
+    @abstractmethod
+    def keyword_search(
+        self,
+        bot_id: str,
+        query: str,
+        embedding: list[float],
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        """Search the items of the bot by full-text search, ordered by relevance.
+        The distance to the embedding is returned as well.
+        """
+
+    def hybrid_search(
+        self,
+        bot_id: str,
+        query: str,
+        embedding: list[float],
+        limit: int,
+        vector_weight: float = 1.0,
+        keyword_weight: float = 1.0,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        """Search the items of the bot by both embedding distance and full-text search,
+        and fuse the rankings. Exact matches of product codes or names, which embeddings
+        tend to miss, are ranked high by the full-text search.
+        """
+        candidates = limit * HYBRID_CANDIDATE_FACTOR
+        return fuse_rankings(
+            [
+                self.search(bot_id, embedding, candidates, with_embeddings),
+                self.keyword_search(
+                    bot_id, query, embedding, candidates, with_embeddings
+                ),
+            ],
+            [vector_weight, keyword_weight],
+            limit,
+        )
@@ -0,0 +1,347 @@
+"""In-process vector store on NumPy.
+Small bots are searched by brute force over a float32 matrix of their embeddings, which
+takes less than a millisecond and saves the round trip to PostgreSQL. The embedding job
+exports a snapshot of each small bot to S3, and the snapshot is loaded into memory on
+first use. For local runs without PostgreSQL, snapshots are read from a local directory
+instead.
+
+Each snapshot is a single uncompressed `.npz` file, so that a reader never sees the
+embeddings of one version with the items of another. It consists of:
+- `embeddings.npy`: float32 matrix of shape (items, dimensions)
+- `items.npy`: UTF-8 JSON of [{"id", "content", "source"}] in the same order as the matrix
+
+On load, the embeddings are extracted to a `.npy` file under `SNAPSHOT_CACHE_DIR` and
+memory-mapped, so that the matrix is paged in from local storage instead of being copied
+into the heap.
+The embedding job records on the bot whether it exported a snapshot (`vector_snapshot`),
+so that bots searched on PostgreSQL are routed without looking for one.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import Counter
+
+import boto3
+import numpy as np
+from app.cache import TTLCache
+from app.vector_stores.base import VectorStore
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Bucket of the snapshots. Empty disables the in-process store on Lambda.
+VECTOR_SNAPSHOT_BUCKET = os.environ.get("VECTOR_SNAPSHOT_BUCKET", "")
+# Local directory of the snapshots, used instead of the bucket for local runs.
+VECTOR_SNAPSHOT_DIR = os.environ.get("VECTOR_SNAPSHOT_DIR", "")
+# Bots with at most this many items are exported and searched in process.
+IN_PROCESS_MAX_ITEMS = int(os.environ.get("IN_PROCESS_MAX_ITEMS", 2000))
+# Seconds until a loaded snapshot is checked for updates. Snapshots are replaced when
+# the bot is embedded again, so results may lag behind PostgreSQL by this much.
+SNAPSHOT_CACHE_TTL = 300
+
+SNAPSHOT_PREFIX = "vector-snapshots"
+SNAPSHOT_SUFFIX = ".npz"
+# Local directory of the memory-mapped embeddings of loaded snapshots.
+SNAPSHOT_CACHE_DIR = os.path.join(tempfile.gettempdir(), SNAPSHOT_PREFIX)
+
+# NOTE: Same as the `simple` text search configuration, which only lowercases words.
+_TERM_PATTERN = re.compile(r"\w+")
+
+s3_client = boto3.client("s3")
+
+
+class BotSnapshot:
+    def __init__(self, items: list[dict], embeddings: np.ndarray):
+        if len(items) != len(embeddings):
+            raise ValueError(
+                f"Snapshot has {len(items)} items but {len(embeddings)} embeddings"
+            )
+        self.items = items
+        self.embeddings = embeddings
+        # Squared norms, so that distances need a single matrix-vector product
+        self.squared_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+        self._terms: list[Counter] | None = None
+
+    @property
+    def terms(self) -> list[Counter]:
+        """Term frequencies of each item, built on first keyword search."""
+        if self._terms is None:
+            self._terms = [Counter(_tokenize(item["content"])) for item in self.items]
+        return self._terms
+
+    def squared_distances(self, embedding: list[float]) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32)
+        return self.squared_norms - 2 * (self.embeddings @ query) + query @ query
+
+    def squared_distances_many(self, embeddings: list[list[float]]) -> np.ndarray:
+        """Squared distances of shape (queries, items) by a single matrix product."""
+        queries = np.asarray(embeddings, dtype=np.float32)
+        return (
+            self.squared_norms[np.newaxis, :]
+            - 2 * (queries @ self.embeddings.T)
+            + np.einsum("ij,ij->i", queries, queries)[:, np.newaxis]
+        )
+
+    def to_rows(
+        self,
+        indices: np.ndarray,
+        squared_distances: np.ndarray,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        distances = np.sqrt(np.maximum(squared_distances[indices], 0.0))
+        rows = [
+            (
+                self.items[i]["id"],
+                self.items[i]["content"],
+                self.items[i]["source"],
+                float(distance),
+            )
+            for i, distance in zip(indices, distances)
+        ]
+        if with_embeddings:
+            rows = [
+                (*row, np.array(self.embeddings[i])) for row, i in zip(rows, indices)
+            ]
+        return rows
+
+
+# bot id -> snapshot, or None if the bot has no snapshot
+_snapshot_cache: TTLCache[str, BotSnapshot | None] = TTLCache(
+    maxsize=64, ttl=SNAPSHOT_CACHE_TTL
+)
+
+
+def _tokenize(text: str) -> list[str]:
+    return _TERM_PATTERN.findall(text.lower())
+
+
+def _validate_bot_id(bot_id: str) -> str:
+    # NOTE: Bot ids are used as file paths and object keys.
+    if not bot_id.isalnum():
+        raise ValueError(f"Invalid bot id: {bot_id}")
+    return bot_id
+
+
+def _compose_snapshot_key(bot_id: str) -> str:
+    return f"{SNAPSHOT_PREFIX}/{_validate_bot_id(bot_id)}{SNAPSHOT_SUFFIX}"
+
+
+def _compose_snapshot_path(bot_id: str) -> str:
+    return os.path.join(VECTOR_SNAPSHOT_DIR, _validate_bot_id(bot_id) + SNAPSHOT_SUFFIX)
+
+
+def is_enabled() -> bool:
+    return bool(VECTOR_SNAPSHOT_DIR or VECTOR_SNAPSHOT_BUCKET)
+
+
+def _serialize_snapshot(file, items: list[dict], embeddings: np.ndarray):
+    # NOTE: Items are stored as JSON bytes, so that loading never needs pickle.
+    # `savez` does not compress, so the embeddings can be extracted as they are.
+    np.savez(
+        file,
+        embeddings=embeddings,
+        items=np.frombuffer(json.dumps(items).encode("utf-8"), dtype=np.uint8),
+    )
+
+
+def _deserialize_snapshot(file) -> BotSnapshot:
+    """Load the snapshot from a `.npz` file (path or seekable file object)."""
+    with zipfile.ZipFile(file) as archive:
+        with archive.open("items.npy") as f:
+            data = np.lib.format.read_array(f, allow_pickle=False)
+        items = json.loads(data.tobytes().decode("utf-8"))
+
+        os.makedirs(SNAPSHOT_CACHE_DIR, exist_ok=True)
+        # NOTE: The file is removed on close, but the mapping keeps it until the snapshot
+        # is garbage collected. Replaced snapshots therefore never leave files behind.
+        with tempfile.NamedTemporaryFile(dir=SNAPSHOT_CACHE_DIR, suffix=".npy") as f:
+            with archive.open("embeddings.npy") as member:
+                shutil.copyfileobj(member, f)
+            f.flush()
+            embeddings = np.load(f.name, mmap_mode="r", allow_pickle=False)
+    return BotSnapshot(items, embeddings)
+
+
+def _read_snapshot(bot_id: str) -> BotSnapshot | None:
+    """Read the snapshot of the bot, or return None if the bot has no snapshot."""
+    if VECTOR_SNAPSHOT_DIR:
+        try:
+            return _deserialize_snapshot(_compose_snapshot_path(bot_id))
+        except FileNotFoundError:
+            return None
+
+    os.makedirs(SNAPSHOT_CACHE_DIR, exist_ok=True)
+    with tempfile.TemporaryFile(dir=SNAPSHOT_CACHE_DIR) as f:
+        try:
+            s3_client.download_fileobj(
+                VECTOR_SNAPSHOT_BUCKET, _compose_snapshot_key(bot_id), f
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise e
+        f.seek(0)
+        return _deserialize_snapshot(f)
+
+
+def load_snapshot(bot_id: str) -> BotSnapshot | None:
+    """Load the snapshot of the bot, or return None if the bot has no snapshot."""
+    if bot_id in _snapshot_cache:
+        return _snapshot_cache.get(bot_id)
+
+    snapshot = None
+    try:
+        snapshot = _read_snapshot(bot_id)
+    except Exception as e:
+        # Searched on PostgreSQL instead
+        logger.warning(f"Failed to load the vector snapshot of bot {bot_id}: {e}")
+
+    if snapshot is not None and len(snapshot.items) > IN_PROCESS_MAX_ITEMS:
+        snapshot = None
+    _snapshot_cache.set(bot_id, snapshot)
+    return snapshot
+
+
+def store_snapshot(
+    bot_id: str,
+    ids: list[str],
+    contents: list[str],
+    sources: list[str],
+    embeddings: list[list[float]],
+):
+    items = [
+        {"id": id, "content": content, "source": source}
+        for id, content, source in zip(ids, contents, sources)
+    ]
+    embedding_matrix = np.asarray(embeddings, dtype=np.float32)
+
+    if VECTOR_SNAPSHOT_DIR:
+        os.makedirs(VECTOR_SNAPSHOT_DIR, exist_ok=True)
+        # NOTE: Written to a unique temporary file and renamed, so that concurrent
+        # writers never interleave and readers see either version as a whole.
+        fd, temp_path = tempfile.mkstemp(dir=VECTOR_SNAPSHOT_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                _serialize_snapshot(f, items, embedding_matrix)
+            os.replace(temp_path, _compose_snapshot_path(bot_id))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    else:
+        with tempfile.TemporaryFile() as f:
+            _serialize_snapshot(f, items, embedding_matrix)
+            f.seek(0)
+            s3_client.upload_fileobj(
+                f, VECTOR_SNAPSHOT_BUCKET, _compose_snapshot_key(bot_id)
+            )
+    _snapshot_cache.pop(bot_id)
+
+
+def delete_snapshot(bot_id: str):
+    if VECTOR_SNAPSHOT_DIR:
+        try:
+            os.remove(_compose_snapshot_path(bot_id))
+        except FileNotFoundError:
+            pass
+    else:
+        s3_client.delete_object(
+            Bucket=VECTOR_SNAPSHOT_BUCKET, Key=_compose_snapshot_key(bot_id)
+        )
+    _snapshot_cache.pop(bot_id)
+
+
+def update_snapshot(
+    bot_id: str,
+    ids: list[str],
+    contents: list[str],
+    sources: list[str],
+    embeddings: list[list[float]],
+) -> bool:
+    """Export the snapshot of the bot if it is small enough to be searched in process.
+    Otherwise the previous snapshot is deleted, so that the bot is searched on PostgreSQL.
+    Returns whether the bot has a snapshot, which is recorded on the bot.
+    """
+    if not is_enabled():
+        return False
+    if len(ids) > IN_PROCESS_MAX_ITEMS:
+        logger.info(f"Bot {bot_id} has {len(ids)} items. Deleting the vector snapshot.")
+        delete_snapshot(bot_id)
+        return False
+    store_snapshot(bot_id, ids, contents, sources, embeddings)
+    logger.info(f"Exported the vector snapshot of bot {bot_id} ({len(ids)} items).")
+    return True
+
+
+class InProcessVectorStore(VectorStore):
+    """Brute-force search over the snapshot of the bot."""
+
+    def _load(self, bot_id: str) -> BotSnapshot:
+        snapshot = load_snapshot(bot_id)
+        if snapshot is None:
+            raise ValueError(f"Bot {bot_id} has no vector snapshot")
+        return snapshot
+
+    def _nearest(
+        self,
+        snapshot: BotSnapshot,
+        squared_distances: np.ndarray,
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        k = min(limit, len(squared_distances))
+        if k <= 0:
+            return []
+        # Only the top k are sorted
+        top = np.argpartition(squared_distances, k - 1)[:k]
+        top = top[np.argsort(squared_distances[top])]
+        return snapshot.to_rows(top, squared_distances, with_embeddings)
+
+    def search(
+        self,
+        bot_id: str,
+        embedding: list[float],
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        snapshot = self._load(bot_id)
+        return self._nearest(
+            snapshot, snapshot.squared_distances(embedding), limit, with_embeddings
+        )
+
+    def search_many(
+        self, bot_id: str, embeddings: list[list[float]], limit: int
+    ) -> list[list[tuple]]:
+        if not embeddings:
+            return []
+        snapshot = self._load(bot_id)
+        return [
+            self._nearest(snapshot, squared_distances, limit)
+            for squared_distances in snapshot.squared_distances_many(embeddings)
+        ]
+
+    def keyword_search(
+        self,
+        bot_id: str,
+        query: str,
+        embedding: list[float],
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        snapshot = self._load(bot_id)
+        # NOTE: Terms are OR-ed like the full-text search of PostgreSQL, and items are
+        # ranked by the number of occurrences of the terms.
+        terms = set(_tokenize(query))
+        scores = np.array(
+            [sum(counter[t] for t in terms) for counter in snapshot.terms],
+            dtype=np.int64,
+        )
+        matched = np.flatnonzero(scores)
+        ranked = matched[np.argsort(-scores[matched], kind="stable")][:limit]
+        return snapshot.to_rows(
+            ranked, snapshot.squared_distances(embedding), with_embeddings
+        )
@@ -0,0 +1,344 @@
+"""Vector store on PostgreSQL (pgvector).
+All bots share the `items` table. Instead of a single ANN index over all bots, each bot with
+enough items gets its own partial HNSW index, so that the index only contains the items of
+that bot. Smaller bots are searched exactly, which is fast enough and has perfect recall.
+Items also have a full-text search vector (`tsv`), which is used by the hybrid search.
+"""
+
+import logging
+import os
+import re
+from contextlib import contextmanager
+
+import numpy as np
+from app.cache import TTLCache
+from app.postgres import PooledConnection, connection_pool
+from app.vector_stores.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Bots with at least this many items get their own HNSW index.
+VECTOR_INDEX_MIN_ROWS = int(os.environ.get("VECTOR_INDEX_MIN_ROWS", 5000))
+# Number of candidates explored by HNSW. Raised to the limit if the limit is larger.
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+# Seconds to remember whether a bot has its own index.
+INDEX_CACHE_TTL = 300
+# Text search configuration of `tsv`. `simple` does not depend on the language.
+TEXT_SEARCH_CONFIG = "simple"
+
+# NOTE: Bot ids are inlined into DDL and queries which must match the partial index
+# predicate, so they are strictly validated.
+_BOT_ID_PATTERN = re.compile(r"^[0-9A-Za-z]{1,50}$")
+
+# bot id -> whether the bot has its own index
+_index_cache: TTLCache[str, bool] = TTLCache(maxsize=1024, ttl=INDEX_CACHE_TTL)
+
+# Query embeddings are sent as typed `real[]` parameters and cast to `vector` by the
+# server, instead of being formatted as pgvector text literals and parsed back.
+# Queries of single embeddings select `{embedding_column}` as well, which is either empty
+# or the embedding of each item (only for MMR). See `_compose_query`.
+
+# Exact search over the items of the bot. `MATERIALIZED` keeps the planner from using an
+# ANN index of other bots and forces the exact ordering.
+EXACT_SEARCH_QUERY = """
+WITH candidates AS MATERIALIZED (
+    SELECT id, content, source, embedding <-> CAST(:embedding AS real[])::vector AS distance{embedding_column}
+    FROM items
+    WHERE botid = :bot_id
+)
+SELECT id, content, source, distance{embedding_column}
+FROM candidates
+ORDER BY distance
+LIMIT :limit
+"""
+
+# Approximate search through the partial index of the bot. The bot id is a literal so that
+# the planner can match the index predicate.
+# NOTE: `<->` is L2 distance, which must match `vector_l2_ops` of the index.
+INDEXED_SEARCH_QUERY = """
+SELECT id, content, source, embedding <-> %s::real[]::vector AS distance{embedding_column}
+FROM items
+WHERE botid = '{bot_id}'
+ORDER BY embedding <-> %s::real[]::vector
+LIMIT %s
+"""
+
+
+# Exact search of multiple embeddings in a single statement. The embeddings are sent as a
+# two-dimensional `real[]`, which `queries` splits into one vector per row (array slices
+# are avoided because `:` marks the named parameters of pg8000). Each query then scans the
+# items of the bot.
+EXACT_SEARCH_MANY_QUERY = """
+WITH candidates AS MATERIALIZED (
+    SELECT id, content, source, embedding
+    FROM items
+    WHERE botid = :bot_id
+), queries AS MATERIALIZED (
+    SELECT (i - 1) / array_length(q.e, 2) + 1 AS ord, array_agg(x ORDER BY i)::vector AS embedding
+    FROM (SELECT CAST(:embeddings AS real[]) AS e) q, unnest(q.e) WITH ORDINALITY AS u(x, i)
+    GROUP BY 1
+)
+SELECT queries.ord, r.id, r.content, r.source, r.distance
+FROM queries
+CROSS JOIN LATERAL (
+    SELECT id, content, source, candidates.embedding <-> queries.embedding AS distance
+    FROM candidates
+    ORDER BY distance
+    LIMIT :limit
+) r
+ORDER BY queries.ord, r.distance
+"""
+
+# Approximate search of multiple embeddings through the partial index of the bot.
+# NOTE: The index is scanned once per query, ordered by the distance to that query.
+INDEXED_SEARCH_MANY_QUERY = """
+WITH queries AS MATERIALIZED (
+    SELECT (i - 1) / array_length(q.e, 2) + 1 AS ord, array_agg(x ORDER BY i)::vector AS embedding
+    FROM (SELECT %s::real[] AS e) q, unnest(q.e) WITH ORDINALITY AS u(x, i)
+    GROUP BY 1
+)
+SELECT queries.ord, r.id, r.content, r.source, r.distance
+FROM queries
+CROSS JOIN LATERAL (
+    SELECT id, content, source, items.embedding <-> queries.embedding AS distance
+    FROM items
+    WHERE botid = '{bot_id}'
+    ORDER BY items.embedding <-> queries.embedding
+    LIMIT %s
+) r
+ORDER BY queries.ord, r.distance
+"""
+
+
+# Full-text search over the items of the bot.
+# NOTE: Terms are OR-ed instead of AND-ed by `plainto_tsquery`, because queries are
+# usually natural language and rarely contain all terms of a chunk. The query is built
+# from the lexemes of the text, each quoted as a tsquery operand (`'` doubled and `\`
+# escaped), so that lexemes containing operators or quotes are matched literally.
+KEYWORD_SEARCH_QUERY = rf"""
+WITH q AS (
+    SELECT array_to_string(
+        ARRAY(
+            SELECT '''' || replace(replace(lexeme, '\', '\\'), '''', '''''') || ''''
+            FROM unnest(
+                tsvector_to_array(to_tsvector('{TEXT_SEARCH_CONFIG}', :query))
+            ) AS lexeme
+        ),
+        ' | '
+    )::tsquery AS query
+)
+SELECT id, content, source, embedding <-> CAST(:embedding AS real[])::vector AS distance{{embedding_column}}
+FROM items, q
+WHERE botid = :bot_id AND tsv @@ q.query
+ORDER BY ts_rank_cd(tsv, q.query) DESC
+LIMIT :limit
+"""
+
+
+def parse_vector(vector: str) -> np.ndarray:
+    """Parse the pgvector text format (e.g. `[0.1,0.2]`)."""
+    return np.fromstring(vector.strip("[]"), dtype=np.float32, sep=",")
+
+
+def _compose_query(sql: str, with_embeddings: bool, **kwargs) -> str:
+    return sql.format(
+        embedding_column=", embedding" if with_embeddings else "", **kwargs
+    )
+
+
+def _validate_bot_id(bot_id: str) -> str:
+    if not _BOT_ID_PATTERN.match(bot_id):
+        raise ValueError(f"Invalid bot id: {bot_id}")
+    return bot_id
+
+
+def compose_index_name(bot_id: str) -> str:
+    return f"idx_items_embedding_{_validate_bot_id(bot_id).lower()}"
+
+
+def _find_index_validity(conn: PooledConnection, bot_id: str) -> bool | None:
+    """Return whether the index of the bot is valid, or None if it does not exist.
+    NOTE: An index is left invalid when its concurrent build fails.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT i.indisvalid FROM pg_class c "
+            "JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = %s",
+            (compose_index_name(bot_id),),
+        )
+        rows = cursor.fetchall()
+    return rows[0][0] if rows else None
+
+
+def has_bot_index(conn: PooledConnection, bot_id: str) -> bool:
+    cached = _index_cache.get(bot_id)
+    if cached is not None:
+        return cached
+
+    exists = _find_index_validity(conn, bot_id) is True
+    _index_cache.set(bot_id, exists)
+    return exists
+
+
+def search(
+    conn: PooledConnection,
+    bot_id: str,
+    embedding: list[float],
+    limit: int,
+    with_embeddings: bool = False,
+) -> list[tuple]:
+    """Search the items of the bot nearest to the embedding.
+    Returns tuples of (id, content, source, distance) ordered by L2 distance. With
+    `with_embeddings`, the embedding of each item (pgvector text format) is appended.
+    """
+    if not has_bot_index(conn, bot_id):
+        # NOTE: The statement is prepared once per pooled connection.
+        statement = conn.prepare(_compose_query(EXACT_SEARCH_QUERY, with_embeddings))
+        return list(statement.run(bot_id=bot_id, embedding=embedding, limit=limit))
+
+    with conn.cursor() as cursor:
+        # `SET LOCAL` only lasts until the end of the transaction.
+        cursor.execute(f"SET LOCAL hnsw.ef_search = {max(HNSW_EF_SEARCH, limit)}")
+        cursor.execute(
+            _compose_query(
+                INDEXED_SEARCH_QUERY,
+                with_embeddings,
+                bot_id=_validate_bot_id(bot_id),
+            ),
+            (embedding, embedding, limit),
+        )
+        return list(cursor.fetchall())
+
+
+def search_many(
+    conn: PooledConnection, bot_id: str, embeddings: list[list[float]], limit: int
+) -> list[list[tuple]]:
+    """Search the items of the bot nearest to each embedding by a single statement.
+    Returns the rows of each embedding in the same order, like `search`.
+    """
+    if not embeddings:
+        return []
+    if not has_bot_index(conn, bot_id):
+        statement = conn.prepare(EXACT_SEARCH_MANY_QUERY)
+        rows = statement.run(bot_id=bot_id, embeddings=embeddings, limit=limit)
+    else:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SET LOCAL hnsw.ef_search = {max(HNSW_EF_SEARCH, limit)}")
+            cursor.execute(
+                INDEXED_SEARCH_MANY_QUERY.format(bot_id=_validate_bot_id(bot_id)),
+                (embeddings, limit),
+            )
+            rows = cursor.fetchall()
+
+    results: list[list[tuple]] = [[] for _ in embeddings]
+    for row in rows:
+        # NOTE: `WITH ORDINALITY` starts from 1.
+        results[row[0] - 1].append(tuple(row[1:]))
+    return results
+
+
+def keyword_search(
+    conn: PooledConnection,
+    bot_id: str,
+    query: str,
+    embedding: list[float],
+    limit: int,
+    with_embeddings: bool = False,
+) -> list[tuple]:
+    """Search the items of the bot by full-text search, ordered by relevance.
+    Returns tuples of (id, content, source, distance) like `search`.
+    """
+    statement = conn.prepare(_compose_query(KEYWORD_SEARCH_QUERY, with_embeddings))
+    return list(
+        statement.run(bot_id=bot_id, query=query, embedding=embedding, limit=limit)
+    )
+
+
+def _parse_embeddings(rows: list[tuple]) -> list[tuple]:
+    return [(*row[:4], parse_vector(row[4])) for row in rows]
+
+
+@contextmanager
+def _autocommit(conn: PooledConnection):
+    """Run the statements outside of a transaction.
+    NOTE: Concurrent index operations cannot run inside a transaction.
+    """
+    conn.conn.commit()
+    conn.conn.autocommit = True
+    try:
+        yield
+    finally:
+        conn.conn.autocommit = False
+
+
+def ensure_bot_index(bot_id: str, min_rows: int = VECTOR_INDEX_MIN_ROWS) -> bool:
+    """Create the HNSW index of the bot if it has enough items.
+    The index is built concurrently, so the other bots can be written meanwhile.
+    Returns whether the bot has its own index.
+    """
+    index_name = compose_index_name(bot_id)
+    with connection_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM items WHERE botid = %s", (bot_id,))
+            count = cursor.fetchall()[0][0]
+        validity = _find_index_validity(conn, bot_id)
+        if validity is True or count < min_rows:
+            _index_cache.set(bot_id, validity is True)
+            return validity is True
+
+        logger.info(f"Creating index {index_name} for {count} items")
+        with _autocommit(conn), conn.cursor() as cursor:
+            if validity is False:
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+            cursor.execute(
+                f"CREATE INDEX CONCURRENTLY {index_name} ON items "
+                f"USING hnsw (embedding vector_l2_ops) WHERE botid = '{bot_id}'"
+            )
+
+    _index_cache.set(bot_id, True)
+    return True
+
+
+def drop_bot_index(bot_id: str):
+    """Drop the index of the bot without blocking the searches of the other bots."""
+    with connection_pool.connection() as conn:
+        with _autocommit(conn), conn.cursor() as cursor:
+            cursor.execute(
+                f"DROP INDEX CONCURRENTLY IF EXISTS {compose_index_name(bot_id)}"
+            )
+    _index_cache.pop(bot_id)
+
+
+class PostgresVectorStore(VectorStore):
+    """Vector store shared by all bots. Each call borrows a pooled connection."""
+
+    def search(
+        self,
+        bot_id: str,
+        embedding: list[float],
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        with connection_pool.connection() as conn:
+            rows = search(conn, bot_id, embedding, limit, with_embeddings)
+        return _parse_embeddings(rows) if with_embeddings else rows
+
+    def search_many(
+        self, bot_id: str, embeddings: list[list[float]], limit: int
+    ) -> list[list[tuple]]:
+        with connection_pool.connection() as conn:
+            return search_many(conn, bot_id, embeddings, limit)
+
+    def keyword_search(
+        self,
+        bot_id: str,
+        query: str,
+        embedding: list[float],
+        limit: int,
+        with_embeddings: bool = False,
+    ) -> list[tuple]:
+        with connection_pool.connection() as conn:
+            rows = keyword_search(
+                conn, bot_id, query, embedding, limit, with_embeddings
+            )
+        return _parse_embeddings(rows) if with_embeddings else rows
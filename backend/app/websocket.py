@@ -16,13 +16,23 @@ from app.agents.utils import get_tool_by_name
 from app.auth import verify_token
 from app.bedrock import compose_args
 from app.repositories.conversation import RecordNotFoundError, store_conversation
-from app.repositories.models.conversation import ChunkModel, ContentModel, MessageModel
+from app.repositories.models.conversation import ContentModel, MessageModel
 from app.routes.schemas.conversation import ChatInput
 from app.stream import OnStopInput, get_stream_handler_type
 from app.usecases.bot import modify_bot_last_used_time
-from app.usecases.chat import insert_knowledge, prepare_conversation, trace_to_root
+from app.usecases.chat import (
+    get_updated_message_ids,
+    insert_knowledge,
+    prepare_conversation,
+    trace_to_root,
+)
 from app.utils import get_anthropic_client, get_current_time, is_anthropic_model
-from app.vector_search import filter_used_results, get_source_link, search_related_docs
+from app.vector_search import (
+    filter_used_results,
+    search_related_docs,
+    store_search_results,
+    to_chunk_models,
+)
 from boto3.dynamodb.conditions import Attr, Key
 from ulid import ULID
 
@@ -139,7 +149,13 @@ def process_chat_input(
         conversation.total_price += price
 
         # Store conversation before finish streaming so that front-end can avoid 404 issue
-        store_conversation(user_id, conversation)
+        store_conversation(
+            user_id,
+            conversation,
+            message_ids=get_updated_message_ids(
+                conversation, user_msg_id, assistant_msg_id
+            ),
+        )
 
         # Send signal so that frontend can close the connection
         last_data_to_send = json.dumps(
@@ -153,6 +169,7 @@ def process_chat_input(
 
     message_map = conversation.message_map
     search_results = []
+    query: str | None = None
     if bot and bot.has_knowledge():
         gatewayapi.post_to_connection(
             ConnectionId=connection_id,
@@ -167,7 +184,11 @@ def process_chat_input(
         # NOTE: Currently embedding not support multi-modal. For now, use the last text content.
         query = conversation.message_map[user_msg_id].content[-1].body
         search_results = search_related_docs(
-            bot_id=bot.id, limit=bot.search_params.max_results, query=query
+            bot_id=bot.id,
+            limit=bot.search_params.max_results,
+            query=query,
+            search_params=bot.search_params,
+            vector_snapshot=bot.vector_snapshot,
         )
         logger.info(f"Search results from vector store: {search_results}")
 
@@ -210,21 +231,14 @@ def process_chat_input(
             conversation.message_map[conversation.last_message_id].content[
                 0
             ].body += arg.full_token
+            updated_message_ids = [conversation.last_message_id]
         else:
             used_chunks = None
             if bot and bot.display_retrieved_chunks:
                 if len(search_results) > 0:
-                    used_chunks = []
-                    for r in filter_used_results(arg.full_token, search_results):
-                        content_type, source_link = get_source_link(r.source)
-                        used_chunks.append(
-                            ChunkModel(
-                                content=r.content,
-                                content_type=content_type,
-                                source=source_link,
-                                rank=r.rank,
-                            )
-                        )
+                    used_chunks = to_chunk_models(
+                        filter_used_results(arg.full_token, search_results)
+                    )
 
             # Append entire completion as the last message
             assistant_msg_id = str(ULID())
@@ -247,14 +261,22 @@ def process_chat_input(
             # Append children to parent
             conversation.message_map[user_msg_id].children.append(assistant_msg_id)
             conversation.last_message_id = assistant_msg_id
+            updated_message_ids = get_updated_message_ids(
+                conversation, user_msg_id, assistant_msg_id
+            )
 
         conversation.total_price += arg.price
 
         # If continued, save the state
         conversation.should_continue = arg.stop_reason == "max_tokens"
 
+        if bot and bot.display_retrieved_chunks and query is not None:
+            # Reused by `fetch_related_documents`. Stored after streaming, so that the write
+            # does not delay the first token.
+            store_search_results(user_id, bot, query, search_results)
+
         # Store conversation before finish streaming so that front-end can avoid 404 issue
-        store_conversation(user_id, conversation)
+        store_conversation(user_id, conversation, message_ids=updated_message_ids)
         last_data_to_send = json.dumps(
             dict(status="STREAMING_END", completion="", stop_reason=arg.stop_reason)
         ).encode("utf-8")
@@ -4,11 +4,10 @@ import logging
 import multiprocessing
 import os
 from multiprocessing.managers import ListProxy
-from typing import Any
 
-import pg8000
 import requests
 from app.config import DEFAULT_EMBEDDING_CONFIG
+from app.postgres import connection_pool
 from app.repositories.common import RecordNotFoundError, _get_table_client
 from app.repositories.custom_bot import (
     compose_bot_id,
@@ -17,7 +16,8 @@ from app.repositories.custom_bot import (
 )
 from app.routes.schemas.bot import type_sync_status
 from app.utils import compose_upload_document_s3_path
-from aws_lambda_powertools.utilities import parameters
+from app.vector_stores.in_process import delete_snapshot, update_snapshot
+from app.vector_stores.postgres import TEXT_SEARCH_CONFIG, ensure_bot_index
 from embedding.loaders import UrlLoader
 from embedding.loaders.base import BaseLoader
 from embedding.loaders.s3 import S3FileLoader
@@ -35,7 +35,6 @@ RETRY_DELAY_TO_INSERT_TO_POSTGRES = 2
 RETRIES_TO_UPDATE_SYNC_STATUS = 4
 RETRY_DELAY_TO_UPDATE_SYNC_STATUS = 2
 
-DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
 DOCUMENT_BUCKET = os.environ.get("DOCUMENT_BUCKET", "documents")
 
 METADATA_URI = os.environ.get("ECS_CONTAINER_METADATA_URI_V4")
@@ -54,24 +53,16 @@ def get_exec_id() -> str:
 @retry(tries=RETRIES_TO_INSERT_TO_POSTGRES, delay=RETRY_DELAY_TO_INSERT_TO_POSTGRES)
 def insert_to_postgres(
     bot_id: str, contents: ListProxy, sources: ListProxy, embeddings: ListProxy
-):
-    secrets: Any = parameters.get_secret(DB_SECRETS_ARN)  # type: ignore
-    db_info = json.loads(secrets)
-
-    conn = pg8000.connect(
-        database=db_info["dbname"],
-        host=db_info["host"],
-        port=db_info["port"],
-        user=db_info["username"],
-        password=db_info["password"],
-    )
-
-    try:
+) -> list[str]:
+    """Replace the items of the bot. Returns the ids of the inserted items."""
+    # NOTE: Deletion and insertion are committed in a single transaction.
+    with connection_pool.connection() as conn:
         with conn.cursor() as cursor:
             delete_query = "DELETE FROM items WHERE botid = %s"
             cursor.execute(delete_query, (bot_id,))
 
-            insert_query = f"INSERT INTO items (id, botid, content, source, embedding) VALUES (%s, %s, %s, %s, %s)"
+            # NOTE: `tsv` is used by the hybrid search. See `app/vector_stores/postgres.py`.
+            insert_query = f"INSERT INTO items (id, botid, content, source, embedding, tsv) VALUES (%s, %s, %s, %s, %s, to_tsvector('{TEXT_SEARCH_CONFIG}', %s))"
             values_to_insert = []
             for i, (source, content, embedding) in enumerate(
                 zip(sources, contents, embeddings)
@@ -79,16 +70,11 @@ def insert_to_postgres(
                 id_ = str(ULID())
                 logger.info(f"Preview of content {i}: {content[:200]}")
                 values_to_insert.append(
-                    (id_, bot_id, content, source, json.dumps(embedding))
+                    (id_, bot_id, content, source, json.dumps(embedding), content)
                 )
             cursor.executemany(insert_query, values_to_insert)
-        conn.commit()
-        logger.info(f"Successfully inserted {len(values_to_insert)} records.")
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    logger.info(f"Successfully inserted {len(values_to_insert)} records.")
+    return [values[0] for values in values_to_insert]
 
 
 @retry(tries=RETRIES_TO_UPDATE_SYNC_STATUS, delay=RETRY_DELAY_TO_UPDATE_SYNC_STATUS)
@@ -98,16 +84,28 @@ def update_sync_status(
     sync_status: type_sync_status,
     sync_status_reason: str,
     last_exec_id: str,
+    vector_snapshot: bool | None = None,
 ):
+    """Update the sync status of the bot.
+    `vector_snapshot` records whether the bot has a snapshot of the in-process vector
+    store, so that the backend routes the bot without looking for one. Unchanged if None.
+    """
     table = _get_table_client(user_id)
+    update_expression = "SET SyncStatus = :sync_status, SyncStatusReason = :sync_status_reason, LastExecId = :last_exec_id"
+    expression_attribute_values = {
+        ":sync_status": sync_status,
+        ":sync_status_reason": sync_status_reason,
+        ":last_exec_id": last_exec_id,
+        ":one": 1,
+    }
+    if vector_snapshot is not None:
+        update_expression += ", VectorSnapshot = :vector_snapshot"
+        expression_attribute_values[":vector_snapshot"] = vector_snapshot
     table.update_item(
         Key={"PK": user_id, "SK": compose_bot_id(user_id, bot_id)},
-        UpdateExpression="SET SyncStatus = :sync_status, SyncStatusReason = :sync_status_reason, LastExecId = :last_exec_id",
-        ExpressionAttributeValues={
-            ":sync_status": sync_status,
-            ":sync_status_reason": sync_status_reason,
-            ":last_exec_id": last_exec_id,
-        },
+        # NOTE: `Version` invalidates the bots cached by the backend.
+        UpdateExpression=f"{update_expression} ADD Version :one",
+        ExpressionAttributeValues=expression_attribute_values,
     )
 
 
@@ -165,6 +163,7 @@ def main(
     )
 
     status_reason = ""
+    vector_snapshot: bool | None = None
     try:
         if len(sitemap_urls) + len(source_urls) + len(filenames) == 0:
             logger.info("No contents to embed. Skipping.")
@@ -224,7 +223,28 @@ def main(
             logger.info(f"Number of chunks: {len(contents)}")
 
             # Insert records into postgres
-            insert_to_postgres(bot_id, contents, sources, embeddings)
+            ids = insert_to_postgres(bot_id, contents, sources, embeddings)
+            try:
+                ensure_bot_index(bot_id)
+            except Exception as e:
+                # The items are searched exactly until the index is built by the next sync.
+                logger.error(f"Failed to create the vector index of bot {bot_id}: {e}")
+            try:
+                # Small bots are searched in process. See `app/vector_stores/in_process.py`.
+                vector_snapshot = update_snapshot(
+                    bot_id, ids, list(contents), list(sources), list(embeddings)
+                )
+            except Exception as e:
+                vector_snapshot = False
+                # The items are already in PostgreSQL, so the sync itself succeeded.
+                logger.error(
+                    f"Failed to update the vector snapshot of bot {bot_id}: {e}"
+                )
+                try:
+                    # Fall back to PostgreSQL instead of searching a stale snapshot
+                    delete_snapshot(bot_id)
+                except Exception as e:
+                    logger.error(f"Failed to delete the vector snapshot: {e}")
             status_reason = "Successfully inserted to vector store."
     except Exception as e:
         logger.error("[ERROR] Failed to embed.")
@@ -244,6 +264,7 @@ def main(
         "SUCCEEDED",
         status_reason,
         exec_id,
+        vector_snapshot=vector_snapshot,
     )
 
 
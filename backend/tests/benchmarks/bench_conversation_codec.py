@@ -0,0 +1,123 @@
+"""Micro-benchmark of conversation (de)serialization.
+Usage: poetry run python tests/benchmarks/bench_conversation_codec.py
+"""
+
+import json
+import sys
+import time
+
+sys.path.append(".")
+
+from app.repositories.conversation import (
+    _compose_message_item,
+    _item_to_message_model,
+)
+from app.repositories.models.conversation import (
+    ChunkModel,
+    ContentModel,
+    FeedbackModel,
+    MessageModel,
+)
+
+SIZES = [100, 1_000, 10_000]
+# Large enough to keep every message inline (no S3 access)
+THRESHOLD = 1024 * 1024 * 1024
+
+
+def synthetic_message_map(size: int) -> dict[str, MessageModel]:
+    message_map = {}
+    for i in range(size):
+        message_map[str(i)] = MessageModel(
+            role="user" if i % 2 == 0 else "assistant",
+            content=[
+                ContentModel(
+                    content_type="text",
+                    body=f"Message {i}. " + "Lorem ipsum dolor sit amet. " * 20,
+                    media_type=None,
+                )
+            ],
+            model="claude-v3-haiku",
+            children=[str(i + 1)] if i + 1 < size else [],
+            parent=str(i - 1) if i > 0 else None,
+            create_time=1627984879.9 + i,
+            feedback=(
+                FeedbackModel(thumbs_up=True, category="", comment="")
+                if i % 10 == 0
+                else None
+            ),
+            used_chunks=(
+                [
+                    ChunkModel(
+                        content="chunk " * 50,
+                        content_type="s3",
+                        source=f"doc{j}.pdf",
+                        rank=j,
+                    )
+                    for j in range(3)
+                ]
+                if i % 2 == 1
+                else None
+            ),
+            thinking_log=None,
+        )
+    return message_map
+
+
+def bench_legacy(message_map: dict[str, MessageModel]) -> tuple[float, float]:
+    """Previous implementation: whole map as JSON, serialized twice."""
+    start = time.perf_counter()
+    dumped = {k: v.model_dump() for k, v in message_map.items()}
+    size = len(json.dumps(dumped).encode("utf-8"))
+    serialized = json.dumps(dumped)
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = json.loads(serialized)
+    {
+        k: MessageModel(
+            role=v["role"],
+            content=[ContentModel(**c) for c in v["content"]],
+            model=v["model"],
+            children=v["children"],
+            parent=v["parent"],
+            create_time=float(v["create_time"]),
+            feedback=FeedbackModel(**v["feedback"]) if v.get("feedback") else None,
+            used_chunks=(
+                [ChunkModel(**c) for c in v["used_chunks"]]
+                if v.get("used_chunks")
+                else None
+            ),
+            thinking_log=v.get("thinking_log"),
+        )
+        for k, v in loaded.items()
+    }
+    decode_time = time.perf_counter() - start
+    assert size > 0
+    return encode_time, decode_time
+
+
+def bench_codec(message_map: dict[str, MessageModel]) -> tuple[float, float]:
+    """Current implementation: one compressed buffer per message item."""
+    start = time.perf_counter()
+    items = [
+        _compose_message_item("user", "conv", k, v, THRESHOLD)
+        for k, v in message_map.items()
+    ]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for item in items:
+        _item_to_message_model(item)
+    decode_time = time.perf_counter() - start
+    return encode_time, decode_time
+
+
+if __name__ == "__main__":
+    print(f"{'messages':>10} {'impl':>8} {'encode[ms]':>12} {'decode[ms]':>12}")
+    for size in SIZES:
+        message_map = synthetic_message_map(size)
+        for name, bench in [("legacy", bench_legacy), ("codec", bench_codec)]:
+            encode_time, decode_time = bench(message_map)
+            print(
+                f"{size:>10} {name:>8} {encode_time * 1000:>12.1f} {decode_time * 1000:>12.1f}"
+            )
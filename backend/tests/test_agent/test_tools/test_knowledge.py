@@ -0,0 +1,59 @@
+import sys
+
+sys.path.append(".")
+import unittest
+from unittest.mock import patch
+
+from app.agents.tools.knowledge import AnswerWithKnowledgeTool
+from app.vector_search import SearchResult
+from langchain_core.language_models.fake import FakeListLLM
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
+
+
+class TestAnswerWithKnowledgeTool(unittest.TestCase):
+    def setUp(self):
+        self.bot = create_test_private_bot("bot1", False, "user1")
+        self.tool = AnswerWithKnowledgeTool.from_bot(
+            llm=FakeListLLM(responses=["answer"] * 2), bot=self.bot
+        )
+        self.results = [
+            SearchResult(bot_id="bot1", content="content", source="source", rank=0)
+        ]
+
+    def test_query(self):
+        with patch(
+            "app.agents.tools.knowledge.search_related_docs",
+            return_value=self.results,
+        ) as search_related_docs:
+            output = self.tool.run("question")
+        search_related_docs.assert_called_once_with(
+            "bot1",
+            limit=20,
+            query="question",
+            search_params=self.bot.search_params,
+            vector_snapshot=self.bot.vector_snapshot,
+        )
+        self.assertEqual(output["search_results"], self.results)
+        self.assertEqual(output["output"], "answer")
+
+    def test_related_queries(self):
+        with patch(
+            "app.agents.tools.knowledge.search_related_docs_many",
+            return_value=self.results,
+        ) as search_related_docs_many:
+            output = self.tool.run(
+                {"query": "question", "related_queries": ["rephrased", "sub"]}
+            )
+        # The related queries are searched together with the question
+        search_related_docs_many.assert_called_once_with(
+            "bot1",
+            ["question", "rephrased", "sub"],
+            limit=20,
+            search_params=self.bot.search_params,
+            vector_snapshot=self.bot.vector_snapshot,
+        )
+        self.assertEqual(output["search_results"], self.results)
+
+
+if __name__ == "__main__":
+    unittest.main()
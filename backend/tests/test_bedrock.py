@@ -5,7 +5,12 @@ sys.path.append(".")
 import unittest
 from pprint import pprint
 
-from app.bedrock import calculate_query_embedding
+from app.bedrock import (
+    calculate_query_embedding,
+    calculate_query_embeddings,
+    normalize_query,
+    query_embedding_cache,
+)
 from app.routes.schemas.conversation import type_model_name
 
 MODEL: type_model_name = "claude-v3-sonnet"
@@ -20,6 +25,28 @@ class TestBedrock(unittest.TestCase):
         self.assertEqual(type(embeddings), list)
         self.assertEqual(type(embeddings[0]), float)
 
+    def test_calculate_query_embeddings(self):
+        questions = ["What is Bedrock?", "What is S3?", "What is Bedrock?"]
+        embeddings = calculate_query_embeddings(questions)
+        self.assertEqual(len(embeddings), 3)
+        self.assertEqual(len(embeddings[0]), 1024)
+        # Same query, same embedding
+        self.assertEqual(embeddings[0], embeddings[2])
+        self.assertNotEqual(embeddings[0], embeddings[1])
+
+    def test_query_embedding_cache(self):
+        query_embedding_cache.clear()
+        embeddings = calculate_query_embedding("What is   Bedrock?")
+        # Same query after normalization
+        cached = calculate_query_embedding(" What is Bedrock?\n")
+        self.assertEqual(embeddings, cached)
+        self.assertEqual(query_embedding_cache.stats()["size"], 1)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  Hello \n\t World  "), "Hello World")
+        # Full-width characters are normalized
+        self.assertEqual(normalize_query("ＡＢＣ１２３"), "ABC123")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,52 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+from app.cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+
+    def test_hit_and_miss(self):
+        cache = TTLCache(maxsize=2, timer=self.timer)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_expire(self):
+        cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=100)
+        self.timer.now = 50
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        self.assertNotIn("a", cache)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, timer=self.timer)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # Touch `a` so that `b` becomes the least recently used
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+from app.postgres import ConnectionPool
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+        self.committed = 0
+        self.rolled_back = 0
+        self.prepared: list[str] = []
+
+    def run(self, sql: str):
+        if not self.healthy:
+            raise ConnectionError("connection is closed")
+
+    def prepare(self, operation: str):
+        self.prepared.append(operation)
+        return operation
+
+    def commit(self):
+        self.committed += 1
+
+    def rollback(self):
+        if not self.healthy:
+            raise ConnectionError("connection is closed")
+        self.rolled_back += 1
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.connections: list[FakeConnection] = []
+        self.pool = ConnectionPool(
+            connect=self._connect,
+            maxsize=1,
+            health_check_interval=10,
+            max_idle_time=100,
+            timer=self.timer,
+        )
+
+    def _connect(self) -> FakeConnection:
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+    def test_reuse_connection(self):
+        with self.pool.connection() as conn:
+            conn.prepare("SELECT 1")
+        with self.pool.connection() as conn:
+            conn.prepare("SELECT 1")
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].committed, 2)
+        # Prepared only once per connection
+        self.assertEqual(self.connections[0].prepared, ["SELECT 1"])
+
+    def test_discard_unhealthy_connection(self):
+        with self.pool.connection():
+            pass
+        self.connections[0].healthy = False
+        self.timer.now = 50
+
+        with self.pool.connection() as conn:
+            self.assertIs(conn.conn, self.connections[1])
+        self.assertTrue(self.connections[0].closed)
+
+    def test_close_idle_connection(self):
+        with self.pool.connection():
+            pass
+        self.timer.now = 200
+
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.connections), 2)
+        self.assertTrue(self.connections[0].closed)
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection():
+                raise ValueError("error")
+        self.assertEqual(self.connections[0].rolled_back, 1)
+
+        # Connections which cannot be rolled back are not returned to the pool
+        with self.assertRaises(ValueError):
+            with self.pool.connection():
+                self.connections[0].healthy = False
+                raise ValueError("error")
+        self.assertTrue(self.connections[0].closed)
+
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.connections), 2)
+
+    def test_maxsize(self):
+        with self.pool.connection():
+            with self.pool.connection():
+                pass
+        self.assertEqual(len(self.connections), 2)
+        # Only `maxsize` connections are kept
+        self.assertEqual(sum(c.closed for c in self.connections), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import json
+import sys
+import unittest
+
+sys.path.append(".")
+
+from app.repositories import codec
+from boto3.dynamodb.types import Binary
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "role": "assistant",
+            "content": [{"content_type": "text", "body": "こんにちは" * 100}],
+        }
+
+    def test_roundtrip(self):
+        encoded = codec.encode(self.data)
+        self.assertEqual(encoded[0], codec.VERSION_ZLIB_JSON)
+        self.assertLess(len(encoded), len(json.dumps(self.data).encode("utf-8")))
+        self.assertEqual(codec.decode(encoded), self.data)
+        # Binary attribute returned by DynamoDB
+        self.assertEqual(codec.decode(Binary(encoded)), self.data)
+
+    def test_decode_legacy_json(self):
+        raw = json.dumps(self.data)
+        self.assertEqual(codec.decode(raw), self.data)
+        self.assertEqual(codec.decode(raw.encode("utf-8")), self.data)
+
+    def test_unsupported_version(self):
+        with self.assertRaises(codec.UnsupportedCodecVersionError):
+            codec.decode(b"\xff")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,18 @@
 import sys
 import unittest
+from unittest.mock import patch
 
 sys.path.append(".")
 
+import base64
+import json
+
 from app.config import DEFAULT_EMBEDDING_CONFIG
+from app.repositories.common import (
+    _get_table_client,
+    compose_conv_id,
+    compose_partition_key,
+)
 from app.repositories.conversation import (
     ContentModel,
     ConversationModel,
@@ -14,6 +23,8 @@ from app.repositories.conversation import (
     delete_conversation_by_user_id,
     find_conversation_by_id,
     find_conversation_by_user_id,
+    find_conversation_page_by_user_id,
+    find_conversation_path,
     store_conversation,
     update_feedback,
 )
@@ -22,6 +33,7 @@ from app.repositories.custom_bot import (
     find_private_bots_by_user_id,
     store_bot,
 )
+from app.repositories.image import is_image_reference, resolve_image_body
 from app.repositories.models.conversation import ChunkModel, FeedbackModel
 from app.repositories.models.custom_bot import (
     AgentModel,
@@ -308,6 +320,468 @@ class TestConversationRepository(unittest.TestCase):
         self.assertEqual(len(conversations), 0)
 
 
+class TestFindConversationPath(unittest.TestCase):
+    def setUp(self) -> None:
+        def message(parent, children):
+            return MessageModel(
+                role="user",
+                content=[
+                    ContentModel(content_type="text", body="Hello", media_type=None)
+                ],
+                model="claude-instant-v1",
+                children=children,
+                parent=parent,
+                create_time=1627984879.9,
+                feedback=None,
+                used_chunks=None,
+                thinking_log=None,
+            )
+
+        self.message = message
+        # system -> a -> b1 (edited to b2) -> c
+        conversation = ConversationModel(
+            id="branched",
+            create_time=1627984879.9,
+            title="Branched Conversation",
+            total_price=0,
+            message_map={
+                "system": message(None, ["a"]),
+                "a": message("system", ["b1", "b2"]),
+                "b1": message("a", []),
+                "b2": message("a", ["c"]),
+                "c": message("b2", []),
+            },
+            last_message_id="c",
+            bot_id=None,
+            should_continue=False,
+        )
+        store_conversation("user", conversation)
+
+    def test_find_conversation_path(self):
+        conversation = find_conversation_path("user", "branched")
+        self.assertEqual(
+            set(conversation.message_map.keys()), {"system", "a", "b2", "c"}
+        )
+        self.assertEqual(conversation.message_map["a"].children, ["b1", "b2"])
+
+        # Path to the other branch. The last message is always included.
+        conversation = find_conversation_path("user", "branched", leaf_id="b1")
+        self.assertEqual(
+            set(conversation.message_map.keys()), {"system", "a", "b1", "c"}
+        )
+
+    def test_message_items_off_the_path_not_read(self):
+        with patch(
+            "app.repositories.conversation._find_message_items"
+        ) as find_message_items:
+            conversation = find_conversation_path("user", "branched")
+        find_message_items.assert_not_called()
+
+        # A new turn adds the parents of the new messages in place
+        conversation.message_map["d"] = self.message("c", [])
+        conversation.message_map["c"].children.append("d")
+        conversation.last_message_id = "d"
+        store_conversation("user", conversation, message_ids=["c", "d"])
+        with patch(
+            "app.repositories.conversation._find_message_items"
+        ) as find_message_items:
+            conversation = find_conversation_path("user", "branched")
+        find_message_items.assert_not_called()
+        self.assertEqual(
+            set(conversation.message_map.keys()), {"system", "a", "b2", "c", "d"}
+        )
+
+    def test_conversation_without_message_parents(self):
+        # Stored before the parents were kept on the conversation item
+        table = _get_table_client("user")
+        key = {
+            "PK": compose_partition_key("user", "branched"),
+            "SK": compose_conv_id("user", "branched"),
+        }
+        table.update_item(Key=key, UpdateExpression="REMOVE MessageParents")
+
+        conversation = find_conversation_path("user", "branched")
+        self.assertEqual(
+            set(conversation.message_map.keys()), {"system", "a", "b2", "c"}
+        )
+
+        # Added by the next write, even if it only has the messages on the path
+        store_conversation("user", conversation, message_ids=["c"])
+        self.assertEqual(
+            table.get_item(Key=key)["Item"]["MessageParents"],
+            {"system": None, "a": "system", "b1": "a", "b2": "a", "c": "b2"},
+        )
+
+    def test_update_feedback(self):
+        update_feedback(
+            user_id="user",
+            conversation_id="branched",
+            message_id="b2",
+            feedback=FeedbackModel(thumbs_up=False, category="Bad", comment="Wrong"),
+        )
+        conversation = find_conversation_path("user", "branched")
+        feedback = conversation.message_map["b2"].feedback
+        self.assertIsNotNone(feedback)
+        self.assertEqual(feedback.category, "Bad")  # type: ignore
+        self.assertEqual(conversation.message_map["b2"].content[0].body, "Hello")
+
+        with self.assertRaises(RecordNotFoundError):
+            update_feedback(
+                user_id="user",
+                conversation_id="branched",
+                message_id="unknown",
+                feedback=FeedbackModel(thumbs_up=True, category="", comment=""),
+            )
+
+    def tearDown(self) -> None:
+        delete_conversation_by_user_id("user")
+
+
+class TestLegacyConversationRepository(unittest.TestCase):
+    def setUp(self) -> None:
+        # Store a conversation in the legacy layout (whole message map in a single item)
+        self.message_map = {
+            "system": MessageModel(
+                role="system",
+                content=[ContentModel(content_type="text", body="", media_type=None)],
+                model="claude-instant-v1",
+                children=["a"],
+                parent=None,
+                create_time=1627984879.9,
+                feedback=None,
+                used_chunks=None,
+                thinking_log=None,
+            ),
+            "a": MessageModel(
+                role="user",
+                content=[
+                    ContentModel(content_type="text", body="Hello", media_type=None)
+                ],
+                model="claude-instant-v1",
+                children=[],
+                parent="system",
+                create_time=1627984879.9,
+                feedback=None,
+                used_chunks=None,
+                thinking_log=None,
+            ),
+        }
+        table = _get_table_client("user")
+        table.put_item(
+            Item={
+                "PK": "user",
+                "SK": compose_conv_id("user", "legacy"),
+                "Title": "Legacy Conversation",
+                "CreateTime": 1627984879,
+                "TotalPrice": 0,
+                "LastMessageId": "a",
+                "ShouldContinue": False,
+                "IsLargeMessage": False,
+                "MessageMap": json.dumps(
+                    {k: v.model_dump() for k, v in self.message_map.items()}
+                ),
+            }
+        )
+
+    def test_find_and_migrate_legacy_conversation(self):
+        conversations = find_conversation_by_user_id(user_id="user")
+        self.assertEqual(len(conversations), 1)
+        self.assertEqual(conversations[0].model, "claude-instant-v1")
+
+        conversation = find_conversation_by_id(user_id="user", conversation_id="legacy")
+        self.assertEqual(len(conversation.message_map), 2)
+        self.assertEqual(conversation.message_map["a"].content[0].body, "Hello")
+
+        # Append a message. Only the touched messages are specified,
+        # but the legacy conversation must be migrated as a whole.
+        conversation.message_map["b"] = MessageModel(
+            role="assistant",
+            content=[ContentModel(content_type="text", body="Hi", media_type=None)],
+            model="claude-instant-v1",
+            children=[],
+            parent="a",
+            create_time=1627984880.0,
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
+        conversation.message_map["a"].children.append("b")
+        conversation.last_message_id = "b"
+        store_conversation("user", conversation, message_ids=["a", "b"])
+
+        item = _get_table_client("user").get_item(
+            Key={"PK": "user", "SK": compose_conv_id("user", "legacy")}
+        )["Item"]
+        self.assertNotIn("MessageMap", item)
+
+        found = find_conversation_by_id(user_id="user", conversation_id="legacy")
+        self.assertEqual(set(found.message_map.keys()), {"system", "a", "b"})
+        self.assertEqual(found.message_map["a"].children, ["b"])
+        self.assertEqual(found.last_message_id, "b")
+
+    def tearDown(self) -> None:
+        delete_conversation_by_user_id("user")
+
+
+class TestConversationImage(unittest.TestCase):
+    def _message(self, parent: str | None, children: list[str]) -> MessageModel:
+        return MessageModel(
+            role="user",
+            content=[
+                ContentModel(
+                    content_type="image", media_type="image/png", body=self.image
+                ),
+                ContentModel(
+                    content_type="text", body="What is this?", media_type=None
+                ),
+            ],
+            model="claude-v3-haiku",
+            children=children,
+            parent=parent,
+            create_time=1627984879.9,
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
+
+    def setUp(self) -> None:
+        self.image = base64.b64encode(b"\x89PNG dummy image").decode("utf-8")
+        store_conversation("user", self._conversation("image"))
+
+    def _conversation(self, id: str) -> ConversationModel:
+        return ConversationModel(
+            id=id,
+            create_time=1627984879.9,
+            title="Image Conversation",
+            total_price=0,
+            message_map={
+                "a": self._message(None, ["b"]),
+                # Same image uploaded again in a later turn
+                "b": self._message("a", []),
+            },
+            last_message_id="b",
+            bot_id=None,
+            should_continue=False,
+        )
+
+    def test_image_stored_by_reference(self):
+        found = find_conversation_by_id(user_id="user", conversation_id="image")
+        body_a = found.message_map["a"].content[0].body
+        body_b = found.message_map["b"].content[0].body
+        self.assertTrue(is_image_reference(body_a))
+        # Deduplicated by content hash
+        self.assertEqual(body_a, body_b)
+        self.assertEqual(resolve_image_body(body_a), self.image)
+        # Text is kept inline
+        self.assertEqual(found.message_map["a"].content[1].body, "What is this?")
+
+    def test_images_deleted_with_conversation(self):
+        store_conversation("user", self._conversation("other"))
+        body = find_conversation_by_id("user", "image").message_map["a"].content[0].body
+        other_body = find_conversation_by_id("user", "other").message_map["a"]
+        other_body = other_body.content[0].body
+        # Stored per conversation
+        self.assertNotEqual(body, other_body)
+
+        delete_conversation_by_id("user", "image")
+        with self.assertRaises(ClientError):
+            resolve_image_body(body)
+        # Images of other conversations are kept
+        self.assertEqual(resolve_image_body(other_body), self.image)
+
+    def tearDown(self) -> None:
+        delete_conversation_by_user_id("user")
+
+
+class TestConversationPagination(unittest.TestCase):
+    def setUp(self) -> None:
+        for i in range(3):
+            store_conversation(
+                "user",
+                ConversationModel(
+                    id=f"conv{i}",
+                    create_time=1627984879.9 + i,
+                    title=f"Conversation {i}",
+                    total_price=0,
+                    message_map={
+                        "system": MessageModel(
+                            role="system",
+                            content=[
+                                ContentModel(
+                                    content_type="text",
+                                    body="Hello" * 1000,
+                                    media_type=None,
+                                )
+                            ],
+                            model="claude-v3-haiku",
+                            children=[],
+                            parent=None,
+                            create_time=1627984879.9,
+                            feedback=None,
+                            used_chunks=None,
+                            thinking_log=None,
+                        )
+                    },
+                    last_message_id="system",
+                    bot_id=None,
+                    should_continue=False,
+                ),
+            )
+
+    def test_pagination(self):
+        page1, next_token = find_conversation_page_by_user_id("user", limit=2)
+        self.assertEqual(len(page1), 2)
+        self.assertIsNotNone(next_token)
+        self.assertEqual(page1[0].model, "claude-v3-haiku")
+
+        page2, next_token = find_conversation_page_by_user_id(
+            "user", limit=2, next_token=next_token
+        )
+        self.assertEqual(len(page2), 1)
+        self.assertIsNone(next_token)
+
+        ids = {c.id for c in page1 + page2}
+        self.assertEqual(ids, {"conv0", "conv1", "conv2"})
+
+    def test_invalid_next_token(self):
+        with self.assertRaises(ValueError):
+            find_conversation_page_by_user_id("user", next_token="invalid")
+
+    def tearDown(self) -> None:
+        delete_conversation_by_user_id("user")
+
+
+class TestPublishedApiConversation(unittest.TestCase):
+    def _conversation(self, id: str) -> ConversationModel:
+        return ConversationModel(
+            id=id,
+            create_time=1627984879.9,
+            title=f"Conversation {id}",
+            total_price=0,
+            message_map={
+                "system": MessageModel(
+                    role="system",
+                    content=[
+                        ContentModel(content_type="text", body="", media_type=None)
+                    ],
+                    model="claude-v3-haiku",
+                    children=[],
+                    parent=None,
+                    create_time=1627984879.9,
+                    feedback=None,
+                    used_chunks=None,
+                    thinking_log=None,
+                )
+            },
+            last_message_id="system",
+            bot_id="bot1",
+            should_continue=False,
+        )
+
+    def setUp(self) -> None:
+        self.user_id = "PUBLISHED_API#bot1"
+        self.ids = [f"conv{i}" for i in range(8)]
+        for id in self.ids:
+            store_conversation(self.user_id, self._conversation(id))
+
+    def test_conversations_are_sharded(self):
+        partition_keys = {compose_partition_key(self.user_id, id) for id in self.ids}
+        self.assertGreater(len(partition_keys), 1)
+        for partition_key in partition_keys:
+            self.assertTrue(partition_key.startswith(f"{self.user_id}#"))
+
+        # Normal users are not sharded
+        self.assertEqual(compose_partition_key("user", "conv0"), "user")
+
+        found = find_conversation_by_id(self.user_id, "conv0")
+        self.assertEqual(found.bot_id, "bot1")
+        self.assertEqual(found.message_map["system"].model, "claude-v3-haiku")
+
+    def test_find_all_shards(self):
+        conversations = find_conversation_by_user_id(self.user_id)
+        self.assertEqual({c.id for c in conversations}, set(self.ids))
+
+        ids = []
+        page, next_token = find_conversation_page_by_user_id(self.user_id, limit=3)
+        ids.extend(c.id for c in page)
+        while next_token:
+            page, next_token = find_conversation_page_by_user_id(
+                self.user_id, limit=3, next_token=next_token
+            )
+            ids.extend(c.id for c in page)
+        self.assertCountEqual(ids, self.ids)
+
+        delete_conversation_by_id(self.user_id, "conv0")
+        with self.assertRaises(RecordNotFoundError):
+            find_conversation_by_id(self.user_id, "conv0")
+
+    def _put_unsharded_conversation(self, conversation_id: str):
+        conversation = self._conversation(conversation_id)
+        _get_table_client(self.user_id).put_item(
+            Item={
+                "PK": self.user_id,
+                "SK": f"{self.user_id}#CONV#{conversation_id}",
+                "Title": "Legacy Conversation",
+                "CreateTime": 1627984879,
+                "TotalPrice": 0,
+                "LastMessageId": "system",
+                "ShouldContinue": False,
+                "BotId": "bot1",
+                "IsLargeMessage": False,
+                "MessageMap": json.dumps(
+                    {k: v.model_dump() for k, v in conversation.message_map.items()}
+                ),
+            }
+        )
+
+    def test_migrate_unsharded_conversation(self):
+        self._put_unsharded_conversation("legacy")
+        found = find_conversation_by_id(self.user_id, "legacy")
+        self.assertEqual(found.title, "Legacy Conversation")
+        self.assertIn(
+            "legacy", {c.id for c in find_conversation_by_user_id(self.user_id)}
+        )
+
+        # The unsharded item is moved to the shard on write
+        store_conversation(self.user_id, found)
+        table = _get_table_client(self.user_id)
+        response = table.get_item(
+            Key={"PK": self.user_id, "SK": f"{self.user_id}#CONV#legacy"}
+        )
+        self.assertNotIn("Item", response)
+        response = table.get_item(
+            Key={
+                "PK": compose_partition_key(self.user_id, "legacy"),
+                "SK": compose_conv_id(self.user_id, "legacy"),
+            }
+        )
+        self.assertIn("Item", response)
+        self.assertEqual(
+            find_conversation_by_id(self.user_id, "legacy").title,
+            "Legacy Conversation",
+        )
+        # Listed only once
+        self.assertEqual(
+            [c.id for c in find_conversation_by_user_id(self.user_id)].count("legacy"),
+            1,
+        )
+
+    def test_delete_conversation_under_all_keys(self):
+        # A stale copy left under the unsharded key
+        store_conversation(self.user_id, self._conversation("legacy"))
+        self._put_unsharded_conversation("legacy")
+
+        delete_conversation_by_id(self.user_id, "legacy")
+        with self.assertRaises(RecordNotFoundError):
+            find_conversation_by_id(self.user_id, "legacy")
+        with self.assertRaises(RecordNotFoundError):
+            delete_conversation_by_id(self.user_id, "legacy")
+
+    def tearDown(self) -> None:
+        delete_conversation_by_user_id(self.user_id)
+        self.assertEqual(find_conversation_by_user_id(self.user_id), [])
+
+
 class TestConversationBotRepository(unittest.TestCase):
     def setUp(self) -> None:
         conversation1 = ConversationModel(
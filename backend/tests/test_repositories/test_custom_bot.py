@@ -1,5 +1,6 @@
 import sys
 import unittest
+from unittest.mock import patch
 
 sys.path.insert(0, ".")
 
@@ -12,6 +13,7 @@ from app.repositories.custom_bot import (
     find_private_bot_by_id,
     find_private_bots_by_user_id,
     find_public_bots_by_ids,
+    find_public_bots_by_ids_concurrently,
     store_alias,
     store_bot,
     update_alias_last_used_time,
@@ -293,6 +295,16 @@ class TestFindAllBots(unittest.IsolatedAsyncioTestCase):
         # 2 public bots and 2 private bots
         self.assertEqual(len(bots), 2)
 
+    def test_find_public_bots_by_ids_concurrently(self):
+        bots = find_public_bots_by_ids_concurrently(
+            ["public1", "public2", "1", "unknown"], max_workers=2
+        )
+        # Private and unknown bots are not included
+        self.assertEqual(set(bots), {"public1", "public2"})
+        self.assertEqual(bots["public1"].id, "public1")
+        self.assertEqual(bots["public1"].owner_user_id, "user2")
+        self.assertEqual(find_public_bots_by_ids_concurrently([]), {})
+
     async def test_find_all_published_bots(self):
         bots, next_token = find_all_published_bots()
         # Bot should not contain unpublished bots
@@ -302,6 +314,36 @@ class TestFindAllBots(unittest.IsolatedAsyncioTestCase):
         # Next token should be None
         self.assertIsNone(next_token)
 
+    async def test_find_bots_with_indexes(self):
+        # Published but not public
+        update_bot_publication("user2", "public2", "api2", "build2")
+        update_bot_visibility("user2", "public2", False)
+
+        for enable_bot_indexes in (False, True):
+            with self.subTest(enable_bot_indexes=enable_bot_indexes), patch(
+                "app.repositories.custom_bot.ENABLE_BOT_INDEXES", enable_bot_indexes
+            ):
+                bots, _ = find_all_published_bots()
+                self.assertIn("public1", [bot.id for bot in bots])
+                self.assertNotIn("public2", [bot.id for bot in bots])
+
+                bots = find_private_bots_by_user_id("user1")
+                self.assertEqual({bot.id for bot in bots}, {"1", "2", "3", "4"})
+                bots = find_private_bots_by_user_id("user1", limit=3)
+                self.assertEqual(len(bots), 3)
+
+        with patch("app.repositories.custom_bot.ENABLE_BOT_INDEXES", True):
+            # Public again, so listed again
+            update_bot_visibility("user2", "public2", True)
+            # `Limit` is the number of bots, and the next token continues after them
+            bots, next_token = find_all_published_bots(limit=1)
+            self.assertEqual(len(bots), 1)
+            self.assertIsNotNone(next_token)
+            next_bots, _ = find_all_published_bots(limit=1, next_token=next_token)
+            self.assertEqual(
+                {bot.id for bot in bots + next_bots}, {"public1", "public2"}
+            )
+
 
 class TestUpdateBotVisibility(unittest.TestCase):
     def setUp(self) -> None:
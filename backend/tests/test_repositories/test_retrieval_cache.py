@@ -0,0 +1,39 @@
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.repositories import retrieval_cache
+from app.repositories.retrieval_cache import (
+    find_retrieval_results,
+    store_retrieval_results,
+)
+
+results = [
+    {"bot_id": "bot1", "content": "content1", "source": "source1", "rank": 0},
+    {"bot_id": "bot1", "content": "content2", "source": "source2", "rank": 1},
+]
+
+
+class TestRetrievalCache(unittest.TestCase):
+    def test_store_and_find_retrieval_results(self):
+        store_retrieval_results("user1", "key1", results, ttl=60)
+        self.assertEqual(find_retrieval_results("user1", "key1"), results)
+        # Other users cannot read them
+        self.assertIsNone(find_retrieval_results("user2", "key1"))
+        self.assertIsNone(find_retrieval_results("user1", "key2"))
+
+    def test_expired_retrieval_results(self):
+        store_retrieval_results("user1", "key3", results, ttl=60)
+        with patch.object(retrieval_cache.time, "time", return_value=10**10):
+            self.assertIsNone(find_retrieval_results("user1", "key3"))
+
+    def test_large_retrieval_results(self):
+        with patch.object(retrieval_cache, "THRESHOLD_LARGE_RESULTS", 10):
+            store_retrieval_results("user1", "key4", results, ttl=60)
+        self.assertIsNone(find_retrieval_results("user1", "key4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import re
 import sys
 import unittest
 
@@ -5,7 +6,13 @@ sys.path.append(".")
 
 from pprint import pprint
 
+from app.repositories.common import (
+    PUBLISHED_API_PARTITION_KEY_PATTERN,
+    compose_partition_key,
+    decompose_partition_key,
+)
 from app.repositories.usage_analysis import (
+    _compose_users_sorted_by_price_query,
     _find_cognito_user_by_id,
     _find_cognito_users_by_ids,
     find_bots_sorted_by_price,
@@ -27,6 +34,28 @@ class TestUsageAnalysis(unittest.IsolatedAsyncioTestCase):
         pprint([user.model_dump() for user in users])
 
 
+class TestUsersSortedByPriceQuery(unittest.TestCase):
+    def test_published_api_shards_are_aggregated(self):
+        user_id = "PUBLISHED_API#bot1"
+        partition_keys = {compose_partition_key(user_id, f"conv{i}") for i in range(32)}
+        self.assertGreater(len(partition_keys), 1)
+        for partition_key in partition_keys:
+            self.assertEqual(decompose_partition_key(partition_key), user_id)
+        # Unsharded keys are kept as is
+        self.assertEqual(decompose_partition_key(user_id), user_id)
+        self.assertEqual(decompose_partition_key("user#1"), "user#1")
+
+        query = _compose_users_sorted_by_price_query(
+            limit=10, from_str="2024/01/01/00", to_str="2024/12/01/00"
+        )
+        self.assertIn(
+            f"regexp_replace(p.UserId, '{PUBLISHED_API_PARTITION_KEY_PATTERN}', '$1') AS UserId",
+            query,
+        )
+        # The user id is aggregated after the shard suffix is removed
+        self.assertRegex(query, re.compile(r"AggregatedData\s+GROUP BY\s+UserId"))
+
+
 class TestCognitoUser(unittest.IsolatedAsyncioTestCase):
     async def test_find_cognito_user_by_id(self):
         user = _find_cognito_user_by_id("07645ad8-b041-702e-9852-98b169c9f1b1")
@@ -129,4 +129,5 @@ def create_test_public_bot(
         published_api_datetime=None,
         published_api_codebuild_id=None,
         display_retrieved_chunks=True,
+        conversation_quick_starters=[],
     )
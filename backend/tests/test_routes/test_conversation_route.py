@@ -0,0 +1,59 @@
+import sys
+
+sys.path.append(".")
+import unittest
+from unittest.mock import patch
+
+from app.repositories.models.conversation import ConversationMeta
+from app.routes.conversation import router
+from app.user import User
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+
+def create_test_client() -> TestClient:
+    app = FastAPI()
+    app.include_router(router)
+
+    @app.middleware("http")
+    async def add_current_user_to_request(request: Request, call_next):
+        request.state.current_user = User(id="user1", name="user1", groups=[])
+        return await call_next(request)
+
+    return TestClient(app)
+
+
+class TestGetAllConversations(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = create_test_client()
+        self.conversation = ConversationMeta(
+            id="1",
+            title="Test Conversation",
+            create_time=1627984879.9,
+            model="claude-v3-haiku",
+            bot_id=None,
+        )
+
+    def test_page(self):
+        with patch(
+            "app.routes.conversation.find_conversation_page_by_user_id",
+            return_value=([self.conversation], "token"),
+        ) as find_page:
+            response = self.client.get("/conversations", params={"limit": 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["id"] for c in response.json()], ["1"])
+        self.assertEqual(response.headers["X-Next-Token"], "token")
+        find_page.assert_called_once_with("user1", limit=10, next_token=None)
+
+    def test_invalid_limit(self):
+        with patch(
+            "app.routes.conversation.find_conversation_page_by_user_id"
+        ) as find_page:
+            for limit in (0, -1, 101):
+                response = self.client.get("/conversations", params={"limit": limit})
+                self.assertEqual(response.status_code, 422)
+        find_page.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@ import sys
 
 sys.path.insert(0, ".")
 import unittest
+from unittest.mock import patch
 
 from pydantic import BaseModel
 
@@ -11,18 +12,30 @@ from tests.test_usecases.utils.bot_factory import (
     create_test_public_bot,
 )
 
+from app.repositories.common import RecordNotFoundError
 from app.repositories.custom_bot import (
+    bot_cache,
     delete_alias_by_id,
     delete_bot_by_id,
+    find_alias_by_id,
+    find_private_bot_by_id,
     store_alias,
     store_bot,
     update_alias_last_used_time,
+    update_bot,
     update_bot_last_used_time,
     update_bot_publication,
     update_bot_visibility,
 )
 
-from app.usecases.bot import fetch_all_bots_by_user_id, issue_presigned_url
+from app.usecases.bot import (
+    _find_original_bots,
+    _last_used_time_updated,
+    fetch_all_bots_by_user_id,
+    fetch_bot,
+    issue_presigned_url,
+    modify_bot_last_used_time,
+)
 
 
 class TestIssuePresignedUrl(unittest.TestCase):
@@ -141,6 +154,148 @@ class TestFindAllBots(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(bots[4].id, self.third_bot_id)
         self.assertEqual(bots[5].id, self.first_bot_id)
 
+    def test_stale_alias_refreshed(self):
+        alias = find_alias_by_id(self.first_user_id, self.first_bot_alias_id)
+        self.assertEqual(alias.title, "Test Alias")
+
+        fetch_all_bots_by_user_id(self.first_user_id, limit=6)
+        alias = find_alias_by_id(self.first_user_id, self.first_bot_alias_id)
+        self.assertEqual(alias.title, "Test Public Bot")
+
+    def test_original_bots_validated_and_copied(self):
+        bot_cache.clear()
+        originals = _find_original_bots([self.first_public_bot_id])
+        # Mutating the result does not modify the cache
+        originals[self.first_public_bot_id].title = "Modified"
+        originals = _find_original_bots([self.first_public_bot_id])
+        self.assertEqual(originals[self.first_public_bot_id].title, "Test Public Bot")
+
+        # Closed on another instance
+        with patch("app.repositories.custom_bot.invalidate_bot_cache"):
+            update_bot_visibility(self.second_user_id, self.first_public_bot_id, False)
+        self.assertEqual(_find_original_bots([self.first_public_bot_id]), {})
+
+
+class TestFetchBot(unittest.TestCase):
+    owner_user_id = "user1"
+    other_user_id = "user2"
+    bot_id = "public1"
+
+    def setUp(self) -> None:
+        bot_cache.clear()
+        store_bot(
+            self.owner_user_id,
+            create_test_public_bot(self.bot_id, True, self.owner_user_id),
+        )
+        update_bot_visibility(self.owner_user_id, self.bot_id, True)
+
+    def test_fetch_bot_cached(self):
+        owned, bot = fetch_bot(self.other_user_id, self.bot_id)
+        self.assertFalse(owned)
+        self.assertEqual(bot.owner_user_id, self.owner_user_id)
+
+        hits = bot_cache.stats()["hits"]
+        owned, _ = fetch_bot(self.owner_user_id, self.bot_id)
+        self.assertTrue(owned)
+        self.assertEqual(bot_cache.stats()["hits"], hits + 1)
+
+    def test_invalidated_on_update(self):
+        fetch_bot(self.other_user_id, self.bot_id)
+        # Closing the bot must take effect immediately for other users
+        update_bot_visibility(self.owner_user_id, self.bot_id, False)
+        with self.assertRaises(RecordNotFoundError):
+            fetch_bot(self.other_user_id, self.bot_id)
+
+        owned, _ = fetch_bot(self.owner_user_id, self.bot_id)
+        self.assertTrue(owned)
+
+    def test_changed_on_another_instance(self):
+        fetch_bot(self.other_user_id, self.bot_id)
+        # Closed without invalidating the cache of this instance
+        with patch("app.repositories.custom_bot.invalidate_bot_cache"):
+            update_bot_visibility(self.owner_user_id, self.bot_id, False)
+        with self.assertRaises(RecordNotFoundError):
+            fetch_bot(self.other_user_id, self.bot_id)
+
+    def test_modified_on_another_instance(self):
+        _, bot = fetch_bot(self.owner_user_id, self.bot_id)
+        with patch("app.repositories.custom_bot.invalidate_bot_cache"):
+            update_bot(
+                self.owner_user_id,
+                self.bot_id,
+                title="Modified",
+                description=bot.description,
+                instruction=bot.instruction,
+                embedding_params=bot.embedding_params,
+                generation_params=bot.generation_params,
+                search_params=bot.search_params,
+                agent=bot.agent,
+                knowledge=bot.knowledge,
+                sync_status=bot.sync_status,
+                sync_status_reason=bot.sync_status_reason,
+                display_retrieved_chunks=bot.display_retrieved_chunks,
+                conversation_quick_starters=bot.conversation_quick_starters,
+            )
+        # The version of the cached bot is outdated
+        _, bot = fetch_bot(self.owner_user_id, self.bot_id)
+        self.assertEqual(bot.title, "Modified")
+        hits = bot_cache.stats()["hits"]
+        _, bot = fetch_bot(self.owner_user_id, self.bot_id)
+        self.assertEqual(bot_cache.stats()["hits"], hits + 1)
+        self.assertEqual(bot.title, "Modified")
+
+    def test_cached_bot_is_copied(self):
+        _, bot = fetch_bot(self.owner_user_id, self.bot_id)
+        bot.title = "Modified"
+        _, bot = fetch_bot(self.owner_user_id, self.bot_id)
+        self.assertNotEqual(bot.title, "Modified")
+        bot.title = "Modified"
+        _, bot = fetch_bot(self.owner_user_id, self.bot_id)
+        self.assertNotEqual(bot.title, "Modified")
+
+    def tearDown(self) -> None:
+        delete_bot_by_id(self.owner_user_id, self.bot_id)
+
+
+class TestModifyBotLastUsedTime(unittest.TestCase):
+    user_id = "user1"
+    bot_id = "1"
+
+    def setUp(self) -> None:
+        _last_used_time_updated.clear()
+        store_bot(
+            self.user_id, create_test_private_bot(self.bot_id, True, self.user_id)
+        )
+
+    def test_coalesced(self):
+        modify_bot_last_used_time(self.user_id, self.bot_id)
+        last_used_time = find_private_bot_by_id(
+            self.user_id, self.bot_id
+        ).last_used_time
+        self.assertGreater(last_used_time, 1627984879.9)
+
+        # Second update within the interval is skipped
+        modify_bot_last_used_time(self.user_id, self.bot_id)
+        self.assertEqual(
+            find_private_bot_by_id(self.user_id, self.bot_id).last_used_time,
+            last_used_time,
+        )
+
+        # Also skipped by the condition when another instance updated it recently
+        _last_used_time_updated.clear()
+        modify_bot_last_used_time(self.user_id, self.bot_id)
+        self.assertEqual(
+            find_private_bot_by_id(self.user_id, self.bot_id).last_used_time,
+            last_used_time,
+        )
+
+    def test_not_found(self):
+        with self.assertRaises(RecordNotFoundError):
+            modify_bot_last_used_time(self.user_id, "unknown")
+
+    def tearDown(self) -> None:
+        delete_bot_by_id(self.user_id, self.bot_id)
+
 
 if __name__ == "__main__":
     unittest.main()
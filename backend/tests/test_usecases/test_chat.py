@@ -859,13 +859,25 @@ class TestInsertKnowledge(unittest.TestCase):
             },
             bot_id="bot1",
             last_message_id="1-user",
-            continue_generate=False,
+            should_continue=False,
         )
         conversation_with_context = insert_knowledge(
             conversation, results, display_citation=True
         )
         print(conversation_with_context.message_map["instruction"])
 
+        # The original conversation is left untouched and other messages are shared
+        self.assertNotEqual(
+            conversation_with_context.message_map["instruction"].content[0].body,
+            conversation.message_map["instruction"].content[0].body,
+        )
+        self.assertIs(
+            conversation_with_context.message_map["1-user"],
+            conversation.message_map["1-user"],
+        )
+        messages = trace_to_root("1-user", conversation_with_context.message_map)
+        self.assertEqual(len(messages), 2)
+
 
 class TestStreamingApi(unittest.TestCase):
     def test_streaming_api(self):
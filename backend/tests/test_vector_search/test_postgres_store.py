@@ -0,0 +1,144 @@
+"""Tests of the SQL of the PostgreSQL vector store against a real server.
+Set `POSTGRES_TEST_HOST` (and optionally `POSTGRES_TEST_PORT`, `POSTGRES_TEST_USER`,
+`POSTGRES_TEST_PASSWORD`, `POSTGRES_TEST_DBNAME`) to a server with pgvector to run them.
+The items are written to a temporary table, which hides any `items` table of the database.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+
+import pg8000
+from app.postgres import PooledConnection
+from app.vector_stores import postgres
+from app.vector_stores.postgres import (
+    compose_index_name,
+    keyword_search,
+    parse_vector,
+    search,
+    search_many,
+)
+
+POSTGRES_TEST_HOST = os.environ.get("POSTGRES_TEST_HOST", "")
+
+BOT_ID = "BOT1"
+OTHER_BOT_ID = "BOT2"
+
+
+@unittest.skipUnless(POSTGRES_TEST_HOST, "POSTGRES_TEST_HOST is not set")
+class TestPostgresVectorStore(unittest.TestCase):
+    def setUp(self):
+        self.conn = PooledConnection(
+            pg8000.connect(
+                host=POSTGRES_TEST_HOST,
+                port=int(os.environ.get("POSTGRES_TEST_PORT", 5432)),
+                user=os.environ.get("POSTGRES_TEST_USER", "postgres"),
+                password=os.environ.get("POSTGRES_TEST_PASSWORD"),
+                database=os.environ.get("POSTGRES_TEST_DBNAME", "postgres"),
+            ),
+            time.monotonic,
+        )
+        with self.conn.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            cursor.execute(
+                "CREATE TEMPORARY TABLE items (id text PRIMARY KEY, botid text, "
+                "content text, source text, embedding vector(2), tsv tsvector)"
+            )
+        postgres._index_cache.clear()
+
+    def tearDown(self):
+        self.conn.conn.close()
+        postgres._index_cache.clear()
+
+    def _insert(self, bot_id: str, items: list[tuple[str, str, list[float]]]):
+        with self.conn.cursor() as cursor:
+            for id, content, embedding in items:
+                cursor.execute(
+                    "INSERT INTO items VALUES "
+                    "(%s, %s, %s, %s, %s::real[]::vector, to_tsvector('simple', %s))",
+                    (id, bot_id, content, f"s3://{id}", embedding, content),
+                )
+
+    def test_keyword_search(self):
+        self._insert(
+            BOT_ID,
+            [
+                ("a", "apple pie", [0.0, 0.0]),
+                ("b", "banana bread", [1.0, 0.0]),
+                ("c", "it's a 'quoted' c:\\path", [2.0, 0.0]),
+                ("d", "model E-1234 foo:bar", [3.0, 0.0]),
+            ],
+        )
+        self._insert(OTHER_BOT_ID, [("x", "apple banana", [0.0, 0.0])])
+
+        def search(query: str) -> list[str]:
+            rows = keyword_search(self.conn, BOT_ID, query, [0.0, 0.0], 10)
+            return sorted(row[0] for row in rows)
+
+        # Terms are OR-ed, and only the items of the bot are matched
+        self.assertEqual(search("apple banana"), ["a", "b"])
+        # Quotes, backslashes and operators in the query are matched literally
+        self.assertEqual(search("it's"), ["c"])
+        self.assertEqual(search("c:\\path"), ["c"])
+        self.assertEqual(search("E-1234"), ["d"])
+        self.assertEqual(search("foo:bar"), ["d"])
+        self.assertEqual(search("apple & !banana"), ["a", "b"])
+        # Queries without any lexeme match nothing
+        self.assertEqual(search("& | !"), [])
+        self.assertEqual(search(""), [])
+
+        rows = keyword_search(self.conn, BOT_ID, "banana", [0.0, 0.0], 10)
+        self.assertEqual(list(rows[0][:3]), ["b", "banana bread", "s3://b"])
+        self.assertAlmostEqual(rows[0][3], 1.0)
+        self.assertEqual(len(rows[0]), 4)
+        # The embedding column is only selected on request
+        rows = keyword_search(
+            self.conn, BOT_ID, "banana", [0.0, 0.0], 10, with_embeddings=True
+        )
+        self.assertEqual(parse_vector(rows[0][4]).tolist(), [1.0, 0.0])
+
+    def _assert_search_many(self):
+        self._insert(
+            BOT_ID,
+            [
+                ("a", "a", [0.0, 0.0]),
+                ("b", "b", [1.0, 0.0]),
+                ("c", "c", [0.0, 2.0]),
+            ],
+        )
+        self._insert(OTHER_BOT_ID, [("x", "x", [1.0, 0.0])])
+
+        embeddings = [[0.0, 2.0], [1.0, 0.0], [0.0, 0.0]]
+        results = search_many(self.conn, BOT_ID, embeddings, 2)
+        # Rows are returned in the order of the embeddings, each ordered by distance
+        self.assertEqual(
+            [[r[0] for r in rows] for rows in results],
+            [["c", "a"], ["b", "a"], ["a", "b"]],
+        )
+        self.assertEqual(list(results[0][0]), ["c", "c", "s3://c", 0.0])
+        # Same as searching one by one
+        for embedding, rows in zip(embeddings, results):
+            self.assertEqual(
+                [list(r) for r in rows],
+                [list(r) for r in search(self.conn, BOT_ID, embedding, 2)],
+            )
+        self.assertEqual(search_many(self.conn, BOT_ID, [], 2), [])
+
+    def test_search_many_exact(self):
+        self._assert_search_many()
+
+    def test_search_many_indexed(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX {compose_index_name(BOT_ID)} ON items "
+                f"USING hnsw (embedding vector_l2_ops) WHERE botid = '{BOT_ID}'"
+            )
+        self._assert_search_many()
+        self.assertTrue(postgres.has_bot_index(self.conn, BOT_ID))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,32 @@
+import os
 import sys
+import tempfile
 import unittest
+from unittest.mock import patch
 
 sys.path.append(".")
 
-from app.vector_search import SearchResult, filter_used_results
+import numpy as np
+from app.vector_search import (
+    SearchResult,
+    compose_retrieval_cache_key,
+    distance_to_similarity,
+    filter_used_results,
+    get_source_links,
+    get_vector_store,
+    in_process_vector_store,
+    is_search_available,
+    maximal_marginal_relevance,
+    postgres_vector_store,
+    search_related_docs,
+    search_related_docs_many,
+)
+from app.repositories.models.custom_bot import SearchParamsModel
+from app.vector_stores import in_process
+from app.vector_stores.base import fuse_rankings
+from app.vector_stores.in_process import InProcessVectorStore
+from app.vector_stores.postgres import compose_index_name
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
 
 
 class TestVectorSearch(unittest.TestCase):
@@ -47,6 +70,219 @@ class TestVectorSearch(unittest.TestCase):
         used_results = filter_used_results(generated_text, search_results)
         self.assertEqual(len(used_results), 0)
 
+    def test_get_source_links(self):
+        sources = [
+            "s3://bucket/docs/a.pdf",
+            "https://example.com",
+            "s3://bucket/docs/a.pdf",
+            "dQw4w9WgXcQ",
+        ]
+        with patch(
+            "app.vector_search.generate_presigned_urls",
+            return_value={("bucket", "docs/a.pdf"): "https://signed"},
+        ) as generate_presigned_urls:
+            links = get_source_links(sources)
+        generate_presigned_urls.assert_called_once()
+        self.assertEqual(
+            links,
+            [
+                ("s3", "https://signed"),
+                ("url", "https://example.com"),
+                ("s3", "https://signed"),
+                ("url", "https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+            ],
+        )
+
+    def test_maximal_marginal_relevance(self):
+        query = np.array([1.0, 0.0])
+        embeddings = np.array(
+            [
+                [1.0, 0.1],
+                # Near-duplicate of the first one
+                [1.0, 0.11],
+                [0.7, -0.7],
+            ]
+        )
+        self.assertEqual(
+            maximal_marginal_relevance(query, embeddings, limit=2, lambda_mult=0.5),
+            [0, 2],
+        )
+        # Relevance only
+        self.assertEqual(
+            maximal_marginal_relevance(query, embeddings, limit=2, lambda_mult=1.0),
+            [0, 1],
+        )
+        self.assertEqual(maximal_marginal_relevance(query, embeddings[:0], 2), [])
+
+    def test_distance_to_similarity(self):
+        self.assertAlmostEqual(distance_to_similarity(0.0), 1.0)
+        # Orthogonal unit vectors
+        self.assertAlmostEqual(distance_to_similarity(2**0.5), 0.0)
+
+    def test_compose_retrieval_cache_key(self):
+        bot = create_test_private_bot("bot1", False, "user1", sync_status="SUCCEEDED")
+        key = compose_retrieval_cache_key(bot, "What is  Bedrock?")
+        self.assertEqual(key, compose_retrieval_cache_key(bot, " What is Bedrock? "))
+        self.assertNotEqual(key, compose_retrieval_cache_key(bot, "What is S3?"))
+
+        # Invalidated by the next sync
+        bot.sync_last_exec_id = "exec2"
+        self.assertNotEqual(key, compose_retrieval_cache_key(bot, "What is Bedrock?"))
+
+
+class TestVectorStore(unittest.TestCase):
+    def test_compose_index_name(self):
+        self.assertEqual(
+            compose_index_name("01HXYZABCDEFGHJKMNPQRSTVWX"),
+            "idx_items_embedding_01hxyzabcdefghjkmnpqrstvwx",
+        )
+        # Bot ids are inlined into SQL
+        with self.assertRaises(ValueError):
+            compose_index_name("bot'; DROP TABLE items; --")
+
+    def test_fuse_rankings(self):
+        vector = [("a", "content_a"), ("b", "content_b"), ("c", "content_c")]
+        keyword = [("d", "content_d"), ("c", "content_c")]
+
+        fused = fuse_rankings([vector, keyword], [1.0, 1.0], limit=3)
+        # `c` is found by both rankings
+        self.assertEqual([r[0] for r in fused], ["c", "a", "d"])
+
+        # Keyword search only
+        fused = fuse_rankings([vector, keyword], [0.0, 1.0], limit=2)
+        self.assertEqual([r[0] for r in fused], ["d", "c"])
+
+
+class TestInProcessVectorStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = patch.object(in_process, "VECTOR_SNAPSHOT_DIR", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache_directory = os.path.join(self.directory.name, "cache")
+        patcher = patch.object(in_process, "SNAPSHOT_CACHE_DIR", self.cache_directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(in_process._snapshot_cache.clear)
+
+        in_process.store_snapshot(
+            "bot1",
+            ["a", "b", "c"],
+            ["apple pie", "banana bread", "Apple apple cider"],
+            ["source_a", "source_b", "source_c"],
+            [[1.0, 0.0], [0.0, 1.0], [0.6, 0.8]],
+        )
+        self.store = InProcessVectorStore()
+
+    def test_search(self):
+        results = self.store.search("bot1", [1.0, 0.0], limit=2)
+        self.assertEqual([r[0] for r in results], ["a", "c"])
+        self.assertEqual(results[0][1:3], ("apple pie", "source_a"))
+        self.assertAlmostEqual(results[0][3], 0.0, places=5)
+        self.assertAlmostEqual(results[1][3], 0.8**0.5, places=5)
+
+        self.assertEqual(len(self.store.search("bot1", [1.0, 0.0], limit=10)), 3)
+
+    def test_keyword_search(self):
+        results = self.store.keyword_search("bot1", "APPLE tart", [0.0, 1.0], limit=5)
+        # Ranked by the number of occurrences
+        self.assertEqual([r[0] for r in results], ["c", "a"])
+        self.assertAlmostEqual(results[1][3], 2**0.5, places=5)
+
+    def test_search_many(self):
+        results = self.store.search_many("bot1", [[1.0, 0.0], [0.0, 1.0]], limit=2)
+        self.assertEqual(
+            [[r[0] for r in rs] for rs in results], [["a", "c"], ["b", "c"]]
+        )
+        # Same as searching one by one
+        self.assertEqual(results[1], self.store.search("bot1", [0.0, 1.0], limit=2))
+        self.assertEqual(self.store.search_many("bot1", [], limit=2), [])
+
+    def test_search_related_docs_many(self):
+        with patch(
+            "app.vector_search.calculate_query_embeddings",
+            return_value=[[1.0, 0.0], [0.0, 1.0]],
+        ) as calculate_query_embeddings:
+            results = search_related_docs_many("bot1", ["apple", "banana"], limit=2)
+        calculate_query_embeddings.assert_called_once_with(["apple", "banana"])
+        # `c` is found by both queries, and returned only once
+        self.assertEqual(
+            [r.content for r in results], ["Apple apple cider", "apple pie"]
+        )
+        self.assertEqual([r.rank for r in results], [0, 1])
+
+    def test_search_with_embeddings(self):
+        results = self.store.search("bot1", [0.0, 1.0], limit=2, with_embeddings=True)
+        self.assertEqual([r[0] for r in results], ["b", "c"])
+        np.testing.assert_allclose(results[0][4], [0.0, 1.0])
+        np.testing.assert_allclose(results[1][4], [0.6, 0.8])
+
+        results = self.store.hybrid_search(
+            "bot1", "apple", [0.0, 1.0], limit=3, with_embeddings=True
+        )
+        self.assertEqual({r[0]: len(r) for r in results}, {"a": 5, "b": 5, "c": 5})
+
+    def test_search_related_docs_with_mmr(self):
+        search_params = SearchParamsModel(
+            max_results=2, enable_mmr=True, mmr_lambda=0.3
+        )
+        with patch(
+            "app.vector_search.calculate_query_embedding", return_value=[0.6, 0.8]
+        ):
+            results = search_related_docs(
+                "bot1", limit=2, query="apple", search_params=search_params
+            )
+        # `b` is close to `c`, so `a` is selected for diversity
+        self.assertEqual(
+            [r.content for r in results], ["Apple apple cider", "apple pie"]
+        )
+
+    def test_load_snapshot(self):
+        # A single file per snapshot, and no temporary file is left
+        self.assertEqual(os.listdir(self.directory.name), ["bot1.npz"])
+        snapshot = in_process.load_snapshot("bot1")
+        # The embeddings are memory-mapped, and their file is removed once mapped
+        self.assertIsInstance(snapshot.embeddings, np.memmap)
+        np.testing.assert_allclose(snapshot.embeddings[2], [0.6, 0.8])
+        self.assertEqual(os.listdir(self.cache_directory), [])
+        self.assertIsNone(in_process.load_snapshot("bot2"))
+        with self.assertRaises(ValueError):
+            self.store.search("bot2", [1.0, 0.0], limit=1)
+
+    def test_is_search_available(self):
+        with patch("app.vector_search.is_running_on_lambda", return_value=False):
+            # Locally, bots without a snapshot are not searched
+            self.assertTrue(is_search_available("bot1"))
+            self.assertFalse(is_search_available("bot2"))
+        with patch("app.vector_search.is_running_on_lambda", return_value=True):
+            self.assertTrue(is_search_available("bot2"))
+
+    def test_get_vector_store(self):
+        self.assertIs(get_vector_store("bot1"), in_process_vector_store)
+        self.assertIs(get_vector_store("bot1", True), in_process_vector_store)
+        self.assertIs(get_vector_store("bot2"), postgres_vector_store)
+        # Bots recorded without a snapshot are not looked up
+        with patch.object(in_process, "load_snapshot") as load_snapshot:
+            self.assertIs(get_vector_store("bot1", False), postgres_vector_store)
+            with patch("app.vector_search.is_running_on_lambda", return_value=False):
+                self.assertFalse(is_search_available("bot1", False))
+        load_snapshot.assert_not_called()
+
+    def test_update_snapshot(self):
+        # Large bots are searched on PostgreSQL
+        with patch.object(in_process, "IN_PROCESS_MAX_ITEMS", 1):
+            self.assertFalse(
+                in_process.update_snapshot(
+                    "bot1", ["a", "b"], ["a", "b"], ["a", "b"], [[1.0], [2.0]]
+                )
+            )
+        self.assertIsNone(in_process.load_snapshot("bot1"))
+        self.assertTrue(
+            in_process.update_snapshot("bot1", ["a"], ["a"], ["a"], [[1.0]])
+        )
+        self.assertIsNotNone(in_process.load_snapshot("bot1"))
+
 
 if __name__ == "__main__":
     unittest.main()
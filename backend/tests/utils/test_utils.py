@@ -1,6 +1,8 @@
 import logging
+import os
 import sys
 import unittest
+from unittest.mock import patch
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
@@ -39,6 +41,60 @@ class TestUtils(unittest.TestCase):
 
         assert reg == "us-west-2"
 
+    def test_generate_presigned_urls(self):
+        from app.utils import generate_presigned_url, generate_presigned_urls
+
+        objects = [("bucket", "a.pdf"), ("bucket", "b.pdf"), ("bucket", "a.pdf")]
+        urls = generate_presigned_urls(objects)
+        # Identical objects are signed once
+        self.assertEqual(list(urls), [("bucket", "a.pdf"), ("bucket", "b.pdf")])
+        # Memoized until shortly before expiry
+        self.assertEqual(
+            generate_presigned_url("bucket", "a.pdf", client_method="get_object"),
+            urls[("bucket", "a.pdf")],
+        )
+        # Upload URLs are not shared with downloads
+        self.assertNotEqual(
+            generate_presigned_url("bucket", "a.pdf"), urls[("bucket", "a.pdf")]
+        )
+
+    def test_presigned_urls_memoized_with_lambda_credentials(self):
+        import app.utils
+        import boto3
+        from app.utils import generate_presigned_url, presigned_url_cache
+
+        # Temporary credentials of unknown expiry, like on Lambda
+        environ = {
+            "AWS_EXECUTION_ENV": "AWS_Lambda_python3.11",
+            "AWS_ACCESS_KEY_ID": "key",
+            "AWS_SECRET_ACCESS_KEY": "secret",
+            "AWS_SESSION_TOKEN": "token",
+        }
+        presigned_url_cache.clear()
+        # NOTE: The default session caches the credentials it resolved.
+        with patch.dict(os.environ, environ), patch.object(
+            boto3, "DEFAULT_SESSION", None
+        ), patch.object(app.utils, "_signing_client", None), patch.object(
+            presigned_url_cache, "set"
+        ) as set_url:
+            url = generate_presigned_url("bucket", "a.pdf", client_method="get_object")
+            self.assertIn("X-Amz-Security-Token=token", url)
+            # Memoized for a few minutes only
+            set_url.assert_called_once_with(("bucket", "a.pdf", 3600), url, ttl=300)
+
+            set_url.reset_mock()
+            url = generate_presigned_url(
+                "bucket", "a.pdf", expiration=400, client_method="get_object"
+            )
+            # Never until shortly before the URL expires
+            set_url.assert_called_once_with(("bucket", "a.pdf", 400), url, ttl=100)
+
+            set_url.reset_mock()
+            generate_presigned_url(
+                "bucket", "a.pdf", expiration=300, client_method="get_object"
+            )
+            set_url.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -37,6 +37,8 @@ const AUTO_JOIN_USER_GROUPS: string[] = app.node.tryGetContext(
 const RDS_SCHEDULES: CronScheduleProps = app.node.tryGetContext("rdbSchedules");
 const ENABLE_MISTRAL: boolean = app.node.tryGetContext("enableMistral");
 const SELF_SIGN_UP_ENABLED: boolean = app.node.tryGetContext("selfSignUpEnabled");
+// Query bots through the sparse bot indexes. See docs/migration/BOT_INDEX_MIGRATION.md
+const ENABLE_BOT_INDEXES: boolean = app.node.tryGetContext("enableBotIndexes");
 
 // container size of embedding ecs tasks
 const EMBEDDING_CONTAINER_VCPU:number = app.node.tryGetContext("embeddingContainerVcpu")
@@ -76,5 +78,6 @@ const chat = new BedrockChatStack(app, `BedrockChatStack`, {
   embeddingContainerVcpu: EMBEDDING_CONTAINER_VCPU,
   embeddingContainerMemory: EMBEDDING_CONTAINER_MEMORY,
   selfSignUpEnabled: SELF_SIGN_UP_ENABLED,
+  enableBotIndexes: ENABLE_BOT_INDEXES,
 });
 chat.addDependency(waf);
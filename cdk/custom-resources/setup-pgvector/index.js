@@ -19,14 +19,14 @@ const setUp = async (dbConfig) => {
                          botid CHAR(26),
                          content text,
                          source text,
-                         embedding vector(1024));`);
-    // `lists` parameter controls the nubmer of clusters created during index building.
-    // Also it's important to choose the same index method as the one used in the query.
-    // Here we use L2 distance for the index method.
-    // See: https://txt.cohere.com/introducing-embed-v3/
-    await client.query(`CREATE INDEX idx_items_embedding ON items 
-                         USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);`);
+                         embedding vector(1024),
+                         tsv tsvector);`);
+    // NOTE: There is no ANN index over all bots. Each large bot gets its own partial HNSW
+    // index after embedding, and smaller bots are searched exactly using the botid index.
+    // See: backend/app/vector_stores/postgres.py
     await client.query(`CREATE INDEX idx_items_botid ON items (botid);`);
+    // Full-text search for the hybrid search
+    await client.query(`CREATE INDEX idx_items_tsv ON items USING gin (tsv);`);
 
     console.log("SQL execution successful.");
   } catch (err) {
@@ -1,4 +1,4 @@
-import { CfnOutput, RemovalPolicy, StackProps } from "aws-cdk-lib";
+import { CfnOutput, Duration, RemovalPolicy, StackProps } from "aws-cdk-lib";
 import {
   BlockPublicAccess,
   Bucket,
@@ -37,6 +37,7 @@ export interface BedrockChatStackProps extends StackProps {
   readonly embeddingContainerVcpu: number;
   readonly embeddingContainerMemory: number;
   readonly selfSignUpEnabled: boolean;
+  readonly enableBotIndexes?: boolean;
 }
 
 export class BedrockChatStack extends cdk.Stack {
@@ -113,9 +114,28 @@ export class BedrockChatStack extends cdk.Stack {
       serverAccessLogsPrefix: "LargeMessageBucket",
     });
 
+    // Embeddings of search queries shared by the API and WebSocket handlers.
+    // Objects are only a cache, so they are expired to bound the storage.
+    const queryEmbeddingCacheBucket = new Bucket(
+      this,
+      "QueryEmbeddingCacheBucket",
+      {
+        encryption: BucketEncryption.S3_MANAGED,
+        blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
+        enforceSSL: true,
+        removalPolicy: RemovalPolicy.DESTROY,
+        objectOwnership: ObjectOwnership.OBJECT_WRITER,
+        autoDeleteObjects: true,
+        serverAccessLogsBucket: accessLogBucket,
+        serverAccessLogsPrefix: "QueryEmbeddingCacheBucket",
+        lifecycleRules: [{ expiration: Duration.days(7) }],
+      }
+    );
+
     const database = new Database(this, "Database", {
       // Enable PITR to export data to s3
       pointInTimeRecovery: true,
+      enableBotIndexes: props.enableBotIndexes,
     });
 
     const usageAnalysis = new UsageAnalysis(this, "UsageAnalysis", {
@@ -134,7 +154,9 @@ export class BedrockChatStack extends cdk.Stack {
       apiPublishProject: apiPublishCodebuild.project,
       usageAnalysis,
       largeMessageBucket,
+      queryEmbeddingCacheBucket,
       enableMistral: props.enableMistral,
+      enableBotIndexes: props.enableBotIndexes ?? false,
     });
     documentBucket.grantReadWrite(backendApi.handler);
 
@@ -149,6 +171,7 @@ export class BedrockChatStack extends cdk.Stack {
       auth,
       bedrockRegion: props.bedrockRegion,
       largeMessageBucket,
+      queryEmbeddingCacheBucket,
       documentBucket,
     });
     frontend.buildViteApp({
@@ -178,6 +201,11 @@ export class BedrockChatStack extends cdk.Stack {
       embeddingContainerMemory: props.embeddingContainerMemory,
     });
     documentBucket.grantRead(embedding.container.taskDefinition.taskRole);
+    // Snapshots of small bots for the in-process vector store
+    documentBucket.grantReadWrite(
+      embedding.container.taskDefinition.taskRole,
+      "vector-snapshots/*"
+    );
 
     vectorStore.allowFrom(embedding.taskSecurityGroup);
     vectorStore.allowFrom(embedding.removalHandler);
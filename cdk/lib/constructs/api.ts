@@ -33,9 +33,11 @@ export interface ApiProps {
   readonly tableAccessRole: iam.IRole;
   readonly documentBucket: IBucket;
   readonly largeMessageBucket: IBucket;
+  readonly queryEmbeddingCacheBucket: IBucket;
   readonly apiPublishProject: codebuild.IProject;
   readonly usageAnalysis?: UsageAnalysis;
   readonly enableMistral: boolean;
+  readonly enableBotIndexes: boolean;
 }
 
 export class Api extends Construct {
@@ -164,6 +166,7 @@ export class Api extends Construct {
     props.usageAnalysis?.resultOutputBucket.grantReadWrite(handlerRole);
     props.usageAnalysis?.ddbBucket.grantRead(handlerRole);
     props.largeMessageBucket.grantReadWrite(handlerRole);
+    props.queryEmbeddingCacheBucket.grantReadWrite(handlerRole);
 
     const handler = new DockerImageFunction(this, "Handler", {
       code: DockerImageCode.fromImageAsset(
@@ -188,7 +191,10 @@ export class Api extends Construct {
         TABLE_ACCESS_ROLE_ARN: tableAccessRole.roleArn,
         DB_SECRETS_ARN: props.dbSecrets.secretArn,
         DOCUMENT_BUCKET: props.documentBucket.bucketName,
+        VECTOR_SNAPSHOT_BUCKET: props.documentBucket.bucketName,
         LARGE_MESSAGE_BUCKET: props.largeMessageBucket.bucketName,
+        QUERY_EMBEDDING_CACHE_BUCKET:
+          props.queryEmbeddingCacheBucket.bucketName,
         PUBLISH_API_CODEBUILD_PROJECT_NAME: props.apiPublishProject.projectName,
         USAGE_ANALYSIS_DATABASE:
           props.usageAnalysis?.database.databaseName || "",
@@ -197,6 +203,7 @@ export class Api extends Construct {
         USAGE_ANALYSIS_WORKGROUP: props.usageAnalysis?.workgroupName || "",
         USAGE_ANALYSIS_OUTPUT_LOCATION: usageAnalysisOutputLocation,
         ENABLE_MISTRAL: props.enableMistral.toString(),
+        ENABLE_BOT_INDEXES: props.enableBotIndexes.toString(),
       },
       role: handlerRole,
     });
@@ -215,6 +222,7 @@ export class Api extends Construct {
           CorsHttpMethod.DELETE,
         ],
         allowOrigins: allowOrigins,
+        exposeHeaders: ["X-Next-Token"],
         maxAge: Duration.days(10),
       },
     });
@@ -2,6 +2,7 @@ import { CfnOutput, RemovalPolicy, Stack } from "aws-cdk-lib";
 import {
   AttributeType,
   BillingMode,
+  ProjectionType,
   Table,
   TableEncryption,
   StreamViewType,
@@ -11,6 +12,10 @@ import { Construct } from "constructs";
 
 export interface DatabaseProps {
   pointInTimeRecovery?: boolean;
+  // Creates `PublishedBotIndex` and lets the backend query the bot indexes.
+  // CloudFormation can create only one global secondary index per table update,
+  // so `OwnedBotIndex` is created first and this index on the next deployment.
+  enableBotIndexes?: boolean;
 }
 
 export class Database extends Construct {
@@ -31,6 +36,8 @@ export class Database extends Construct {
       stream: StreamViewType.NEW_IMAGE,
       pointInTimeRecovery: props?.pointInTimeRecovery,
       encryption: TableEncryption.AWS_MANAGED,
+      // Used to expire cached items (e.g. retrieval results)
+      timeToLiveAttribute: "ExpireTime",
     });
     table.addGlobalSecondaryIndex({
       // Used to fetch conversation or bot by id
@@ -44,6 +51,47 @@ export class Database extends Construct {
       // TODO: add `nonKeyAttributes` for efficiency
       // For now we project all attributes to keep future compatibility
     });
+    table.addGlobalSecondaryIndex({
+      // Used to fetch bots owned by a user, sorted by bot used time.
+      // Sparse: alias bots don't have the partition key attribute.
+      indexName: "OwnedBotIndex",
+      partitionKey: { name: "OwnedBotUserId", type: AttributeType.STRING },
+      sortKey: { name: "LastBotUsed", type: AttributeType.NUMBER },
+      projectionType: ProjectionType.INCLUDE,
+      nonKeyAttributes: [
+        "Title",
+        "Description",
+        "CreateTime",
+        "IsPinned",
+        "PublicBotId",
+        "SyncStatus",
+      ],
+    });
+    if (props?.enableBotIndexes) {
+      table.addGlobalSecondaryIndex({
+        // Used to fetch published bots (administrator use).
+        // Sparse: public bots have the constant partition key, and only
+        // published bots have the sort key, so it is queried without a filter.
+        indexName: "PublishedBotIndex",
+        partitionKey: {
+          name: "PublishedBotPartition",
+          type: AttributeType.STRING,
+        },
+        sortKey: { name: "PublishedBotId", type: AttributeType.STRING },
+        projectionType: ProjectionType.INCLUDE,
+        nonKeyAttributes: [
+          "Title",
+          "Description",
+          "CreateTime",
+          "LastBotUsed",
+          "IsPinned",
+          "PublicBotId",
+          "SyncStatus",
+          "ApiPublishmentStackName",
+          "ApiPublishedDatetime",
+        ],
+      });
+    }
     table.addLocalSecondaryIndex({
       // Used to fetch all bots for a user. Sorted by bot used time
       indexName: "LastBotUsedIndex",
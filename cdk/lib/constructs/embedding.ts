@@ -95,6 +95,7 @@ export class Embedding extends Construct {
         TABLE_NAME: props.database.tableName,
         TABLE_ACCESS_ROLE_ARN: props.tableAccessRole.roleArn,
         DOCUMENT_BUCKET: props.documentBucket.bucketName,
+        VECTOR_SNAPSHOT_BUCKET: props.documentBucket.bucketName,
       },
     });
     taskLogGroup.grantWrite(container.taskDefinition.executionRole!);
@@ -256,6 +257,7 @@ export class Embedding extends Construct {
       environment: {
         DB_SECRETS_ARN: props.dbSecrets.secretArn,
         DOCUMENT_BUCKET: props.documentBucket.bucketName,
+        VECTOR_SNAPSHOT_BUCKET: props.documentBucket.bucketName,
       },
       role: removeHandlerRole,
     });
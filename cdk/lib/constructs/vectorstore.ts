@@ -43,7 +43,7 @@ export class VectorStore extends Construct {
     });
     const cluster = new rds.DatabaseCluster(this, "Cluster", {
       engine: rds.DatabaseClusterEngine.auroraPostgres({
-        version: rds.AuroraPostgresEngineVersion.VER_15_3,
+        version: rds.AuroraPostgresEngineVersion.VER_15_5,
       }),
       vpc: props.vpc,
       securityGroups: [sg],
@@ -30,6 +30,7 @@ export interface WebSocketProps {
   readonly documentBucket: s3.IBucket;
   readonly websocketSessionTable: ITable;
   readonly largeMessageBucket: s3.IBucket;
+  readonly queryEmbeddingCacheBucket: s3.IBucket;
   readonly accessLogBucket?: s3.Bucket;
 }
 
@@ -84,6 +85,7 @@ export class WebSocket extends Construct {
     largePayloadSupportBucket.grantRead(handlerRole);
     props.websocketSessionTable.grantReadWriteData(handlerRole);
     props.largeMessageBucket.grantReadWrite(handlerRole);
+    props.queryEmbeddingCacheBucket.grantReadWrite(handlerRole);
     props.documentBucket.grantRead(handlerRole);
 
     const handler = new DockerImageFunction(this, "Handler", {
@@ -107,7 +109,10 @@ export class WebSocket extends Construct {
         TABLE_NAME: database.tableName,
         TABLE_ACCESS_ROLE_ARN: tableAccessRole.roleArn,
         LARGE_MESSAGE_BUCKET: props.largeMessageBucket.bucketName,
+        QUERY_EMBEDDING_CACHE_BUCKET:
+          props.queryEmbeddingCacheBucket.bucketName,
         DB_SECRETS_ARN: props.dbSecrets.secretArn,
+        VECTOR_SNAPSHOT_BUCKET: props.documentBucket.bucketName,
         LARGE_PAYLOAD_SUPPORT_BUCKET: largePayloadSupportBucket.bucketName,
         WEBSOCKET_SESSION_TABLE_NAME: props.websocketSessionTable.tableName,
       },
@@ -0,0 +1,48 @@
+import boto3
+
+# Open the CloudFormation stack in the AWS Management Console and copy the values from the Outputs tab.
+# Key: DatabaseConversationTableNameXXXX
+TABLE_NAME = "BedrockChatStack-DatabaseConversationTableXXXXX"
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(TABLE_NAME)
+
+# Bot items only. Aliases (`#BOT_ALIAS#`) must not be indexed by `OwnedBotIndex`.
+scan_kwargs = {
+    "FilterExpression": "contains(SK, :substring)",
+    "ExpressionAttributeValues": {":substring": "#BOT#"},
+    "ProjectionExpression": "PK, SK, ApiPublishmentStackName, PublicBotId",
+}
+
+count = 0
+while True:
+    response = table.scan(**scan_kwargs)
+
+    for item in response["Items"]:
+        pk = item["PK"]
+        sk = item["SK"]
+        bot_id = sk.split("#")[-1]
+
+        update_expression = "SET OwnedBotUserId = :user_id"
+        values = {":user_id": pk}
+        if item.get("ApiPublishmentStackName"):
+            update_expression += ", PublishedBotId = :bot_id"
+            values[":bot_id"] = bot_id
+        if "PublicBotId" in item:
+            # Constant partition key of `PublishedBotIndex`
+            update_expression += ", PublishedBotPartition = :partition"
+            values[":partition"] = "PUBLISHED"
+
+        table.update_item(
+            Key={"PK": pk, "SK": sk},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=values,
+        )
+        count += 1
+        print(f"  - Updated {sk}")
+
+    if "LastEvaluatedKey" not in response:
+        break
+    scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+print(f"{count} bots have been updated.")
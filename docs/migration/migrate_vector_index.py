@@ -0,0 +1,55 @@
+import boto3
+
+# Open the RDS console and copy the ARN of the cluster (BedrockChatStack-VectorStoreClusterXXXXX).
+CLUSTER_ARN = "arn:aws:rds:us-east-1:123456789012:cluster:bedrockchatstack-vectorstoreclusterxxxxx"
+# Open the Secrets Manager console and copy the ARN of the secret of the cluster.
+SECRET_ARN = (
+    "arn:aws:secretsmanager:us-east-1:123456789012:secret:VectorStoreClusterSecretXXXXX"
+)
+DATABASE = "postgres"
+# Bots with at least this many items get their own index.
+# Must be the same as `VECTOR_INDEX_MIN_ROWS` of the backend.
+MIN_ROWS = 5000
+
+client = boto3.client("rds-data")
+
+
+def execute(sql: str) -> list:
+    # NOTE: Each statement is committed on its own, which is required by `CONCURRENTLY`.
+    response = client.execute_statement(
+        resourceArn=CLUSTER_ARN,
+        secretArn=SECRET_ARN,
+        database=DATABASE,
+        sql=sql,
+        continueAfterTimeout=True,
+    )
+    return response.get("records", [])
+
+
+# HNSW requires pgvector 0.5.0 or later
+execute("ALTER EXTENSION vector UPDATE")
+
+# Full-text search column for the hybrid search. Must be the same as `TEXT_SEARCH_CONFIG`.
+execute("ALTER TABLE items ADD COLUMN IF NOT EXISTS tsv tsvector")
+execute("UPDATE items SET tsv = to_tsvector('simple', content) WHERE tsv IS NULL")
+execute(
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_items_tsv ON items USING gin (tsv)"
+)
+
+records = execute(
+    f"SELECT botid, count(*) FROM items GROUP BY botid HAVING count(*) >= {MIN_ROWS}"
+)
+print(f"Creating indexes for {len(records)} bots")
+for record in records:
+    bot_id = record[0]["stringValue"].strip()
+    index_name = f"idx_items_embedding_{bot_id.lower()}"
+    execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON items "
+        f"USING hnsw (embedding vector_l2_ops) WHERE botid = '{bot_id}'"
+    )
+    print(f"  - Created {index_name} ({record[1]['longValue']} items)")
+
+# The global index is no longer used by the search
+execute("DROP INDEX CONCURRENTLY IF EXISTS idx_items_embedding")
+execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_items_botid ON items (botid)")
+print("Done.")
@@ -55,6 +55,12 @@ export type GenerationParams = {
 
 export type SearchParams = {
   maxResults: number;
+  searchMode?: 'vector' | 'hybrid';
+  vectorWeight?: number;
+  keywordWeight?: number;
+  enableMmr?: boolean;
+  mmrLambda?: number;
+  minSimilarity?: number | null;
 };
 
 export type BotDetails = BotMeta & {